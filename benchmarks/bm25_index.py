@@ -0,0 +1,122 @@
+"""Memory and search latency of the BM25 index against the baseline model, on a synthetic Zipf corpus.
+
+The baseline model kept the tokenized documents, one dict of term counts per
+document and an idf dict; they are rebuilt from the same Tokenizer output the way
+its fit did, and their Python heap size is measured with tracemalloc. Baseline
+search scored every document in Python, so it is timed on a few queries only.
+
+    python benchmarks/bm25_index.py --n-docs 200000
+"""
+import argparse
+import time
+import tracemalloc
+from collections import Counter
+import numpy as np
+from nlp_toolkit.keywords import BM25Model, Tokenizer
+
+
+def make_words(n:int) -> list:
+    # the tokenizer strips digits, so words are numbered in letters
+    return ["word" + str(i).translate(str.maketrans("0123456789", "abcdefghij")) for i in range(n)]
+
+
+def make_texts(words:list, n:int, rng:np.random.Generator, min_len:int, max_len:int) -> list:
+    weights = 1 / np.arange(1, len(words) + 1)
+    lengths = rng.integers(min_len, max_len, n)
+    tokens = rng.choice(words, size = int(lengths.sum()), p = weights / weights.sum())
+    return [" ".join(doc) for doc in np.split(tokens, np.cumsum(lengths)[:-1])]
+
+
+def best_of(repeats:int, fn) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def traced(fn):
+    """(result, bytes allocated by fn and still alive)"""
+    tracemalloc.start()
+    result = fn()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, allocated
+
+
+def baseline_word_counts(tokenized_documents:list):
+    """document_word_counts and idf_dict as the baseline fit built them"""
+    document_word_counts = [dict(Counter(tokenized_doc)) for tokenized_doc in tokenized_documents]
+    idf_dict = {}
+    for tokenized_doc in tokenized_documents:
+        for word in set(tokenized_doc):
+            idf_dict[word] = idf_dict.get(word, 0) + 1
+    for word, doc_count in idf_dict.items():
+        idf_dict[word] = np.log((len(tokenized_documents) - doc_count + 0.5) / (doc_count + 0.5) + 1)
+    return document_word_counts, idf_dict
+
+
+def baseline_search(document_word_counts:list, idf_dict:dict, avg_doc_len:float, tokenized_query:list,
+                    k1:float, b:float, n:int) -> list:
+    """Top n scores of the baseline search, one Python loop over the documents"""
+    scores = []
+    for doc_wc in document_word_counts:
+        score = 0
+        for word in tokenized_query:
+            word_cnt = doc_wc.get(word, 0)
+            score += idf_dict.get(word, 0) * (
+                word_cnt * (k1 + 1) / (word_cnt + k1 * (1 - b + b * len(doc_wc) / avg_doc_len)))
+        scores.append(score)
+    return np.sort(scores)[::-1][:n].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--n-docs", type = int, default = 200000)
+    parser.add_argument("--vocabulary", type = int, default = 50000)
+    parser.add_argument("--n-queries", type = int, default = 100)
+    parser.add_argument("--n-baseline-queries", type = int, default = 5)
+    parser.add_argument("--repeats", type = int, default = 3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    words = make_words(args.vocabulary)
+    documents = make_texts(words, args.n_docs, rng, 20, 100)
+    queries = make_texts(words, args.n_queries, rng, 2, 6)
+    tokenizer = Tokenizer(offline = True)
+
+    tokenized_documents, tokens_bytes = traced(lambda: tokenizer(documents))
+    (document_word_counts, idf_dict), counts_bytes = traced(lambda: baseline_word_counts(tokenized_documents))
+    avg_doc_len = np.mean([len(doc) for doc in tokenized_documents])
+    del tokenized_documents
+
+    model = BM25Model(k1 = 1.5, b = 0.75, tokenizer = tokenizer)
+    start = time.perf_counter()
+    model.fit(documents)
+    print(f"fit            {time.perf_counter() - start:8.2f} s")
+
+    n_postings = sum(int(segment.indptr[-1] - segment.indptr[0]) for segment in model.segments)
+    index_bytes = sum(segment.nbytes for segment in model.segments)
+    print(f"postings       {n_postings:8d}")
+    print(f"baseline word counts + idf dict   {counts_bytes / 2 ** 20:8.1f} MB "
+          f"({counts_bytes / n_postings:.1f} bytes per posting)")
+    print(f"baseline with tokenized documents {(counts_bytes + tokens_bytes) / 2 ** 20:8.1f} MB "
+          f"({(counts_bytes + tokens_bytes) / n_postings:.1f} bytes per posting)")
+    print(f"compressed index                  {index_bytes / 2 ** 20:8.1f} MB "
+          f"({index_bytes / n_postings:.1f} bytes per posting)")
+
+    baseline_queries = [tokenizer.tokenize_doc(query) for query in queries[:args.n_baseline_queries]]
+    if baseline_queries:
+        elapsed = best_of(1, lambda: [baseline_search(document_word_counts, idf_dict, avg_doc_len, query,
+                                                      model.k1, model.b, 10) for query in baseline_queries])
+        print(f"{'baseline search':<18} {elapsed / len(baseline_queries) * len(queries):8.3f} s "
+              f"for {len(queries)} queries, extrapolated from {len(baseline_queries)}")
+    for name, fn in [("search exhaustive", lambda: [model.search(q, n = 10, exhaustive = True) for q in queries]),
+                     ("search pruned", lambda: [model.search(q, n = 10) for q in queries]),
+                     ("search_batch", lambda: model.search_batch(queries, n = 10))]:
+        print(f"{name:<18} {best_of(args.repeats, fn):8.3f} s for {len(queries)} queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Recall@k and size of the CompactEmbedder options against full float32 embeddings.
+
+Documents and queries are embedded once with the model, or read from a .npy file of
+embeddings, whose first --n-queries rows are the queries. Without either, synthetic
+embeddings are used: a random low-dimensional subspace plus noise. The PCA is fit on
+the documents. Needs torch and transformers with --model:
+
+    python benchmarks/compact_recall.py --model sentence-transformers/all-MiniLM-L6-v2 --texts texts.txt
+    python benchmarks/compact_recall.py --embeddings embeddings.npy --dims 384 256 128
+"""
+import argparse
+import numpy as np
+from nlp_toolkit.embedders.compact import CompactEmbedder, recall_at_k
+
+
+def load_texts(path:str, n:int) -> list:
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip()][:n]
+
+
+def make_embeddings(n:int, dim:int, intrinsic_dim:int, rng:np.random.Generator) -> np.ndarray:
+    basis = rng.standard_normal((intrinsic_dim, dim)).astype(np.float32)
+    return (rng.standard_normal((n, intrinsic_dim), dtype = np.float32) @ basis
+            + 0.3 * rng.standard_normal((n, dim), dtype = np.float32))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--model", help = "SentenceEmbedder checkpoint, needs --texts")
+    parser.add_argument("--texts", help = "file of one text per line")
+    parser.add_argument("--embeddings", help = ".npy file of embeddings, queries first")
+    parser.add_argument("--n", type = int, default = 20_000)
+    parser.add_argument("--dim", type = int, default = 384, help = "of the synthetic embeddings")
+    parser.add_argument("--intrinsic-dim", type = int, default = 48, help = "of the synthetic embeddings")
+    parser.add_argument("--n-queries", type = int, default = 500)
+    parser.add_argument("--k", type = int, default = 10)
+    parser.add_argument("--dims", type = int, nargs = "+", default = [256, 128, 64])
+    args = parser.parse_args()
+
+    if args.model:
+        from nlp_toolkit.embedders.huggingface import SentenceEmbedder
+        if not args.texts:
+            parser.error("--model needs --texts")
+        embeddings = SentenceEmbedder(model_ckpt = args.model)(load_texts(args.texts, args.n))
+    elif args.embeddings:
+        embeddings = np.load(args.embeddings, mmap_mode = "r")[:args.n]
+    else:
+        embeddings = make_embeddings(args.n, args.dim, args.intrinsic_dim, np.random.default_rng(0))
+    embeddings = np.asarray(embeddings, dtype = np.float32)
+    full_queries, full_documents = embeddings[:args.n_queries], embeddings[args.n_queries:]
+    full_dim = embeddings.shape[1]
+    print(f"{len(full_documents)} documents, {len(full_queries)} queries, {full_dim} dimensions")
+
+    # the reference is the full embeddings as CompactEmbedder serves them, normalized
+    reference = CompactEmbedder(None)
+    queries, documents = reference.compress(full_queries), reference.compress(full_documents)
+
+    print(f"{'dtype':<8} {'dim':>5} {'reduction':<10} {'B/vector':>9} {'recall@' + str(args.k):>10}")
+    for dim in [None] + [dim for dim in args.dims if dim < full_dim]:
+        for reduction in (["none"] if dim is None else ["truncate", "pca"]):
+            for dtype in ["float32", "float16", "int8"]:
+                compact = CompactEmbedder(None, dtype = dtype, dim = dim)
+                if reduction == "pca":
+                    compact.fit_pca(embeddings = full_documents)
+                compact_documents = compact.compress(full_documents)
+                recall = recall_at_k(queries, documents, compact.compress(full_queries), compact_documents,
+                                     k = args.k)
+                print(f"{dtype:<8} {dim or full_dim:5d} {reduction:<10} "
+                      f"{compact_documents.nbytes / len(full_documents):9.1f} {recall:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
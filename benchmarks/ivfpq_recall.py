@@ -0,0 +1,71 @@
+"""Recall@k and latency of the IVF-PQ index of LocalVectorStore against its exact scan.
+
+Vectors are synthetic embeddings: a random low-dimensional subspace plus noise.
+
+    python benchmarks/ivfpq_recall.py --n 1000000 --dim 128 --n-lists 1024
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from nlp_toolkit.vectordbs.local import LocalVectorStore
+
+
+def make_vectors(n:int, dim:int, intrinsic_dim:int, rng:np.random.Generator, block_size:int = 100_000) -> np.ndarray:
+    basis = rng.standard_normal((intrinsic_dim, dim)).astype(np.float32)
+    return np.concatenate([
+        rng.standard_normal((min(block_size, n - start), intrinsic_dim), dtype = np.float32) @ basis
+        + 0.3 * rng.standard_normal((min(block_size, n - start), dim), dtype = np.float32)
+        for start in range(0, n, block_size)])
+
+
+def recall(rows:np.ndarray, exact_rows:np.ndarray) -> float:
+    return np.mean([len(np.intersect1d(found, expected)) / len(expected) for found, expected in zip(rows, exact_rows)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--n", type = int, default = 200_000)
+    parser.add_argument("--dim", type = int, default = 128)
+    parser.add_argument("--intrinsic-dim", type = int, default = 24)
+    parser.add_argument("--metric", default = "cosine", choices = ["cosine", "ip", "l2"])
+    parser.add_argument("--n-lists", type = int, default = 512)
+    parser.add_argument("--m", type = int, default = 16)
+    parser.add_argument("--n-queries", type = int, default = 200)
+    parser.add_argument("--k", type = int, default = 10)
+    parser.add_argument("--nprobe", type = int, nargs = "+", default = [1, 4, 16, 64])
+    parser.add_argument("--rerank", type = int, nargs = "+", default = [0, 100])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = make_vectors(args.n + args.n_queries, args.dim, args.intrinsic_dim, rng)
+    vectors, queries = vectors[:args.n], vectors[args.n:]
+
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(path, metric = args.metric)
+        store.add(ids = [str(i) for i in range(args.n)], embeddings = vectors)
+
+        start = time.perf_counter()
+        exact_rows, _ = store.search(queries, n_results = args.k, exact = True)
+        print(f"exact scan: {1000 * (time.perf_counter() - start) / len(queries):.2f} ms/query")
+
+        start = time.perf_counter()
+        index = store.build_index(n_lists = args.n_lists, m = args.m)
+        print(f"index: {index.nbytes / args.n:.1f} B/vector vs {4 * args.dim} B for float32, "
+              f"build {time.perf_counter() - start:.1f} s")
+
+        print(f"recall@{args.k}, ms/query")
+        print("nprobe" + "".join(f"  {'rerank=' + str(rerank):<15}" for rerank in args.rerank))
+        for nprobe in args.nprobe:
+            line = f"{nprobe:6d}"
+            for rerank in args.rerank:
+                store.nprobe, store.rerank = nprobe, rerank
+                start = time.perf_counter()
+                rows, _ = store.search(queries, n_results = args.k)
+                elapsed = 1000 * (time.perf_counter() - start) / len(queries)
+                line += f"  {recall(rows, exact_rows):.3f} {elapsed:6.2f} ms"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Latency and accuracy of the onnx backends of SentenceEmbedder against the torch one, on cpu.
+
+Needs torch, transformers, onnx and onnxruntime:
+
+    python benchmarks/onnx_backend.py --model sentence-transformers/all-MiniLM-L6-v2 --texts texts.txt
+"""
+import argparse
+import random
+from nlp_toolkit.embedders.huggingface import compare_backends
+
+WORDS = ("music song note company game strategy mobile galaxy order play sound feeling people "
+         "create compose listen simple combination produce several today introduce").split()
+
+
+def sample_texts(n:int, seed:int = 0) -> list:
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k = rng.randint(5, 60))) for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--model", default = "sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--texts", help = "file of one text per line, random word sequences if not given")
+    parser.add_argument("--n-texts", type = int, default = 2000)
+    parser.add_argument("--n-queries", type = int, default = 100)
+    parser.add_argument("--batch-size", type = int, default = 32)
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts, "r") as f:
+            texts = [line.strip() for line in f if line.strip()][:args.n_texts]
+    else:
+        texts = sample_texts(args.n_texts)
+    report = compare_backends(texts, model_ckpt = args.model, batch_size = args.batch_size, n_queries = args.n_queries)
+
+    print(f"{'backend':<10} {'query ms':>9} {'texts/s':>9} {'mean cos':>9} {'min cos':>9}")
+    for name, row in report.items():
+        print(f"{name:<10} {row['query_ms']:9.2f} {row['texts_per_second']:9.1f} "
+              f"{row['mean_cosine']:9.4f} {row['min_cosine']:9.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,13 @@
-from .embedders import *
-from .vectordbs import *
-from .hf_config import *
-from .translate import *
-from .keywords import *
-from .llms import *
\ No newline at end of file
+# names load with their submodule on first use, so e.g. BM25 tools never import torch
+from . import embedders, keywords, llms, translate, vectordbs
+from ._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "embedders": embedders.__all__,
+    "vectordbs": vectordbs.__all__,
+    "hf_config": ["HfSettings", "settings", "set_huggingface_dir", "set_proxy"],
+    "translate": translate.__all__,
+    "keywords": keywords.__all__,
+    "llms": llms.__all__,
+    "cache": ["CacheStats", "ResultCache"],
+})
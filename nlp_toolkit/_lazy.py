@@ -0,0 +1,30 @@
+import importlib
+import sys
+from typing import Dict, List
+
+
+def attach(package:str, submodules:Dict[str, List[str]]):
+    """Module `__getattr__`, `__dir__` and `__all__` of a package loading its submodules on first use.
+
+    submodules maps the name of a submodule of the package to the public names it
+    provides; a name is imported from its submodule the first time it is looked up
+    on the package, and then set on it. Submodules are attributes of the package too.
+
+    Usage, in the package's __init__.py:
+        __getattr__, __dir__, __all__ = attach(__name__, {"bm25": ["BM25Model"]})
+    """
+    module_of = {name: module for module, names in submodules.items() for name in names}
+
+    def __getattr__(name:str):
+        if name in submodules:
+            return importlib.import_module(f"{package}.{name}")
+        if name not in module_of:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(f"{package}.{module_of[name]}"), name)
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__() -> List[str]:
+        return sorted(set(module_of) | set(submodules) | set(vars(sys.modules[package])))
+
+    return __getattr__, __dir__, list(module_of)
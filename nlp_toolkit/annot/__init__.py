@@ -1,2 +1,6 @@
-from .database import TextDB
-from .task import MultiThreadTask
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "database": ["TextDB"],
+    "task": ["MultiThreadTask"],
+})
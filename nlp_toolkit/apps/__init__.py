@@ -1 +1,5 @@
-from .structured_extract import *
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "structured_extract": ["get_pydantic_model_schema", "PydanticTool", "StructuredExtraction", "LlamaPydanticTool"],
+})
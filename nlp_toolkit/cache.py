@@ -0,0 +1,180 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from pathlib import Path
+import copy
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+@dataclass
+class CacheStats:
+    """Counters of a ResultCache in this process, evictions from its in-memory LRU"""
+    
+    hits:int = 0
+    misses:int = 0
+    evictions:int = 0
+    expirations:int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+@dataclass
+class ResultCache:
+    """LRU cache of query results, with an optional time to live and on-disk backing store.
+
+    Entries live in a namespace, e.g. one per index or collection, whose version
+    counter is part of every key: `invalidate` bumps the counter, which makes all
+    entries of the namespace unreachable, and they age out of the LRU order.
+
+    With a path, entries and version counters are also kept in a sqlite file shared
+    by all processes using the same path, e.g. the workers of a server, in front of
+    which each process keeps its own in-memory LRU.
+
+    Args:
+        max_size (int, optional): entries kept in memory, and on disk. Defaults to 1024.
+        ttl (float, optional): seconds an entry stays valid, forever if None. Defaults to None.
+        path (str, optional): sqlite file of the shared backing store. Defaults to None.
+    """
+
+    max_size:int = 1024
+    ttl:float = None
+    path:str = None
+    stats:CacheStats = field(default_factory = CacheStats)
+
+    def __post_init__(self):
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection to the backing store, opened once per process"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            Path(self.path).parent.mkdir(parents = True, exist_ok = True)
+            self._conn = sqlite3.connect(self.path, timeout = 30, check_same_thread = False, isolation_level = None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS versions (namespace TEXT PRIMARY KEY, version INTEGER)")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def version(self, namespace:str) -> int:
+        with self._lock:
+            if self.path is None:
+                return self._versions.get(namespace, 0)
+            row = self.conn.execute("SELECT version FROM versions WHERE namespace = ?", (namespace,)).fetchone()
+            return row[0] if row else 0
+
+    def invalidate(self, namespace:str) -> None:
+        """Drop all entries of a namespace, in every process sharing the backing store"""
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            if self.path is not None:
+                self.conn.execute(
+                    "INSERT INTO versions VALUES (?, 1) ON CONFLICT(namespace) DO UPDATE SET version = version + 1",
+                    (namespace,))
+
+    def versioned_key(self, namespace:str, key) -> str:
+        """Normalized key: the namespace, its current version and the JSON form of key.
+
+        A result computed from the data as of this version must be stored under this
+        key, built before computing it, so an invalidation meanwhile leaves it unreachable.
+        """
+        normalized = json.dumps([namespace, self.version(namespace), key], sort_keys = True, default = str)
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, namespace:str, key, default = None):
+        """Cached result of key in namespace, default when missing or expired"""
+        return self.get_versioned(self.versioned_key(namespace, key), default = default)
+
+    def put(self, namespace:str, key, value) -> None:
+        self.put_versioned(self.versioned_key(namespace, key), value)
+
+    def get_versioned(self, cache_key:str, default = None):
+        """Cached result of a key from `versioned_key`, default when missing or expired"""
+        with self._lock:
+            value = self._get_memory(cache_key)
+            if value is None and self.path is not None:
+                value = self._get_disk(cache_key)
+                if value is not None:
+                    self._put_memory(cache_key, *value)
+            if value is None:
+                self.stats.misses += 1
+                return default
+            self.stats.hits += 1
+            return copy.deepcopy(value[1])
+
+    def put_versioned(self, cache_key:str, value) -> None:
+        with self._lock:
+            expires = None if self.ttl is None else time.time() + self.ttl
+            value = copy.deepcopy(value)
+            self._put_memory(cache_key, expires, value)
+            if self.path is not None:
+                self._put_disk(cache_key, expires, value)
+
+    def get_or_compute(self, namespace:str, key, compute:Callable[[], Any]):
+        """Cached result of key in namespace, computed and cached when missing"""
+        sentinel = object()
+        cache_key = self.versioned_key(namespace, key)
+        value = self.get_versioned(cache_key, default = sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put_versioned(cache_key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self.path is not None:
+                self.conn.execute("DELETE FROM results")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_memory(self, cache_key:str):
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] < time.time():
+            del self._entries[cache_key]
+            self.stats.expirations += 1
+            return None
+        self._entries.move_to_end(cache_key)
+        return entry
+
+    def _put_memory(self, cache_key:str, expires:float, value) -> None:
+        self._entries[cache_key] = (expires, value)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last = False)
+            self.stats.evictions += 1
+
+    def _get_disk(self, cache_key:str):
+        row = self.conn.execute("SELECT value, expires FROM results WHERE key = ?", (cache_key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self.conn.execute("DELETE FROM results WHERE key = ?", (cache_key,))
+            self.stats.expirations += 1
+            return None
+        self.conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), cache_key))
+        return row[1], pickle.loads(row[0])
+
+    def _put_disk(self, cache_key:str, expires:float, value) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                          (cache_key, pickle.dumps(value), expires, time.time()))
+        self.conn.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,))
@@ -1,4 +1,11 @@
-from .base import *
-from .chroma_adapter import *
-from .huggingface import *
-from .openai_embedding import *
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "base": ["BaseEmbedder"],
+    "chroma_adapter": ["make_chroma"],
+    "huggingface": ["SentenceEmbedder", "compare_backends"],
+    "openai_embedding": ["load_encoding", "estimate_tokens", "token_batches", "RateLimiter", "OpenAIEmbedding"],
+    "cached": ["model_id_of", "CachedEmbedder"],
+    "server": ["Histogram", "MicroBatcher", "EmbeddingServer", "EmbeddingClient"],
+    "compact": ["DTYPES", "QuantizedEmbeddings", "CompactEmbedder", "recall_at_k"],
+})
@@ -0,0 +1,204 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+from .base import BaseEmbedder
+from .chroma_adapter import make_chroma
+from ..cache import CacheStats
+
+
+def model_id_of(embedder:BaseEmbedder) -> str:
+    """Identify the model of an embedder, so caches of different models never mix.
+
+    Embedders of this package define a model_id naming everything their vectors depend
+    on, e.g. the backend or the server; other ones are identified by a model name
+    attribute. ValueError when there is none, e.g. for plain functions.
+    """
+    for attr in ("model_id", "model_ckpt", "model", "model_name"):
+        value = getattr(embedder, attr, None)
+        if isinstance(value, str):
+            return value
+    raise ValueError(f"Cannot tell the model of {embedder!r}, pass a model_id naming it")
+
+
+@dataclass
+class CachedEmbedder:
+    """Persistent embedding cache in front of any embedder.
+
+    Vectors are keyed by a hash of (model id, text) and stored as rows of a
+    memory-mapped float32 file, vectors.f32, with the hash to row index in a
+    sqlite file, index.sqlite, both under path. Only the texts missing from
+    the cache go to the wrapped embedder, in one call of at most batch_size texts
+    at a time. Beyond max_entries the least recently used entries are evicted
+    and their rows reused.
+
+    Processes sharing a path share the cache; index updates are serialized
+    through sqlite transactions.
+
+    Args:
+        embedder (BaseEmbedder): the wrapped embedder.
+        path (str): folder of the cache files.
+        model_id (str, optional): part of every key, required when `model_id_of` cannot
+            tell the model of the embedder. Defaults to None.
+        max_entries (int, optional): vectors kept on disk. Defaults to 1_000_000.
+        batch_size (int, optional): texts per call of the wrapped embedder. Defaults to 4096.
+    """
+
+    embedder:BaseEmbedder
+    path:str
+    model_id:str = None
+    max_entries:int = 1_000_000
+    batch_size:int = 4096
+    stats:CacheStats = field(default_factory = CacheStats)
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+        self.path.mkdir(parents = True, exist_ok = True)
+        if self.model_id is None:
+            self.model_id = model_id_of(self.embedder)
+        self._conn = None
+        self._conn_pid = None
+        self._vectors = None
+
+    def make_chroma(self):
+        return make_chroma(self)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection to the index, opened once per process"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path / "index.sqlite", timeout = 60, isolation_level = None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, slot INTEGER, accessed REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            self._conn_pid = os.getpid()
+            self._vectors = None
+        return self._conn
+
+    def _meta(self, name:str, default:int = None) -> int:
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, name:str, value:int) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, value))
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def dim(self) -> int:
+        """Dimension of the cached vectors, None before the first one"""
+        return self._meta("dim")
+
+    def vectors(self, n_slots:int = 0) -> np.memmap:
+        """Memory map of the vector file holding at least n_slots rows, grown if needed"""
+        dim = self.dim
+        file = self.path / "vectors.f32"
+        n_rows = file.stat().st_size // (4 * dim) if file.exists() else 0
+        if n_rows < n_slots:
+            n_rows = min(max(n_slots, 2 * n_rows, 1024), max(self.max_entries, n_slots))
+            with open(file, "ab") as f:
+                f.truncate(n_rows * dim * 4)
+            self._vectors = None
+        if self._vectors is None or len(self._vectors) < max(n_rows, 1):
+            self._vectors = np.memmap(file, dtype = np.float32, mode = "r+", shape = (n_rows, dim))
+        return self._vectors
+
+    def keys(self, texts:List[str]) -> List[bytes]:
+        prefix = self.model_id.encode("utf-8") + b"\0"
+        return [hashlib.blake2b(prefix + text.encode("utf-8"), digest_size = 16).digest() for text in texts]
+
+    def _lookup(self, keys:List[bytes]) -> dict:
+        slots = {}
+        for start in range(0, len(keys), 900):
+            chunk = keys[start:start + 900]
+            rows = self.conn.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            slots.update(rows)
+        return slots
+
+    def __call__(self, texts:List[str]) -> np.ndarray:
+        if isinstance(texts, np.ndarray):
+            texts = texts.tolist()
+        texts = list(texts)
+        keys = self.keys(texts)
+        unique_keys = list(dict.fromkeys(keys))
+        found = {}
+
+        # hits are copied out under the write lock, so no other process reuses their rows meanwhile
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            slots = self._lookup(unique_keys)
+            if slots:
+                vectors = self.vectors(max(slots.values()) + 1)
+                hit_keys = list(slots)
+                hit_vectors = np.asarray(vectors[np.asarray([slots[key] for key in hit_keys])])
+                found = dict(zip(hit_keys, hit_vectors))
+                now = time.time()
+                self.conn.executemany("UPDATE entries SET accessed = ? WHERE key = ?", [(now, key) for key in hit_keys])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        text_of = dict(zip(keys, texts))
+        missing = [key for key in unique_keys if key not in found]
+        n_missed = sum(1 for key in keys if key not in found)
+        self.stats.hits += len(keys) - n_missed
+        self.stats.misses += n_missed
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            embeddings = np.asarray(self.embedder([text_of[key] for key in batch]), dtype = np.float32)
+            found.update(zip(batch, embeddings))
+            self._insert(batch, embeddings)
+
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype = np.float32)
+        return np.stack([found[key] for key in keys])
+
+    def _insert(self, keys:List[bytes], embeddings:np.ndarray) -> None:
+        """Store new vectors, evicting the least recently used entries beyond max_entries"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            dim = self.dim
+            if dim is None:
+                dim = embeddings.shape[1]
+                self._set_meta("dim", dim)
+            elif embeddings.shape[1] != dim:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match the cache's {dim}")
+
+            # another process may have inserted some of them meanwhile
+            existing = self._lookup(keys)
+            # beyond max_entries new vectors are returned but not stored
+            new = [i for i, key in enumerate(keys) if key not in existing][:self.max_entries]
+            n_entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            n_evict = max(0, n_entries + len(new) - self.max_entries)
+            slots = []
+            if n_evict:
+                evicted = self.conn.execute(
+                    "SELECT key, slot FROM entries ORDER BY accessed LIMIT ?", (n_evict,)).fetchall()
+                self.conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                slots = [slot for _, slot in evicted]
+                self.stats.evictions += len(evicted)
+            next_slot = self._meta("next_slot", 0)
+            n_appended = len(new) - len(slots)
+            slots += list(range(next_slot, next_slot + n_appended))
+            self._set_meta("next_slot", next_slot + n_appended)
+
+            if new:
+                vectors = self.vectors(max(slots) + 1)
+                vectors[np.asarray(slots)] = embeddings[new]
+                vectors.flush()
+                now = time.time()
+                self.conn.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                                      [(keys[i], slot, now) for i, slot in zip(new, slots)])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
@@ -0,0 +1,173 @@
+from dataclasses import dataclass
+from typing import List
+import hashlib
+import numpy as np
+from .base import BaseEmbedder
+from .cached import model_id_of
+from .chroma_adapter import make_chroma
+
+DTYPES = ("float32", "float16", "int8")
+
+
+@dataclass
+class QuantizedEmbeddings:
+    """int8 embeddings, row i being codes[i] * scales[i]; converts to float32 like an array"""
+
+    codes:np.ndarray
+    scales:np.ndarray
+
+    @classmethod
+    def quantize(cls, embeddings:np.ndarray):
+        scales = np.abs(embeddings).max(axis = 1) / 127
+        scales[scales == 0] = 1
+        codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    def dequantize(self) -> np.ndarray:
+        return self.codes.astype(np.float32) * self.scales[:, None]
+
+    def __array__(self, dtype = None, copy = None):
+        embeddings = self.dequantize()
+        return embeddings if dtype is None else embeddings.astype(dtype)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def shape(self) -> tuple:
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def tolist(self) -> list:
+        return self.dequantize().tolist()
+
+
+@dataclass
+class CompactEmbedder:
+    """Smaller embeddings from any embedder.
+
+    Embeddings are reduced to dim dimensions, by a PCA projection once fitted with
+    `fit_pca`, otherwise by truncation (for models trained for it, e.g. Matryoshka
+    ones), re-normalized, and stored as float32, float16 or int8 with one scale
+    per vector. Use the same instance, or one loaded from `save`, for documents and
+    queries, so both go through the same transform; `evaluate` measures the recall
+    lost against the full embeddings.
+
+    Calling it returns arrays like any embedder, so with int8 the embeddings come back
+    dequantized to float32 and save no memory, only dimensions. To keep 1 byte per
+    dimension, embed with `embed_compressed`, or `compress` full embeddings, which
+    return QuantizedEmbeddings: the int8 codes and the scales.
+
+    Args:
+        embedder (BaseEmbedder): the wrapped embedder.
+        dtype (str, optional): float32, float16 or int8. Defaults to "float32".
+        dim (int, optional): dimensions kept, all if None. Defaults to None.
+        normalize (bool, optional): scale embeddings to unit length after reduction. Defaults to True.
+    """
+
+    embedder:BaseEmbedder
+    dtype:str = "float32"
+    dim:int = None
+    normalize:bool = True
+
+    def __post_init__(self):
+        if self.dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype {self.dtype!r}, expected one of {DTYPES}")
+        self.mean = None
+        self.components = None
+
+    def make_chroma(self):
+        return make_chroma(self)
+
+    @property
+    def model_id(self) -> str:
+        """Model id including the output options, so caches of different options never mix"""
+        name = f"{model_id_of(self.embedder)}|{self.dtype}|{self.dim}|{self.normalize}"
+        if self.components is not None:
+            name += "|pca-" + hashlib.blake2b(self.components.tobytes(), digest_size = 8).hexdigest()
+        return name
+
+    def fit_pca(self, texts:List[str] = None, embeddings:np.ndarray = None):
+        """Fit the projection to dim dimensions on a sample of texts, or of their embeddings"""
+        if embeddings is None:
+            embeddings = self.embedder(texts)
+        embeddings = np.asarray(embeddings, dtype = np.float32)
+        dim = self.dim or embeddings.shape[1]
+        if dim > min(embeddings.shape):
+            raise ValueError(f"A PCA to {dim} dimensions needs at least {dim} samples, got {len(embeddings)}")
+        self.mean = embeddings.mean(axis = 0)
+        _, _, vt = np.linalg.svd(embeddings - self.mean, full_matrices = False)
+        self.components = np.ascontiguousarray(vt[:dim])
+        self.dim = dim
+        return self
+
+    def compress(self, embeddings:np.ndarray):
+        """Apply the output options to full embeddings, QuantizedEmbeddings for int8"""
+        embeddings = np.asarray(embeddings, dtype = np.float32)
+        if self.components is not None:
+            embeddings = (embeddings - self.mean) @ self.components.T
+        elif self.dim is not None:
+            embeddings = embeddings[:, :self.dim]
+        if self.normalize:
+            norms = np.linalg.norm(embeddings, axis = 1, keepdims = True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        if self.dtype == "int8":
+            return QuantizedEmbeddings.quantize(embeddings)
+        return np.ascontiguousarray(embeddings, dtype = self.dtype)
+
+    def transform(self, embeddings:np.ndarray) -> np.ndarray:
+        """Apply the output options to full embeddings, int8 ones dequantized to float32"""
+        compressed = self.compress(embeddings)
+        return compressed.dequantize() if isinstance(compressed, QuantizedEmbeddings) else compressed
+
+    def __call__(self, texts:List[str]) -> np.ndarray:
+        """Embeddings as arrays, int8 ones dequantized to float32, see `embed_compressed`"""
+        return self.transform(self.embedder(texts))
+
+    def embed_compressed(self, texts:List[str]):
+        """Embeddings in their compact form, QuantizedEmbeddings for int8"""
+        return self.compress(self.embedder(texts))
+
+    def evaluate(self, queries:List[str], documents:List[str], k:int = 10) -> float:
+        """Recall@k of nearest documents by inner product against the full embeddings"""
+        full_queries = np.asarray(self.embedder(queries), dtype = np.float32)
+        full_documents = np.asarray(self.embedder(documents), dtype = np.float32)
+        return recall_at_k(full_queries, full_documents,
+                           self.transform(full_queries), self.transform(full_documents), k = k)
+
+    def save(self, path:str) -> None:
+        """Save the output options and projection to an .npz file"""
+        arrays = {"dtype": np.array(self.dtype), "dim": np.array(-1 if self.dim is None else self.dim),
+                  "normalize": np.array(self.normalize)}
+        if self.components is not None:
+            arrays.update(mean = self.mean, components = self.components)
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, embedder:BaseEmbedder, path:str):
+        """Wrap embedder with the options saved by `save`"""
+        with np.load(path) as arrays:
+            dim = int(arrays["dim"])
+            obj = cls(embedder, dtype = str(arrays["dtype"]), dim = None if dim < 0 else dim,
+                      normalize = bool(arrays["normalize"]))
+            if "components" in arrays:
+                obj.mean, obj.components = arrays["mean"], arrays["components"]
+        return obj
+
+
+def recall_at_k(queries:np.ndarray, documents:np.ndarray,
+                compact_queries:np.ndarray, compact_documents:np.ndarray, k:int = 10) -> float:
+    """Share of the top k documents of each query by full embeddings also in the top k by compact ones"""
+    k = min(k, len(documents))
+
+    def top_k(q, d):
+        scores = np.asarray(q, dtype = np.float32) @ np.asarray(d, dtype = np.float32).T
+        return np.argpartition(-scores, k - 1, axis = 1)[:, :k]
+
+    expected, found = top_k(queries, documents), top_k(compact_queries, compact_documents)
+    hits = sum(len(np.intersect1d(e, f)) for e, f in zip(expected, found))
+    return hits / (k * len(expected))
@@ -1,37 +1,252 @@
 import torch
 from transformers import AutoTokenizer, AutoModel
+from transformers.modeling_outputs import BaseModelOutput
+from huggingface_hub.constants import HF_HUB_CACHE
 import torch.nn.functional as F
 from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
 import numpy as np
 from tqdm import tqdm
 from .chroma_adapter import make_chroma
 
+
+def _embedding_worker(params:dict, n_threads:int, tasks, results):
+    """Worker process of SentenceEmbedder: runs (index, method, batch) tasks until None"""
+    torch.set_num_threads(n_threads)
+    try:
+        embedder = SentenceEmbedder(**params)
+    except Exception:
+        results.put((None, None, traceback.format_exc()))
+        return
+    results.put((None, None, None))
+    for index, method, batch in iter(tasks.get, None):
+        try:
+            results.put((index, getattr(embedder, method)(batch), None))
+        except Exception:
+            results.put((index, None, traceback.format_exc()))
+
+
 @dataclass
 class SentenceEmbedder:
 
     model_ckpt:str = "sentence-transformers/all-MiniLM-L6-v2"
     mps:bool = False
     batch_size:int = 512
+    # padded tokens per batch; when set, texts are tokenized once, sorted by length
+    # and batched under this budget instead of batch_size texts in input order
+    max_tokens:int = None
+    # worker processes, each with its own copy of the model; batches are the same as
+    # in a single process, so are the embeddings as long as the single process runs
+    # torch with threads_per_worker threads. Use as a context manager, or call close
+    workers:int = 0
+    # torch threads of each worker, cpu count / workers by default
+    threads_per_worker:int = None
+    # "torch", or "onnx" to run an ONNX export of the model with onnxruntime on cpu
+    backend:str = "torch"
+    # with the onnx backend, use a copy of the export with weights quantized to int8
+    quantize:bool = False
 
     def __post_init__(self):
+        if self.backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown backend {self.backend!r}, expected 'torch' or 'onnx'")
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_ckpt)
-        self.model = AutoModel.from_pretrained(self.model_ckpt)
-        if self.mps:
+        if self.backend == "onnx":
+            self.device = "cpu"
+        elif self.mps:
             self.device ="mps"
         else:
             self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        self.model.to(self.device)
+        self.model = None
+        self.session = None
+        if self.workers <= 1 and self.backend == "onnx":
+            self.session = self.onnx_session()
+        elif self.workers <= 1:
+            self.model = AutoModel.from_pretrained(self.model_ckpt)
+            self.model.to(self.device)
+        self._processes = None
+        self._lock = threading.Lock()
         
     def make_chroma(self):
         return make_chroma(self)
 
+    @property
+    def model_id(self) -> str:
+        """The checkpoint and the backend running it, see `model_id_of`"""
+        if self.backend == "torch":
+            return self.model_ckpt
+        return f"{self.model_ckpt}|{self.backend}{'-int8' if self.quantize else ''}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        """Start the worker processes and wait until all of them loaded the model.
+
+        Workers are spawned, so scripts using them need an `if __name__ == "__main__":` guard.
+        """
+        if self.workers <= 1 or self._processes is not None:
+            return self
+        if self.backend == "onnx":
+            # exported once here rather than by every worker
+            self.export_onnx()
+        context = multiprocessing.get_context("spawn")
+        self._tasks, self._results = context.Queue(), context.Queue()
+        params = {"model_ckpt": self.model_ckpt, "mps": self.mps,
+                  "batch_size": self.batch_size, "max_tokens": self.max_tokens,
+                  "backend": self.backend, "quantize": self.quantize}
+        n_threads = self.threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self._processes = [
+            context.Process(target = _embedding_worker, args = (params, n_threads, self._tasks, self._results),
+                            daemon = True)
+            for _ in range(self.workers)
+        ]
+        for process in self._processes:
+            process.start()
+        for _ in self._processes:
+            self._next_result()
+        return self
+
+    def close(self) -> None:
+        """Stop the worker processes, they are started again on the next call"""
+        if self._processes is None:
+            return
+        for process in self._processes:
+            if process.is_alive():
+                self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout = 10)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._tasks.close()
+        self._results.close()
+        self._processes = None
+
+    def _next_result(self):
+        """Next (index, embeddings) from the workers, raising if one failed or died"""
+        while True:
+            try:
+                index, embeddings, error = self._results.get(timeout = 1)
+                break
+            except queue.Empty:
+                if any(not process.is_alive() for process in self._processes):
+                    self.close()
+                    raise RuntimeError("An embedding worker exited unexpectedly")
+        if error is not None:
+            self.close()
+            raise RuntimeError(f"Embedding worker failed:\n{error}")
+        return index, embeddings
+
+    def _map_batches(self, method:str, batches:list) -> List[np.ndarray]:
+        """Embeddings of every batch by the given method, in the workers if any, in batch order"""
+        if self.workers <= 1:
+            return [getattr(self, method)(batch) for batch in tqdm(batches, total = len(batches), desc = "Embedding Batches")]
+        
+        with self._lock:
+            self.start()
+            for i, batch in enumerate(batches):
+                self._tasks.put((i, method, batch))
+            embeddings = [None] * len(batches)
+            for _ in tqdm(range(len(batches)), total = len(batches), desc = "Embedding Batches"):
+                index, batch_embeddings = self._next_result()
+                embeddings[index] = batch_embeddings
+            return embeddings
+
     def _embed(self, sentences):
-        encoder_input = self.tokenizer(sentences, padding = True, truncation = True, return_tensors = 'pt').to(self.device)
+        encoder_input = self.tokenizer(sentences, padding = True, truncation = True, return_tensors = 'pt')
+        return self._embed_encoded(encoder_input)
+    
+    @property
+    def onnx_path(self) -> Path:
+        """ONNX export of the model, cached in the huggingface hub cache folder"""
+        folder = Path(HF_HUB_CACHE) / "onnx" / self.model_ckpt.replace("/", "--")
+        return folder / ("model.int8.onnx" if self.quantize else "model.onnx")
+
+    def export_onnx(self) -> Path:
+        """Export the model to ONNX, and quantize it, unless already cached"""
+        int8_path = self.onnx_path.with_name("model.int8.onnx")
+        fp32_path = self.onnx_path.with_name("model.onnx")
+        if self.onnx_path.exists():
+            return self.onnx_path
+        fp32_path.parent.mkdir(parents = True, exist_ok = True)
+        # written under a temporary name then renamed, processes exporting at the same time never see half a file
+        tmp_path = fp32_path.with_name(f"model.{os.getpid()}.tmp.onnx")
+
+        if not fp32_path.exists():
+            model = AutoModel.from_pretrained(self.model_ckpt).eval()
+            example = dict(self.tokenizer(["an example sentence"], return_tensors = 'pt'))
+            dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in list(example) + ["last_hidden_state"]}
+            with torch.no_grad():
+                torch.onnx.export(model, (example,), str(tmp_path), input_names = list(example),
+                                  output_names = ["last_hidden_state"], dynamic_axes = dynamic_axes, opset_version = 14)
+            os.replace(tmp_path, fp32_path)
+
+        if self.quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(str(fp32_path), str(tmp_path), weight_type = QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+        return self.onnx_path
+
+    def onnx_session(self):
+        """onnxruntime cpu session of the exported model, using as many threads as torch"""
+        import onnxruntime
+        path = self.export_onnx()
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        session = onnxruntime.InferenceSession(str(path), options, providers = ["CPUExecutionProvider"])
+        self._onnx_inputs = [node.name for node in session.get_inputs()]
+        return session
+
+    def _run_onnx(self, encoder_input):
+        input_ids = encoder_input['input_ids'].numpy()
+        # inputs the tokenizer left out, i.e. token_type_ids after pad, take the model's default of zeros
+        inputs = {name: encoder_input[name].numpy() if name in encoder_input else np.zeros_like(input_ids)
+                  for name in self._onnx_inputs}
+        last_hidden_state = self.session.run(["last_hidden_state"], inputs)[0]
+        return encoder_input, BaseModelOutput(last_hidden_state = torch.from_numpy(last_hidden_state))
+
+    def _embed_encoded(self, encoder_input):
+        if self.backend == "onnx":
+            return self._run_onnx(encoder_input)
+        encoder_input = encoder_input.to(self.device)
 
         with torch.no_grad():
             model_output = self.model(**encoder_input)
 
         return encoder_input, model_output
+    
+    def tokenize(self, texts:List[str]) -> List[List[int]]:
+        """Token ids of every text, truncated to the model's maximum length"""
+        return self.tokenizer(list(texts), truncation = True)['input_ids']
+    
+    def length_batches(self, lengths:List[int]) -> List[np.ndarray]:
+        """Positions of texts sorted by decreasing length and cut into batches.
+
+        A batch holds at most batch_size texts and, padded to its longest text,
+        at most max_tokens tokens; a text longer than max_tokens gets a batch of its own.
+        Longest batches come first, so running out of memory shows up right away.
+        """
+        lengths = np.asarray(lengths)
+        order = np.argsort(-lengths, kind = "stable")
+        batches, start = [], 0
+        for end in range(1, len(order) + 1):
+            size = end - start
+            if size > 1 and (size > self.batch_size or size * lengths[order[start]] > self.max_tokens):
+                batches.append(order[start:end - 1])
+                start = end - 1
+        if start < len(order):
+            batches.append(order[start:])
+        return batches
 
     def mean_pooling(self, encoder_input, model_output):
 
@@ -46,30 +261,85 @@ class SentenceEmbedder:
         return sentence_embeddings
 
     def embed_sentences(self, sentences):
+        if self.workers > 1:
+            # the model lives in the workers
+            return self._map_batches("embed_sentences", [list(sentences)])[0]
         encoder_input, model_output = self._embed(sentences)
         return self.mean_pooling(encoder_input, model_output).cpu().numpy()
 
+    def embed_input_ids(self, input_ids:List[List[int]]) -> np.ndarray:
+        """Embed one batch of tokenized texts, padded to the longest"""
+        if self.workers > 1:
+            return self._map_batches("embed_input_ids", [input_ids])[0]
+        encoder_input = self.tokenizer.pad({'input_ids': input_ids}, padding = True, return_tensors = 'pt')
+        encoder_input, model_output = self._embed_encoded(encoder_input)
+        return self.mean_pooling(encoder_input, model_output).cpu().numpy()
+
+    def embed_bucketed(self, texts:List[str]) -> np.ndarray:
+        """Embed texts in length-sorted batches under the max_tokens budget, in input order"""
+        input_ids = self.tokenize(texts)
+        batches = self.length_batches([len(ids) for ids in input_ids])
+        batch_embeddings = self._map_batches("embed_input_ids", [[input_ids[i] for i in batch] for batch in batches])
+        
+        embeddings = np.empty((len(input_ids), batch_embeddings[0].shape[1]), dtype = batch_embeddings[0].dtype)
+        for batch, subset_embeddings in zip(batches, batch_embeddings):
+            embeddings[batch] = subset_embeddings
+        return embeddings
+
     def __call__(self, texts):
+        if self.max_tokens is not None and len(texts) > 0:
+            return self.embed_bucketed(texts)
+        
         batch_size = self.batch_size
         n_batchs = len(texts) // batch_size + int(len(texts) % batch_size > 0)
 
-        subset_embeddings = []
-
-        for i in tqdm(range(n_batchs), total = n_batchs, desc = "Embedding Batches"):
-            subset = texts[i * batch_size: (i+1) * batch_size]
-            subset_embedding = self.embed_sentences(subset)
-            subset_embeddings.append(subset_embedding)
+        subsets = [list(texts[i * batch_size: (i+1) * batch_size]) for i in range(n_batchs)]
+        subset_embeddings = self._map_batches("embed_sentences", subsets)
         return np.concatenate(subset_embeddings)
-  
 
 
-        
-    
-    
-    
-    
+def compare_backends(texts:List[str], model_ckpt:str = "sentence-transformers/all-MiniLM-L6-v2",
+                     batch_size:int = 32, n_queries:int = 100) -> dict:
+    """Accuracy and cpu latency of the onnx backends against the torch one.
 
+    Embeds texts with every backend, and the first n_queries texts one at a time
+    as queries would be.
 
-    
+    Returns:
+        dict: per backend, the median query latency in ms, texts per second in
+            batches and the mean and min cosine similarity to the torch embeddings.
+    """
+    texts = list(texts)
+    backends = {
+        "torch": {"backend": "torch"},
+        "onnx": {"backend": "onnx"},
+        "onnx-int8": {"backend": "onnx", "quantize": True},
+    }
+    report, reference = {}, None
+    for name, params in backends.items():
+        embedder = SentenceEmbedder(model_ckpt, batch_size = batch_size, **params)
+        if embedder.model is not None:
+            embedder.device = "cpu"
+            embedder.model.to("cpu")
+        embedder.embed_sentences(texts[:batch_size])
 
+        latencies = []
+        for text in texts[:n_queries]:
+            start = time.perf_counter()
+            embedder.embed_sentences([text])
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        embeddings = embedder(texts)
+        elapsed = time.perf_counter() - start
 
+        if reference is None:
+            reference = embeddings
+        # embeddings are L2 normalized
+        cosine = np.sum(embeddings * reference, axis = 1)
+        report[name] = {
+            "query_ms": float(np.median(latencies) * 1000),
+            "texts_per_second": len(texts) / elapsed,
+            "mean_cosine": float(cosine.mean()),
+            "min_cosine": float(cosine.min()),
+        }
+    return report
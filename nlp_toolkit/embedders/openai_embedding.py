@@ -1,22 +1,150 @@
 import os
+import threading
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from .chroma_adapter import make_chroma
 
 
+@lru_cache(maxsize = None)
+def load_encoding(model:str):
+    """tiktoken encoding of a model, None when tiktoken or its files are unavailable, e.g. offline"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def estimate_tokens(texts:List[str], model:str) -> List[int]:
+    """Tokens of every text, about 1 per 3 characters without tiktoken, which overestimates English"""
+    encoding = load_encoding(model)
+    if encoding is None:
+        return [len(text) // 3 + 1 for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
+def token_batches(n_tokens:List[int], max_size:int, max_tokens:int) -> List[range]:
+    """Consecutive ranges of at most max_size items and max_tokens tokens; a larger item is alone"""
+    batches, start, total = [], 0, 0
+    for i, tokens in enumerate(n_tokens):
+        if i > start and (i - start >= max_size or total + tokens > max_tokens):
+            batches.append(range(start, i))
+            start, total = i, 0
+        total += tokens
+    if start < len(n_tokens):
+        batches.append(range(start, len(n_tokens)))
+    return batches
+
+
+class RateLimiter:
+    """Token buckets of requests and tokens per minute, refilled continuously; None is unlimited"""
+
+    def __init__(self, requests_per_minute:int = None, tokens_per_minute:int = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute or 0
+        self._tokens = tokens_per_minute or 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now:float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens:int = 0) -> None:
+        """Block until one request of the given tokens fits in both budgets, then take it"""
+        if self.tokens_per_minute:
+            # a request larger than the whole budget waits for a full bucket
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = (1 - self._requests) * 60 / self.requests_per_minute
+                if self.tokens_per_minute and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait == 0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+            time.sleep(wait)
+
+
 class OpenAIEmbedding:
-    def __init__(self, model:str = 'text-embedding-ada-002'):
+    """Embeddings from the OpenAI API, or any server compatible with it through base_url.
+
+    Inputs are split into requests of at most max_batch_size texts and
+    max_batch_tokens estimated tokens, sent by max_workers threads under the
+    optional requests and tokens per minute limits. Rate limited (429), server
+    (5xx) and connection errors are retried with exponential backoff, up to
+    max_retries attempts. Embeddings come back in input order.
+    """
+
+    def __init__(self, model:str = 'text-embedding-ada-002',
+                 api_key:str = None,
+                 base_url:str = None,
+                 max_batch_size:int = 512,
+                 max_batch_tokens:int = 100_000,
+                 max_workers:int = 8,
+                 requests_per_minute:int = None,
+                 tokens_per_minute:int = None,
+                 max_retries:int = 6):
         import openai
         from openai import OpenAI
-        openai.api_key = os.environ['OPENAI_API_KEY']
-        self.client = OpenAI()
+        if api_key is None:
+            api_key = os.environ['OPENAI_API_KEY']
+        openai.api_key = api_key
+        # retries are ours, so they go through the rate limiter
+        self.client = OpenAI(api_key = api_key, base_url = base_url, max_retries = 0)
         self.model = model
-        
+        self.base_url = base_url
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        retry_on = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+        self._create = retry(
+            retry = retry_if_exception_type(retry_on),
+            wait = wait_random_exponential(multiplier = 1, max = 60),
+            stop = stop_after_attempt(max_retries),
+            reraise = True,
+        )(self._create_once)
+
     def make_chroma(self):
         return make_chroma(self)
-        
+
+    @property
+    def model_id(self) -> str:
+        """The model, and the server when not OpenAI's, see `model_id_of`"""
+        return self.model if self.base_url is None else f"{self.model}|{self.base_url}"
+
+    def _create_once(self, texts:List[str], n_tokens:int) -> List[List[float]]:
+        self.rate_limiter.acquire(n_tokens)
+        response = self.client.embeddings.create(input = texts, model = self.model)
+        return [embd.embedding for embd in sorted(response.data, key = lambda embd: embd.index)]
+
     def __call__(self, texts:List[str]):
         if isinstance(texts, np.ndarray):
             texts = texts.tolist()
-        response = self.client.embeddings.create(input = texts, model=self.model)
-        return [embd.embedding for embd in response.data]
+        texts = list(texts)
+        n_tokens = estimate_tokens(texts, self.model)
+        requests = [(texts[batch.start:batch.stop], sum(n_tokens[batch.start:batch.stop]))
+                    for batch in token_batches(n_tokens, self.max_batch_size, self.max_batch_tokens)]
+        if len(requests) <= 1:
+            return [embd for request in requests for embd in self._create(*request)]
+
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(requests))) as executor:
+            results = executor.map(lambda request: self._create(*request), requests)
+            return [embd for result in results for embd in result]
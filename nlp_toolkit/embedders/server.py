@@ -0,0 +1,277 @@
+from bisect import bisect_left
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.request
+import numpy as np
+from .base import BaseEmbedder
+from .chroma_adapter import make_chroma
+
+
+@dataclass
+class Histogram:
+    """Counts of observed values per bucket, the last bucket holding values above all bounds"""
+
+    bounds:List[float]
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value:float) -> None:
+        with self._lock:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"bounds": list(self.bounds), "counts": list(self.counts), "count": self.count, "sum": self.sum}
+
+
+@dataclass
+class MicroBatcher:
+    """Run the texts of concurrent requests through an embedder together.
+
+    A background thread takes the first waiting request, then gathers more for at
+    most max_wait_ms or until max_batch_size texts, embeds them all in one call
+    and hands every request its own rows.
+
+    Args:
+        embedder (BaseEmbedder): the embedder running the batches.
+        max_batch_size (int, optional): texts in a batch, a larger request still runs whole. Defaults to 256.
+        max_wait_ms (float, optional): time a request waits for others to join its batch. Defaults to 5.0.
+    """
+
+    embedder:BaseEmbedder
+    max_batch_size:int = 256
+    max_wait_ms:float = 5.0
+    latency:Histogram = field(default_factory = lambda: Histogram([1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000]))
+    batch_sizes:Histogram = field(default_factory = lambda: Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]))
+
+    def __post_init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def submit(self, texts:List[str]) -> Future:
+        """Future of the embeddings of texts"""
+        future = Future()
+        self._queue.put((list(texts), future, time.perf_counter()))
+        return future
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests waiting for a batch"""
+        return self._queue.qsize()
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "batch_size": self.batch_sizes.to_dict(),
+            "latency_ms": self.latency.to_dict(),
+        }
+
+    def close(self) -> None:
+        """Stop the batching thread once the requests already submitted are done"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            request = self._queue.get()
+            if request is None:
+                break
+            requests, n_texts = [request], len(request[0])
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while n_texts < self.max_batch_size:
+                try:
+                    request = self._queue.get(timeout = max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                requests.append(request)
+                n_texts += len(request[0])
+            self._run_batch(requests)
+
+    def _run_batch(self, requests:list) -> None:
+        texts = [text for request_texts, _, _ in requests for text in request_texts]
+        try:
+            embeddings = np.asarray(self.embedder(texts), dtype = np.float32) if texts else np.zeros((0, 0), np.float32)
+        except Exception as e:
+            for _, future, _ in requests:
+                future.set_exception(e)
+            return
+
+        self.batch_sizes.observe(len(texts))
+        offset = 0
+        for request_texts, future, submitted in requests:
+            future.set_result(embeddings[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+            self.latency.observe((time.perf_counter() - submitted) * 1000)
+
+
+class _EmbeddingHandler(BaseHTTPRequestHandler):
+    """POST /embed with {"texts": [...]} returns float32 rows, shape in the X-Shape header"""
+
+    protocol_version = "HTTP/1.1"
+    batcher:MicroBatcher = None
+
+    def do_POST(self):
+        if self.path != "/embed":
+            return self._send_json(404, {"error": f"Unknown path {self.path}"})
+        try:
+            texts = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["texts"]
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError("texts must be a list of strings")
+        except (ValueError, KeyError, TypeError) as e:
+            return self._send_json(400, {"error": f"Bad request: {e}"})
+
+        try:
+            embeddings = self.batcher.submit(texts).result()
+        except Exception as e:
+            return self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+        body = np.ascontiguousarray(embeddings).tobytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("X-Shape", ",".join(map(str, embeddings.shape)))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            return self._send_json(200, self.batcher.metrics())
+        if self.path == "/health":
+            return self._send_json(200, {"status": "ok"})
+        return self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def _send_json(self, status:int, payload:dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # listen backlog, the default of 5 resets connections under bursts of concurrent requests
+    request_queue_size = 1024
+
+
+@dataclass
+class EmbeddingServer:
+    """HTTP server sharing one embedder, e.g. a SentenceEmbedder, between local services.
+
+    Requests are micro-batched, see `MicroBatcher`; GET /metrics returns the queue
+    depth and the batch size and latency histograms. Use `serve_forever`, or
+    `start` to serve from a background thread and `close` or a with block to stop.
+    """
+
+    embedder:BaseEmbedder
+    host:str = "127.0.0.1"
+    port:int = 8765
+    max_batch_size:int = 256
+    max_wait_ms:float = 5.0
+
+    def __post_init__(self):
+        self.batcher = MicroBatcher(self.embedder, max_batch_size = self.max_batch_size, max_wait_ms = self.max_wait_ms)
+        handler = type("EmbeddingHandler", (_EmbeddingHandler,), {"batcher": self.batcher})
+        self.httpd = _HTTPServer((self.host, self.port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def serve_forever(self) -> None:
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.batcher.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target = self.serve_forever, daemon = True)
+            self._thread.start()
+        return self
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+
+
+@dataclass
+class EmbeddingClient:
+    """Embedder calling an EmbeddingServer, usable wherever a BaseEmbedder is"""
+
+    url:str = "http://127.0.0.1:8765"
+    timeout:float = 60
+
+    def make_chroma(self):
+        return make_chroma(self)
+
+    @property
+    def model_id(self) -> str:
+        """The server, which serves a single model, see `model_id_of`"""
+        return f"embedding-server|{self.url.rstrip('/')}"
+
+    def __call__(self, texts:List[str]) -> np.ndarray:
+        if isinstance(texts, np.ndarray):
+            texts = texts.tolist()
+        request = urllib.request.Request(
+            self.url.rstrip("/") + "/embed",
+            data = json.dumps({"texts": list(texts)}).encode("utf-8"),
+            headers = {"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout = self.timeout) as response:
+            shape = tuple(int(size) for size in response.headers["X-Shape"].split(","))
+            return np.frombuffer(bytearray(response.read()), dtype = np.float32).reshape(shape)
+
+    def metrics(self) -> dict:
+        with urllib.request.urlopen(self.url.rstrip("/") + "/metrics", timeout = self.timeout) as response:
+            return json.loads(response.read())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve a SentenceEmbedder over HTTP")
+    parser.add_argument("--model", default = "sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--max-batch-size", type = int, default = 256)
+    parser.add_argument("--max-wait-ms", type = float, default = 5.0)
+    parser.add_argument("--backend", default = "torch")
+    args = parser.parse_args()
+
+    from .huggingface import SentenceEmbedder
+    embedder = SentenceEmbedder(args.model, batch_size = args.max_batch_size, backend = args.backend)
+    server = EmbeddingServer(embedder, host = args.host, port = args.port,
+                             max_batch_size = args.max_batch_size, max_wait_ms = args.max_wait_ms)
+    print(f"Serving {args.model} on {server.url}")
+    server.serve_forever()
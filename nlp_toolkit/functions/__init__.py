@@ -1,3 +1,7 @@
-from .openai import OpenAITool
-from .base import FuncArg
-from .llama import LlamaFunction
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "openai": ["OpenAITool"],
+    "base": ["FuncArg"],
+    "llama": ["LlamaFunction"],
+})
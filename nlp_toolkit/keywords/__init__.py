@@ -1 +1,10 @@
-from .bm25 import *
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "bm25": ["FORMAT_VERSION", "ENGLISH_STOP_WORDS", "PUNCTUATION_AND_NUMBERS", "load_stop_words",
+             "remove_stop_words", "remove_punctuation_and_numbers", "make_lowercase", "top_n_indices",
+             "tokenizer_config", "tokenizer_from_config", "new_cache_namespace", "read_documents",
+             "CollectionStats", "Tokenizer", "BM25Model"],
+    "index": ["BLOCK_SIZE", "ArrayWriter", "InvertedIndex", "TextStore"],
+    "sharded": ["ShardWorker", "shard_of", "ProcessShard", "ShardedBM25"],
+})
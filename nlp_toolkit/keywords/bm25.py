@@ -1,55 +1,198 @@
 from collections import Counter
-from typing import List
+from typing import Any, Iterator, List, Tuple
 import string
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
 import os
 from pathlib import Path
 import json
 import pickle
 import logging
+import threading
+import shutil
+import importlib
+import dataclasses
+import itertools
+import functools
+import uuid
+from ..cache import ResultCache
+from .index import BLOCK_SIZE, ArrayWriter, InvertedIndex, TextStore
 
-def remove_stop_words(input_string:str):  
-    words = input_string.split()
+FORMAT_VERSION = 2
+
+# nltk's english stop words, used when nltk or its stopwords corpus is not available
+ENGLISH_STOP_WORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours yourself
+yourselves he him his himself she she's her hers herself it it's its itself they them their
+theirs themselves what which who whom this that that'll these those am is are was were be
+been being have has had having do does did doing a an the and but if or because as until
+while of at by for with about against between into through during before after above below
+to from up down in out on off over under again further then once here there when where why
+how all any both each few more most other some such no nor not only own same so than too
+very s t can will just don don't should should've now d ll m o re ve y ain aren aren't
+couldn couldn't didn didn't doesn doesn't hadn hadn't hasn hasn't haven haven't isn isn't
+ma mightn mightn't mustn mustn't needn needn't shan shan't shouldn shouldn't wasn wasn't
+weren weren't won won't wouldn wouldn't
+""".split())
+
+PUNCTUATION_AND_NUMBERS = str.maketrans('', '', string.punctuation + string.digits)
+
+@functools.lru_cache(maxsize = None)
+def load_stop_words(language:str = "english", offline:bool = False) -> frozenset:
+    """Stop words of a language, loaded once per process.
     
+    The nltk stopwords corpus is used when installed; it is downloaded on first use
+    unless offline. Falls back to ENGLISH_STOP_WORDS for english, no stop words otherwise.
+    """
     try:
         import nltk
         from nltk.corpus import stopwords
-        nltk.download('stopwords')
-        """
-        This function removes stop words from the given text.
-        """
-        stop_words = set(stopwords.words('english'))
-        filtered_words = [word for word in words if word.casefold() not in stop_words]
-        return ' '.join(filtered_words)
-    except:
-        logging.warning("nltk not installed, no stop words removed")
-        
+        try:
+            return frozenset(stopwords.words(language))
+        except LookupError:
+            if offline:
+                raise
+            nltk.download('stopwords', quiet = True)
+            return frozenset(stopwords.words(language))
+    except Exception:
+        if language == "english":
+            return ENGLISH_STOP_WORDS
+        logging.warning(f"nltk stopwords for {language} not available, no stop words removed")
+        return frozenset()
+
+def remove_stop_words(input_string:str, language:str = "english", offline:bool = False) -> str:
+    """
+    This function removes stop words from the given text.
+    """
+    stop_words = load_stop_words(language, offline)
+    return ' '.join(word for word in input_string.split() if word.casefold() not in stop_words)
 
 def remove_punctuation_and_numbers(input_string:str):
-    translator = str.maketrans('', '', string.punctuation + string.digits)
-    no_punct = input_string.translate(translator)
-    return no_punct
+    return input_string.translate(PUNCTUATION_AND_NUMBERS)
 
 def make_lowercase(input_string:str):
     return input_string.lower()
 
+def top_n_indices(scores:np.ndarray, n:int = None) -> np.ndarray:
+    """Indices of the n highest scores in descending order, all of them if n is None"""
+    if n is None or n >= len(scores):
+        return np.argsort(scores)[::-1]
+    if n <= 0:
+        return np.array([], dtype = np.int64)
+    # selecting the smallest of the negated scores is much faster on sparse score vectors
+    idx = np.argpartition(-scores, n - 1)[:n]
+    return idx[np.argsort(scores[idx])[::-1]]
+
+
+def tokenizer_config(tokenizer) -> dict:
+    """JSON-serializable description of a tokenizer: its class and dataclass fields"""
+    tokenizer_cls = type(tokenizer)
+    params = dataclasses.asdict(tokenizer) if dataclasses.is_dataclass(tokenizer) else {}
+    return {"class": f"{tokenizer_cls.__module__}:{tokenizer_cls.__qualname__}", "params": params}
+
+def tokenizer_from_config(config:dict):
+    module, qualname = config["class"].split(":")
+    return getattr(importlib.import_module(module), qualname)(**config["params"])
+
+def new_cache_namespace() -> str:
+    """Random ResultCache namespace of a state of a BM25 corpus"""
+    return f"bm25:{uuid.uuid4().hex}"
+
+def read_documents(source, text_field:str = "text", id_field:str = None) -> Iterator[Tuple[str, Any]]:
+    """Yield (text, id) pairs from an iterable of strings or from a text or JSONL file path.
+
+    Text files hold one document per line. JSONL files (.jsonl, .ndjson) hold one record
+    per line, with the text in text_field and the id in id_field; ids are None otherwise.
+    """
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        with open(path, "r", encoding = "utf-8") as f:
+            if path.suffix in (".jsonl", ".ndjson"):
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        yield record[text_field], record[id_field] if id_field else None
+            else:
+                for line in f:
+                    yield line.rstrip("\n"), None
+    else:
+        for document in source:
+            yield document, None
+
+@dataclass
+class CollectionStats:
+    """Collection statistics BM25 scores depend on: the number of live documents,
+    their total length and the document frequency of query terms.
+    
+    Stats of disjoint document sets add up, which lets shards of a collection
+    score with the statistics of the whole collection.
+    """
+    
+    n_docs:int = 0
+    total_len:int = 0
+    doc_freqs:dict = field(default_factory = dict)
+    
+    @property
+    def avg_doc_len(self) -> float:
+        return self.total_len / max(self.n_docs, 1)
+    
+    def idf(self, terms:List[str]) -> np.ndarray:
+        doc_freqs = np.asarray([self.doc_freqs.get(term, 0) for term in terms], dtype = np.int64)
+        return np.log((self.n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5) + 1)
+    
+    def __add__(self, other:"CollectionStats") -> "CollectionStats":
+        doc_freqs = Counter(self.doc_freqs)
+        doc_freqs.update(other.doc_freqs)
+        return CollectionStats(self.n_docs + other.n_docs, self.total_len + other.total_len, dict(doc_freqs))
+
+def _tokenize_chunk(tokenizer, documents:List[str]) -> List[List[str]]:
+    return [tokenizer.tokenize_doc(doc) for doc in documents]
+
+@dataclass
 class Tokenizer:
+    """Lowercases, strips punctuation and digits, splits on whitespace and drops stop words.
+    
+    Args:
+        stop_words (bool, optional): remove stop words. Defaults to True.
+        language (str, optional): language of the stop words. Defaults to "english".
+        offline (bool, optional): never download the nltk stopwords corpus, fall back to
+            the bundled english list when it is not installed. Defaults to False.
+        n_jobs (int, optional): processes used by tokenize_batch, -1 for all cpus. Defaults to 1.
+        chunk_size (int, optional): documents sent to a process at a time. Defaults to 2000.
+    """
+    
+    stop_words:bool = True
+    language:str = "english"
+    offline:bool = False
+    n_jobs:int = 1
+    chunk_size:int = 2000
+    
+    @property
+    def stop_word_set(self) -> frozenset:
+        return load_stop_words(self.language, self.offline) if self.stop_words else frozenset()
     
     def tokenize_doc(self, doc:str) -> list:
         """Tokenize a single document of string type"""
         if not isinstance(doc, str):
             raise ValueError("doc must be a string")
-        doc = remove_punctuation_and_numbers(doc)
-        doc = make_lowercase(doc)
-        doc = remove_stop_words(doc)
-        return [word.strip() for word in doc.lower().split(" ")]
+        stop_words = self.stop_word_set
+        return [word for word in doc.translate(PUNCTUATION_AND_NUMBERS).lower().split() if word not in stop_words]
         
-    def tokenize_batch(self, documents:List[str]) -> List[List[str]]:
-        """Tokenize a batch of documents of string type"""
+    def tokenize_batch(self, documents:List[str], n_jobs:int = None) -> List[List[str]]:
+        """Tokenize a batch of documents of string type, in n_jobs processes when n_jobs > 1"""
         if not isinstance(documents, list):
             raise ValueError("documents must be a list of strings")
-        return [self.tokenize_doc(doc) for doc in documents]
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        if n_jobs <= 1 or len(documents) <= self.chunk_size:
+            return _tokenize_chunk(self, documents)
+        
+        self.stop_word_set  # load, and download if needed, once before forking
+        chunks = [documents[i:i + self.chunk_size] for i in range(0, len(documents), self.chunk_size)]
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            tokenized = executor.map(_tokenize_chunk, itertools.repeat(self), chunks)
+            return list(itertools.chain.from_iterable(tokenized))
     
     def tokenize(self, documents:List[str] | str) -> List[List[str]]:
         """Tokenize either a batch of documents or a single document"""
@@ -72,155 +215,746 @@ class BM25Model:
     
     k1:float
     b:float
-    tokenizer:Tokenizer = Tokenizer()
+    tokenizer:Tokenizer = field(default_factory = Tokenizer)
     fitted:bool = False
+    merge_ratio:float = 0.2
+    max_segments:int = 8
+    cache:ResultCache = None
+    
+    def __post_init__(self):
+        self._lock = threading.RLock()
+        self._merging = False
+        self.reset()
+        
+    def reset(self) -> None:
+        """Drop all indexed documents"""
+        with self._lock:
+            self.segments = []
+            self.documents = TextStore()
+            self.ids = TextStore()
+            self.deleted = np.zeros(0, dtype = bool)
+            self._positions = None
+            self._next_id = 0
+            self._n_live = 0
+            self._total_len = 0
+            # document frequencies of tombstoned documents, until they get merged away
+            self._deleted_df = Counter()
+        self._invalidate_cache()
+    
+    def _invalidate_cache(self) -> None:
+        """Move cached search results to a new namespace, call after every change of the corpus.
+
+        A namespace names one state of one corpus: models sharing a cache never see
+        each other's results, except processes that loaded the same dump, which `dump`
+        writes the namespace into. The old namespace is invalidated as well, so a
+        search that raced with the change is not served to those processes.
+        """
+        if self.cache is not None and hasattr(self, "cache_namespace"):
+            self.cache.invalidate(self.cache_namespace)
+        self.cache_namespace = new_cache_namespace()
+    
+    @staticmethod
+    def _tmp_folder(dump_folder:Path) -> Path:
+        """Empty sibling folder a dump is written into before being swapped in"""
+        tmp_folder = dump_folder.with_name(f"{dump_folder.name}.tmp-{os.getpid()}")
+        shutil.rmtree(tmp_folder, ignore_errors = True)
+        tmp_folder.mkdir(parents = True)
+        return tmp_folder
+    
+    @staticmethod
+    def _swap_folder(tmp_folder:Path, dump_folder:Path) -> None:
+        if dump_folder.exists():
+            old_folder = dump_folder.with_name(f"{dump_folder.name}.old-{os.getpid()}")
+            os.rename(dump_folder, old_folder)
+            os.rename(tmp_folder, dump_folder)
+            shutil.rmtree(old_folder)
+        else:
+            os.rename(tmp_folder, dump_folder)
+    
+    def _write_meta(self, folder:Path, n_segments:int, ids_dtype:str, next_id:int, n_live:int, total_len:int,
+                    cache_namespace:str) -> None:
+        meta = {
+            "format": "bm25",
+            "format_version": FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "merge_ratio": self.merge_ratio,
+            "max_segments": self.max_segments,
+            "tokenizer": tokenizer_config(self.tokenizer),
+            "n_segments": n_segments,
+            "ids_dtype": ids_dtype,
+            "next_id": next_id,
+            "n_live": n_live,
+            "total_len": total_len,
+            "cache_namespace": cache_namespace,
+        }
+        with open(folder / "meta.json", "w") as f:
+            json.dump(meta, f)
     
     def dump(self, path:str = "bm25_model_dump"):
+        """Write the model as a directory of flat arrays, see `load`.
+
+        The directory is written next to path and swapped in when complete, so
+        processes still memory-mapping a previous dump keep working.
+        """
         if not self.fitted:
             raise ValueError("Model not fitted yet")
         
         dump_folder = Path(path)
+        tmp_folder = self._tmp_folder(dump_folder)
         
-        if not os.path.exists(dump_folder):
-            os.makedirs(dump_folder)
+        with self._lock:
+            id_types = {type(id_) for id_ in self.ids}
+            ids_dtype = "int" if id_types == {int} else "str" if id_types <= {str} else "json"
             
-        tokenizer_path = dump_folder / "tokenizer.pkl"
-        idf_dict_path = dump_folder / "idf_dict.json"
-        document_word_counts_path = dump_folder / "document_word_counts.pkl"
-        documents_path = dump_folder / "documents.pkl"
-        params_path = dump_folder / "params.json"
-        params = {"k1":self.k1, "b":self.b, "avg_doc_len":self.avg_doc_len}
-        
-        # save parameters as a json file
-        with open(params_path, "w") as f:
-            json.dump(params, f)
-        
-        # save ifdf data to a json file
-        with open(idf_dict_path, "w") as f:
-            json.dump(self.idf_dict, f)
+            # postings, vocabulary and document lengths of each segment as flat arrays
+            for i, segment in enumerate(self.segments):
+                segment.save(tmp_folder / "segments" / str(i))
+            
+            # documents and ids as UTF-8 buffers with offsets
+            self.documents.save(tmp_folder, "documents")
+            self.ids.save(tmp_folder, "ids", dtype = ids_dtype)
+            
+            # tombstones and the document frequencies they take away
+            np.save(tmp_folder / "deleted.npy", self.deleted)
+            with open(tmp_folder / "deleted_df.json", "w") as f:
+                json.dump(self._deleted_df, f)
             
-        # save tokenizer to a pickle
-        with open(tokenizer_path, "wb") as f:
-            pickle.dump(self.tokenizer,f)
+            self._write_meta(tmp_folder, len(self.segments), ids_dtype, self._next_id, self._n_live, self._total_len,
+                             self.cache_namespace)
+            
+        self._swap_folder(tmp_folder, dump_folder)
+    
+    def fit_stream(self, source, path:str, chunk_size:int = 100000, text_field:str = "text", 
+                   id_field:str = None, mmap:bool = True):
+        """Fit on a corpus larger than memory, the index is built on disk at path.
+
+        Documents are read from source in chunks of chunk_size. Each chunk is indexed
+        into a segment that is spilled to disk (SPIMI), and the spilled segments are
+        merged on disk into a dump at path, which the model then loads, see `load`.
+        Peak memory is bounded by chunk_size and the vocabulary, not by the corpus.
+
+        Args:
+            source: an iterable of strings, or the path of a text file (one document
+                per line) or of a .jsonl file (one record per line, see text_field).
+            path (str): folder of the resulting dump.
+            chunk_size (int, optional): documents per spilled segment. Defaults to 100000.
+            text_field (str, optional): field of the document text in JSONL records. Defaults to "text".
+            id_field (str, optional): field of the document id in JSONL records, ids are
+                positions when None. Defaults to None.
+            mmap (bool, optional): memory-map the resulting dump. Defaults to True.
+        """
+        dump_folder = Path(path)
+        tmp_folder = self._tmp_folder(dump_folder)
+        spill_folder = tmp_folder / "spill"
         
-        # save document_word_counts to a pickle
-        with open(document_word_counts_path, "wb") as f:
-            pickle.dump(self.document_word_counts,f)
+        n_docs, total_len, segments = 0, 0, []
+        text_offsets = {"documents": ArrayWriter(tmp_folder / "documents_offsets.npy", np.int64),
+                        "ids": ArrayWriter(tmp_folder / "ids_offsets.npy", np.int64)}
+        text_ends = {"documents": 0, "ids": 0}
         
-        # save documents to a pickle
-        with open(documents_path, "wb") as f:
-            pickle.dump(self.documents,f)
-    
-    def tokenize_documents(self, documents:List[str]) -> List[List[str]]:
-                
-        self.documents = documents
+        def write_texts(name, texts, f):
+            encoded = [text.encode("utf-8") for text in texts]
+            f.write(b"".join(encoded))
+            offsets = text_ends[name] + np.cumsum([0] + [len(e) for e in encoded])
+            text_offsets[name].append(offsets[1:] if n_docs else offsets)
+            text_ends[name] = int(offsets[-1])
         
-        self.tokenized_documents = self.tokenizer(documents)
+        with open(tmp_folder / "documents.bin", "wb") as documents_file, open(tmp_folder / "ids.bin", "wb") as ids_file:
+            records = read_documents(source, text_field = text_field, id_field = id_field)
+            while True:
+                chunk = list(itertools.islice(records, chunk_size))
+                if not chunk:
+                    break
+                texts = [text for text, _ in chunk]
+                segment = InvertedIndex.from_tokenized(self.tokenize_documents(texts))
+                segment.save(spill_folder / str(len(segments)))
+                segments.append(spill_folder / str(len(segments)))
+                
+                if id_field is None:
+                    ids = [str(i) for i in range(n_docs, n_docs + len(chunk))]
+                else:
+                    ids = [json.dumps(id_) for _, id_ in chunk]
+                write_texts("documents", texts, documents_file)
+                write_texts("ids", ids, ids_file)
+                n_docs += len(chunk)
+                total_len += int(segment.doc_lens.sum())
+                del chunk, texts, segment
+                
+        if n_docs == 0:
+            shutil.rmtree(tmp_folder)
+            raise ValueError("No documents to fit")
+        for writer in text_offsets.values():
+            writer.close()
+                
+        InvertedIndex.merge_to_disk(
+            [InvertedIndex.load(folder) for folder in segments], tmp_folder / "segments" / "0")
+        shutil.rmtree(spill_folder)
         
-        self.document_word_counts = [
-            dict(Counter(tokenized_doc)) 
-            for tokenized_doc in self.tokenized_documents
-        ]
+        np.save(tmp_folder / "deleted.npy", np.zeros(n_docs, dtype = bool))
+        with open(tmp_folder / "deleted_df.json", "w") as f:
+            json.dump({}, f)
+        self._write_meta(tmp_folder, 1, "int" if id_field is None else "json", n_docs, n_docs, total_len,
+                         new_cache_namespace())
+        self._swap_folder(tmp_folder, dump_folder)
         
-        self.avg_doc_len = np.mean([len(doc) for doc in self.tokenized_documents])
+        loaded = self.load(dump_folder, mmap = mmap)
+        with self._lock:
+            self.reset()
+            for name in ("segments", "documents", "ids", "deleted", "_deleted_df", "_next_id", "_n_live", "_total_len",
+                         "cache_namespace"):
+                setattr(self, name, getattr(loaded, name))
+            self.fitted = True
+        return self
+    
+    def tokenize_documents(self, documents:List[str]) -> List[List[str]]:
+        return self.tokenizer(documents)
     
     @classmethod  
-    def load(cls, path):
+    def load(cls, path, mmap:bool = True, cache:ResultCache = None):
+        """Load a model written by `dump`.
+
+        With mmap=True postings, vocabularies, document lengths and document texts
+        are memory-mapped rather than read: loading is near-instant, forked workers
+        share the pages, and document texts are only decoded for returned hits.
+        Processes loading the same dump share the cached results of a shared cache.
+        """
         load_path = Path(path)
         
-        tokenizer_path = load_path / "tokenizer.pkl"
-        idf_dict_path = load_path / "idf_dict.json"
-        document_word_counts_path = load_path / "document_word_counts.pkl"
-        documents_path = load_path / "documents.pkl"
-        params_path = load_path / "params.json"
+        if not (load_path / "meta.json").exists():
+            return cls._load_pickled(load_path)
         
-        # load tokenizer
-        with open(tokenizer_path, "rb") as f:
-            tokenizer = pickle.load(f)
+        with open(load_path / "meta.json", "r") as f:
+            meta = json.load(f)
             
-        # load idf_dict
-        with open(idf_dict_path, "r") as f:
-            idf_dict = json.load(f)
+        # segments of version 1 dumps are uncompressed, InvertedIndex.load compresses them
+        if meta.get("format_version") not in (1, FORMAT_VERSION):
+            raise ValueError(f"Unsupported BM25 dump format version: {meta.get('format_version')}")
             
-        # load document_word_counts
-        with open(document_word_counts_path, "rb") as f:
-            document_word_counts = pickle.load(f)
+        obj = cls(
+            k1 = meta['k1'], 
+            b = meta['b'], 
+            tokenizer = tokenizer_from_config(meta['tokenizer']), 
+            fitted = True,
+            merge_ratio = meta['merge_ratio'],
+            max_segments = meta['max_segments'],
+            cache = cache)
+        
+        obj.segments = [
+            InvertedIndex.load(load_path / "segments" / str(i), mmap = mmap) 
+            for i in range(meta['n_segments'])
+        ]
+        obj.documents = TextStore.load(load_path, "documents", mmap = mmap)
+        obj.ids = TextStore.load(load_path, "ids", mmap = mmap, dtype = meta['ids_dtype'])
+        obj.deleted = np.load(load_path / "deleted.npy")
+        
+        with open(load_path / "deleted_df.json", "r") as f:
+            obj._deleted_df = Counter(json.load(f))
+        
+        obj._next_id = meta['next_id']
+        obj._n_live = meta['n_live']
+        obj._total_len = meta['total_len']
+        # dumps written before cached results were namespaced by dump keep the random one
+        obj.cache_namespace = meta.get('cache_namespace', obj.cache_namespace)
+        
+        return obj
+    
+    @classmethod
+    def _load_pickled(cls, load_path:Path):
+        """Load a dump of the former pickle format by re-fitting its documents"""
+        with open(load_path / "tokenizer.pkl", "rb") as f:
+            tokenizer = pickle.load(f)
+        if isinstance(tokenizer, Tokenizer) and not vars(tokenizer):
+            # pickled before Tokenizer had fields
+            tokenizer = Tokenizer()
             
-        # load documents
-        with open(documents_path, "rb") as f:
+        with open(load_path / "documents.pkl", "rb") as f:
             documents = pickle.load(f)
             
-        # load params
-        with open(params_path, "r") as f:
+        with open(load_path / "params.json", "r") as f:
             params = json.load(f)
             
-        obj = cls(k1 = params['k1'], b = params['b'], tokenizer = tokenizer, fitted = True)
-        obj.idf_dict = idf_dict
-        obj.document_word_counts = document_word_counts
-        obj.documents = documents
-        obj.avg_doc_len = params['avg_doc_len']
+        logging.warning("Loading a pickled BM25 dump, re-fitting its documents. Dump it again to upgrade.")
+        return cls(k1 = params['k1'], b = params['b'], tokenizer = tokenizer).fit(documents)
+    
+    @property
+    def avg_doc_len(self) -> float:
+        return self._total_len / max(self._n_live, 1)
+    
+    @property
+    def n_docs(self) -> int:
+        """Number of live documents"""
+        return self._n_live
+    
+    def _bases(self) -> List[int]:
+        """Position of the first document of each segment"""
+        return np.cumsum([0] + [seg.n_docs for seg in self.segments]).tolist()
+    
+    def _segment_masks(self) -> List[np.ndarray]:
+        """Tombstone mask of each segment"""
+        bases = self._bases()
+        return [self.deleted[start:end] for start, end in zip(bases[:-1], bases[1:])]
         
-        return obj
+    def _lookup(self, terms:List[str]) -> List[np.ndarray]:
+        """Term ids of terms in every segment, -1 where absent"""
+        return [segment.lookup(terms) for segment in self.segments]
+        
+    def document_frequencies(self, terms:List[str], term_ids:List[np.ndarray] = None) -> np.ndarray:
+        """Number of live documents containing each term, from the maintained counts"""
+        term_ids = self._lookup(terms) if term_ids is None else term_ids
+        doc_freqs = np.zeros(len(terms), dtype = np.int64)
+        for segment, segment_term_ids in zip(self.segments, term_ids):
+            found = segment_term_ids >= 0
+            doc_freqs[found] += segment.doc_freq(segment_term_ids[found])
+        doc_freqs -= np.asarray([self._deleted_df.get(term, 0) for term in terms], dtype = np.int64)
+        return doc_freqs
+        
+    def compute_idf(self, terms:List[str], term_ids:List[np.ndarray] = None) -> np.ndarray:
+        """idf of each term, computed at query time from the current document frequencies"""
+        N = self._n_live
+        doc_freqs = self.document_frequencies(terms, term_ids)
+        return np.log((N - doc_freqs + 0.5) / (doc_freqs + 0.5) + 1)
+        
+    def collection_stats(self, terms:List[str]) -> CollectionStats:
+        """Statistics of the live documents for the given terms, see `CollectionStats`"""
+        with self._lock:
+            doc_freqs = self.document_frequencies(terms)
+            return CollectionStats(self._n_live, self._total_len, dict(zip(terms, doc_freqs.tolist())))
+    
+    def _query_stats(self, terms:List[str], term_ids:List[np.ndarray], 
+                     stats:CollectionStats = None) -> Tuple[np.ndarray, float]:
+        """idf of terms and the average document length, from stats if given or from this index"""
+        if stats is None:
+            return self.compute_idf(terms, term_ids), self.avg_doc_len
+        return stats.idf(terms), stats.avg_doc_len
+        
+    @property
+    def idf_dict(self) -> dict[str, float]:
+        terms = list({term: None for segment in self.segments for term in segment.vocabulary})
+        return dict(zip(terms, self.compute_idf(terms)))
+        
+    def fit(self, documents, ids:list = None):
+        self.reset()
+        self.add_documents(documents, ids = ids)
+        return self
+    
+    def add_documents(self, documents:List[str], ids:list = None) -> list:
+        """Index new documents as a new segment, returns their ids.
+
+        Only the new documents are tokenized; document frequencies and the
+        average document length are updated from the new segment alone.
+        Ids must be unique: ValueError for an id given twice or already indexed,
+        remove the document first to replace it.
+        """
+        new_ids = ids is None
+        if new_ids:
+            ids = list(range(self._next_id, self._next_id + len(documents)))
+        elif len(ids) != len(documents):
+            raise ValueError("ids and documents must have the same length")
             
+        segment = InvertedIndex.from_tokenized(self.tokenize_documents(list(documents)))
         
-    def compute_idf(self, tokenized_documents: List[List[str]]) -> dict[str, float]:
-        N = len(tokenized_documents)
-        idf_dict = {}
-        for tokenized_doc in tokenized_documents:
-            for word in set(tokenized_doc):
-                idf_dict[word] = idf_dict.get(word, 0) + 1       
+        with self._lock:
+            if not new_ids:
+                self._check_new_ids(ids)
+            if self._positions is not None:
+                self._positions.update((id_, position) for position, id_ in enumerate(ids, len(self.ids)))
+            self.segments.append(segment)
+            self.documents.extend(documents)
+            self.ids.extend(ids)
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(documents), dtype = bool)])
+            self._next_id = max([self._next_id] + [i + 1 for i in ids if isinstance(i, int)])
+            self._n_live += len(documents)
+            self._total_len += int(segment.doc_lens.sum())
+            self.fitted = True
+            
+        self._invalidate_cache()
+        self._maybe_compact()
+        return ids
+    
+    def _position_of(self) -> dict:
+        """Position of the last document of every id, live unless the id was removed. Call under the lock."""
+        if self._positions is None:
+            self._positions = {id_: position for position, id_ in enumerate(self.ids)}
+        return self._positions
+    
+    def _check_new_ids(self, ids:list) -> None:
+        """ValueError for ids given twice or of live documents. Call under the lock."""
+        duplicated = [id_ for id_, count in Counter(ids).items() if count > 1]
+        if duplicated:
+            raise ValueError(f"Duplicate document ids: {duplicated[:10]}")
+        positions = self._position_of()
+        existing = [id_ for id_ in ids if id_ in positions and not self.deleted[positions[id_]]]
+        if existing:
+            raise ValueError(f"Document ids already indexed: {existing[:10]}, remove them first")
+    
+    def _id_positions(self, ids:list) -> np.ndarray:
+        """Positions of documents by id, ValueError for unknown ids. Call under the lock."""
+        self._position_of()
+        missing = [id_ for id_ in ids if id_ not in self._positions]
+        if missing:
+            raise ValueError(f"Unknown document ids: {missing[:10]}")
+        return np.asarray([self._positions[id_] for id_ in ids], dtype = np.int64)
+    
+    def remove_documents(self, ids:list) -> None:
+        """Tombstone documents by id.
 
-        for word, doc_count in idf_dict.items():
-            idf_dict[word] = np.log((N - doc_count + 0.5) / (doc_count + 0.5) + 1)
+        Statistics are updated by re-tokenizing only the removed documents;
+        their postings are dropped by the next merge, see `compact`.
+        """
+        with self._lock:
+            positions = self._id_positions(ids)
+            positions = np.unique(positions[~self.deleted[positions]])
+            if len(positions) == 0:
+                return
+            
+            bases = np.asarray(self._bases())
+            owners = np.searchsorted(bases, positions, side = "right") - 1
+            doc_lens = [self.segments[o].doc_lens[p - bases[o]] for o, p in zip(owners, positions)]
+            for tokens in self.tokenize_documents([self.documents[p] for p in positions]):
+                self._deleted_df.update(set(tokens))
+                
+            self.deleted[positions] = True
+            self._n_live -= len(positions)
+            self._total_len -= int(np.sum(doc_lens))
+            
+        self._invalidate_cache()
+        self._maybe_compact()
         
-        self.idf_dict = idf_dict
+    def _maybe_compact(self) -> None:
+        n_total = len(self.documents)
+        n_deleted = n_total - self._n_live
+        if len(self.segments) > self.max_segments or (n_total and n_deleted / n_total > self.merge_ratio):
+            self.compact(background = True)
+    
+    def compact(self, background:bool = False):
+        """Merge all segments into one and drop tombstoned documents.
+
+        With background=True the merge runs in a daemon thread, which is returned;
+        searches and updates keep working on the old segments until the merged
+        segment is swapped in.
+        """
+        if background:
+            thread = threading.Thread(target = self._compact, daemon = True)
+            thread.start()
+            return thread
+        self._compact()
         
-    def fit(self, documents):
-        self.tokenize_documents(documents)        
-        self.compute_idf(self.tokenized_documents)
-        self.fitted = True
-        return self
+    def _compact(self) -> None:
+        with self._lock:
+            if self._merging:
+                return
+            self._merging = True
+            segments = list(self.segments)
+            masks = [mask.copy() for mask in self._segment_masks()]
+            deleted_df = Counter(self._deleted_df)
+            
+        try:
+            merged = InvertedIndex.merge(segments, keep_masks = [~mask for mask in masks])
+            
+            with self._lock:
+                n_merged = sum(seg.n_docs for seg in segments)
+                keep = ~np.concatenate(masks + [np.zeros(0, dtype = bool)])
+                kept = np.concatenate([np.flatnonzero(keep), np.arange(n_merged, len(self.documents))])
+                # documents removed while merging stay tombstoned in the new numbering
+                self.deleted = np.concatenate([self.deleted[:n_merged][keep], self.deleted[n_merged:]])
+                self.documents = self.documents.take(kept)
+                self.ids = self.ids.take(kept)
+                self.segments = [merged] + self.segments[len(segments):]
+                self._deleted_df.subtract(deleted_df)
+                self._deleted_df = +self._deleted_df
+                self._positions = None
+        finally:
+            self._merging = False
     
-    def get_score(self, query, doc):
-        score = 0
-        # tokenized query
-        tokenized_query = self.tokenizer.tokenize_doc(query)
-        # tokenize doc, with counter
-        doc_word_count = dict(Counter(self.tokenizer.tokenize_doc(doc)))
-        # for each word in query
-        for word in tokenized_query:
-            # check the occurance of the word in the doc
-            word_cnt = doc_word_count.get(word, 0)
+    def get_score(self, query:str, doc:str) -> float:
+        """Score of a query against a document text, see `score_candidates`"""
+        return float(self.score_candidates(query, texts = [doc])[0])
+    
+    def score_candidates(self, query:str, ids:list = None, texts:List[str] = None, 
+                         stats:CollectionStats = None) -> np.ndarray:
+        """Score a query against candidate documents only, e.g. to rerank the hits of a vector store.
+
+        Candidates are either indexed documents, by id, whose term frequencies and
+        lengths are read from the index, or texts, tokenized as one batch. Both are
+        scored in one vectorized pass with the statistics of the index.
+
+        Args:
+            query (str): the query string.
+            ids (list, optional): ids of indexed documents. Defaults to None.
+            texts (List[str], optional): document texts, not necessarily indexed. Defaults to None.
+            stats (CollectionStats, optional): score with these statistics, see `search`. Defaults to None.
+
+        Returns:
+            np.ndarray: one score per candidate, in order; removed documents score -inf.
+        """
+        if (ids is None) == (texts is None):
+            raise ValueError("Pass either ids or texts")
+        
+        query_counts = Counter(self.tokenizer.tokenize_doc(query))
+        terms = list(query_counts)
+        weights = np.asarray([query_counts[term] for term in terms], dtype = float)
+        if texts is not None:
+            tokenized = self.tokenizer.tokenize_batch(list(texts))
+            
+        with self._lock:
+            term_ids = self._lookup(terms)
+            idf, avg_doc_len = self._query_stats(terms, term_ids, stats)
             
-            score += self.idf_dict.get(word,0) * (
-                word_cnt * (self.k1 + 1) / (word_cnt + self.k1 * (1 - self.b + self.b * len(doc) / self.avg_doc_len)) 
-                )
-        return score
+            if texts is not None:
+                term_index = {term: i for i, term in enumerate(terms)}
+                doc_lens = np.asarray([len(tokens) for tokens in tokenized], dtype = np.int64)
+                cols = np.repeat(np.arange(len(tokenized)), doc_lens)
+                rows = np.asarray([term_index.get(token, -1) for tokens in tokenized for token in tokens], dtype = np.int64)
+                found = rows >= 0
+                tfs = np.bincount(rows[found] * len(tokenized) + cols[found], 
+                                  minlength = len(terms) * len(tokenized)).reshape(len(terms), len(tokenized))
+                deleted = np.zeros(len(tokenized), dtype = bool)
+            else:
+                positions = self._id_positions(ids)
+                tfs = np.zeros((len(terms), len(positions)), dtype = np.int64)
+                doc_lens = np.zeros(len(positions), dtype = np.int64)
+                bases = np.asarray(self._bases())
+                owners = np.searchsorted(bases, positions, side = "right") - 1
+                for s, (segment, segment_term_ids) in enumerate(zip(self.segments, term_ids)):
+                    candidates = np.flatnonzero(owners == s)
+                    local = positions[candidates] - bases[s]
+                    doc_lens[candidates] = segment.doc_lens[local]
+                    found = np.flatnonzero(segment_term_ids >= 0)
+                    tfs[np.ix_(found, candidates)] = segment.term_frequencies(segment_term_ids[found], local)
+                deleted = self.deleted[positions]
+                
+        scores = (weights * idf) @ self._term_impact(tfs, doc_lens[None, :], avg_doc_len)
+        scores[deleted] = -np.inf
+        return scores
+    
+    def _query_matrix(self, tokenized_queries:List[List[str]]):
+        """Sparse query-term matrix in coordinate form, duplicated terms summed up.
+
+        Returns (rows, cols, query_tfs, terms), cols index into terms.
+        """
+        vocabulary = {}
+        cols = [vocabulary.setdefault(token, len(vocabulary)) for tokens in tokenized_queries for token in tokens]
+        rows = np.repeat(np.arange(len(tokenized_queries)), [len(tokens) for tokens in tokenized_queries])
+        n_terms = max(len(vocabulary), 1)
+        keys, query_tfs = np.unique(rows * n_terms + np.asarray(cols, dtype = np.int64), return_counts = True)
+        rows, cols = np.divmod(keys, n_terms)
+        return rows, cols, query_tfs, list(vocabulary)
     
-    def search(self, query:str,n:int = None):
+    def _term_impact(self, tfs:np.ndarray, doc_lens:np.ndarray, avg_doc_len:float) -> np.ndarray:
+        """tf part of the BM25 term score, normalized by the average document length"""
+        norm = self.k1 * (1 - self.b + self.b * doc_lens / max(avg_doc_len, 1e-9))
+        return tfs * (self.k1 + 1) / (tfs + norm)
+    
+    def _query_postings(self, rows:np.ndarray, cols:np.ndarray, query_tfs:np.ndarray, 
+                        idf:np.ndarray, term_ids:List[np.ndarray], avg_doc_len:float):
+        """Entries (rows, doc_ids, impacts) of the product of a sparse query-term matrix with the term-document impact matrix.
+
+        The query-term matrix is given in coordinate form, idf and the per-segment
+        term_ids are indexed by cols. Only the postings of the query terms are
+        gathered, once per segment; entries are not summed up and tombstoned
+        documents are kept.
+        """
+        weights = query_tfs * idf[cols]
         
-        tokenized_query = self.tokenizer.tokenize_doc(query)
+        entry_rows, entry_docs, impacts = [], [], []
+        for segment, base, segment_term_ids in zip(self.segments, self._bases(), term_ids):
+            segment_term_ids = segment_term_ids[cols]
+            found = np.flatnonzero(segment_term_ids >= 0)
+            owner, doc_ids, tfs = segment.gather_postings(segment_term_ids[found])
+            owner = found[owner]
+            entry_rows.append(rows[owner])
+            entry_docs.append(base + doc_ids)
+            impacts.append(weights[owner] * self._term_impact(tfs, segment.doc_lens[doc_ids], avg_doc_len))
         
-        scores = []
-        for doc_wc in self.document_word_counts:
-            score = 0
-            for word in tokenized_query:
-                word_cnt = doc_wc.get(word, 0)
-                score += self.idf_dict.get(word,0) * (
-                    word_cnt * (self.k1 + 1) / (word_cnt + self.k1 * (1 - self.b + self.b * len(doc_wc) / self.avg_doc_len)) 
-                    )
-            scores.append(score)
+        empty = np.zeros(0, dtype = np.int64)
+        return (np.concatenate(entry_rows + [empty]), np.concatenate(entry_docs + [empty]), 
+                np.concatenate(impacts + [np.zeros(0)]))
+    
+    def _score_matrix(self, rows:np.ndarray, cols:np.ndarray, query_tfs:np.ndarray, 
+                      idf:np.ndarray, term_ids:List[np.ndarray], n_rows:int, avg_doc_len:float) -> np.ndarray:
+        """Dense (n_rows, n_docs) scores of a sparse query-term matrix given in coordinate form.
 
-        idx = np.argsort(scores)[::-1]
+        See `_query_postings`, tombstoned documents score -inf.
+        """
+        n_docs = len(self.documents)
+        entry_rows, entry_docs, impacts = self._query_postings(rows, cols, query_tfs, idf, term_ids, avg_doc_len)
+        scores = np.bincount(
+            entry_rows * n_docs + entry_docs, weights = impacts, 
+            minlength = n_rows * n_docs).astype(float, copy = False).reshape(n_rows, n_docs)
+        scores[:, self.deleted] = -np.inf
+        return scores
+    
+    def _score_query(self, tokenized_query:List[str], stats:CollectionStats = None) -> np.ndarray:
+        """Score every document against a single tokenized query"""
+        rows, cols, query_tfs, terms = self._query_matrix([tokenized_query])
+        term_ids = self._lookup(terms)
+        idf, avg_doc_len = self._query_stats(terms, term_ids, stats)
+        return self._score_matrix(rows, cols, query_tfs, idf, term_ids, n_rows = 1, avg_doc_len = avg_doc_len)[0]
+    
+    def _top_n_pruned(self, tokenized_query:List[str], n:int, 
+                      stats:CollectionStats = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top n (doc_indices, scores) by block-max pruning, the same hits as exhaustive scoring.
+
+        Every (segment, block) gets an upper bound: the sum over query terms of the
+        term's impact at the block's largest tf and smallest document length. Blocks
+        are scored exactly, best bounds first and in growing batches, as long as their
+        bound can still reach the n-th best score found so far.
+        """
+        rows, cols, query_tfs, terms = self._query_matrix([tokenized_query])
+        term_ids = self._lookup(terms)
+        idf, avg_doc_len = self._query_stats(terms, term_ids, stats)
+        return self._top_n_blocks(cols, query_tfs, idf, term_ids, n, avg_doc_len)
+    
+    def _top_n_blocks(self, cols:np.ndarray, query_tfs:np.ndarray, idf:np.ndarray, term_ids:List[np.ndarray],
+                      n:int, avg_doc_len:float) -> Tuple[np.ndarray, np.ndarray]:
+        """Block-max pruned top n of one query given by its terms cols, idf and term_ids being indexed by cols"""
+        weights = query_tfs * idf[cols]
+        bases = self._bases()
         
-        if n is None:
+        segment_blocks = []
+        bound_segments, bound_blocks, bounds = [], [], []
+        for s, (segment, segment_term_ids) in enumerate(zip(self.segments, term_ids)):
+            segment_term_ids = segment_term_ids[cols]
+            found = np.flatnonzero(segment_term_ids >= 0)
+            owner, positions, block_ids, block_starts = segment.gather_blocks(segment_term_ids[found])
+            owner = found[owner]
+            segment_blocks.append((owner, positions, block_ids, block_starts))
+            
+            term_bounds = weights[owner] * self._term_impact(
+                segment.block_max_tf[positions], segment.block_min_len[positions], avg_doc_len)
+            block_bounds = np.bincount(block_ids, weights = term_bounds, minlength = segment.n_blocks)
+            blocks = np.flatnonzero(block_bounds > 0)
+            bound_segments.append(np.full(len(blocks), s))
+            bound_blocks.append(blocks)
+            bounds.append(block_bounds[blocks])
+            
+        bound_segments = np.concatenate(bound_segments + [np.zeros(0, dtype = np.int64)])
+        bound_blocks = np.concatenate(bound_blocks + [np.zeros(0, dtype = np.int64)])
+        bounds = np.concatenate(bounds + [np.zeros(0)])
         
+        top_docs, top_scores = np.zeros(0, dtype = np.int64), np.zeros(0)
+        threshold = -np.inf
+        pending = np.ones(len(bounds), dtype = bool)
+        batch = 64
+        while True:
+            # leave some slack for the different summation order of bounds and scores
+            chosen = np.flatnonzero(pending & (bounds >= threshold - 1e-9 * abs(threshold)))
+            if len(chosen) == 0:
+                break
+            if len(chosen) > batch:
+                chosen = chosen[np.argpartition(-bounds[chosen], batch - 1)[:batch]]
+            pending[chosen] = False
+            batch *= 2
+            
+            docs, scores = [top_docs], [top_scores]
+            for s in np.unique(bound_segments[chosen]):
+                segment = self.segments[s]
+                owner, positions, block_ids, block_starts = segment_blocks[s]
+                # slot of each chosen block in a dense score buffer of BLOCK_SIZE per block
+                chosen_blocks = bound_blocks[chosen][bound_segments[chosen] == s]
+                slots = np.full(segment.n_blocks, -1)
+                slots[chosen_blocks] = np.arange(len(chosen_blocks))
+                keep = slots[block_ids] >= 0
+                
+                block_owner, doc_ids, tfs = segment.gather_block_postings(positions[keep], block_ids[keep], block_starts[keep])
+                impacts = weights[owner[keep]][block_owner] * self._term_impact(tfs, segment.doc_lens[doc_ids], avg_doc_len)
+                buffer_index = slots[doc_ids // BLOCK_SIZE] * BLOCK_SIZE + doc_ids % BLOCK_SIZE
+                block_scores = np.bincount(buffer_index, weights = impacts, minlength = len(chosen_blocks) * BLOCK_SIZE)
+                
+                hits = np.flatnonzero(block_scores > 0)
+                block_docs = bases[s] + chosen_blocks[hits // BLOCK_SIZE] * BLOCK_SIZE + hits % BLOCK_SIZE
+                live = ~self.deleted[block_docs]
+                docs.append(block_docs[live])
+                scores.append(block_scores[hits][live])
+            
+            top_docs, top_scores = np.concatenate(docs), np.concatenate(scores)
+            if len(top_docs) >= n:
+                idx = top_n_indices(top_scores, n)
+                top_docs, top_scores = top_docs[idx], top_scores[idx]
+                threshold = top_scores[-1] if n > 0 else np.inf
+        
+        if len(top_docs) < n:
+            # fewer matches than requested, pad with non-matching documents like exhaustive scoring
+            padding = np.flatnonzero(~self.deleted)
+            padding = padding[~np.isin(padding, top_docs)][:n - len(top_docs)]
+            top_docs = np.concatenate([top_docs, padding])
+            top_scores = np.concatenate([top_scores, np.zeros(len(padding))])
+            
+        idx = np.argsort(-top_scores, kind = "stable")
+        return top_docs[idx], top_scores[idx]
+    
+    def search(self, query:str,n:int = None, exhaustive:bool = False, stats:CollectionStats = None):
+        """Search documents with a query string.
+
+        Args:
+            query (str): the query string.
+            n (int, optional): number of hits, all live documents if None. Defaults to None.
+            exhaustive (bool, optional): score every document matching a query term instead
+                of block-max pruning; both return the same hits, pruning only applies when n
+                is given. Defaults to False.
+            stats (CollectionStats, optional): score with these statistics instead of the
+                ones of this index, e.g. those of a whole sharded collection. Defaults to None.
+
+        Returns:
+            dict: scores, documents and ids of the hits by decreasing score.
+        """
+        
+        tokenized_query = self.tokenizer.tokenize_doc(query)
+        
+        if self.cache is not None and stats is None:
+            # scores do not depend on the order of query tokens
+            return self.cache.get_or_compute(
+                self.cache_namespace, ["search", sorted(tokenized_query), n], 
+                lambda: self._search(tokenized_query, n, exhaustive, stats))
+        return self._search(tokenized_query, n, exhaustive, stats)
+    
+    def _search(self, tokenized_query:List[str], n:int, exhaustive:bool, stats:CollectionStats) -> dict:
+        with self._lock:
+            if n is None or exhaustive:
+                scores = self._score_query(tokenized_query, stats)
+                idx = top_n_indices(scores, self._n_live if n is None else min(n, self._n_live))
+                scores = scores[idx]
+            else:
+                idx, scores = self._top_n_pruned(tokenized_query, min(n, self._n_live), stats)
+            
             return {
-                "scores": np.array(scores)[idx].tolist(),
-                "documents": np.array(self.documents)[idx].tolist()
+                "scores": scores.tolist(),
+                "documents": [self.documents[i] for i in idx],
+                "ids": [self.ids[i] for i in idx]
             }
-        else:
-            return {
-                "scores": np.array(scores)[idx].tolist()[:n],
-                "documents": np.array(self.documents)[idx].tolist()[:n]
-            }
\ No newline at end of file
+    
+    def search_batch(self, queries:List[str], n:int = 10, 
+                     stats:CollectionStats = None) -> Tuple[List[list], np.ndarray]:
+        """Search a batch of queries, the same hits as `search` for each.
+
+        Queries are tokenized as one batch, and the segment ids and idf of their
+        terms are looked up once for the whole batch, from its sparse query-term
+        matrix. Each query is then answered by block-max pruning, which only scores
+        the blocks that can still reach its top n.
+
+        Args:
+            queries (List[str]): query strings.
+            n (int, optional): number of hits per query. Defaults to 10.
+            stats (CollectionStats, optional): score with these statistics, see `search`. Defaults to None.
+
+        Returns:
+            Tuple[List[list], np.ndarray]: (ids, scores), one list of n document ids and
+                one row of n scores per query, by decreasing score. Ids are resolved under
+                the lock, a background compaction renumbering documents cannot shift them.
+        """
+        tokenized_queries = self.tokenizer.tokenize_batch(list(queries))
+        rows, cols, query_tfs, terms = self._query_matrix(tokenized_queries)
+        row_starts = np.searchsorted(rows, np.arange(len(tokenized_queries) + 1))
+        
+        with self._lock:
+            term_ids = self._lookup(terms)
+            idf, avg_doc_len = self._query_stats(terms, term_ids, stats)
+            n = min(n, self._n_live)
+            ids, scores = [], np.zeros((len(tokenized_queries), n))
+            for q, (start, end) in enumerate(zip(row_starts[:-1], row_starts[1:])):
+                doc_indices, scores[q] = self._top_n_blocks(cols[start:end], query_tfs[start:end], idf, term_ids, 
+                                                            n, avg_doc_len)
+                ids.append([self.ids[i] for i in doc_indices])
+            
+        return ids, scores
@@ -0,0 +1,603 @@
+from bisect import bisect_left
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+import heapq
+import itertools
+import json
+import os
+import numpy as np
+
+
+def concat_ranges(starts:np.ndarray, ends:np.ndarray) -> np.ndarray:
+    """Concatenation of ``arange(start, end)`` for every (start, end) pair"""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype = np.int64)
+    # output slot i of a range maps to start + (i - position of the range in the output)
+    return np.arange(total, dtype = np.int64) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+
+def encode_strings(strings:List[str]):
+    """Encode strings into one UTF-8 buffer, returns (data, offsets)"""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+    np.cumsum([len(e) for e in encoded], out = offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype = np.uint8), offsets
+
+
+# width of the doc id ranges that block-max metadata is kept for, at most 256
+BLOCK_SIZE = 16
+
+
+def _load_array(path:Path, mmap:bool) -> np.ndarray:
+    return np.load(path, mmap_mode = "r" if mmap else None)
+
+
+def _indptr(counts:np.ndarray) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def min_uint_dtype(max_value:int) -> np.dtype:
+    """Smallest unsigned integer dtype holding values up to max_value"""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def segment_cumsum(values:np.ndarray, lengths:np.ndarray) -> np.ndarray:
+    """Cumulative sums of values restarting at every segment of the given lengths"""
+    sums = np.cumsum(values, dtype = np.int64)
+    before = np.concatenate([[0], sums])[np.cumsum(lengths) - lengths]
+    return sums - np.repeat(before, lengths)
+
+
+def encode_varints(values:np.ndarray):
+    """LEB128 encoding of non-negative integers, returns (data, bytes per value).
+
+    Every byte holds 7 bits of the value, low bits first; the high bit is set on
+    all bytes of a value but its last.
+    """
+    values = np.asarray(values, dtype = np.uint64)
+    n_bytes = np.ones(len(values), dtype = np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        n_bytes += rest > 0
+        rest >>= np.uint64(7)
+    data = np.zeros(int(n_bytes.sum()), dtype = np.uint8)
+    value_starts = np.cumsum(n_bytes) - n_bytes
+    for k in range(int(n_bytes.max()) if len(values) else 0):
+        has_byte = n_bytes > k
+        byte = (values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(n_bytes[has_byte] > k + 1, np.uint64(0x80), np.uint64(0))
+        data[value_starts[has_byte] + k] = byte
+    return data, n_bytes
+
+
+def decode_varints(data:np.ndarray) -> np.ndarray:
+    """Decode a buffer of whole LEB128 encoded values, see `encode_varints`"""
+    data = np.asarray(data)
+    if len(data) == 0:
+        return np.zeros(0, dtype = np.int64)
+    last = data < 0x80
+    value_starts = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(value_starts, np.diff(np.append(value_starts, len(data)))))
+    return np.add.reduceat((data & 0x7F).astype(np.int64) << shifts, value_starts)
+
+
+def block_metadata(indptr:np.ndarray, doc_ids:np.ndarray, tfs:np.ndarray, doc_lens:np.ndarray):
+    """Block-max metadata of the postings of a range of terms.
+
+    indptr must start at 0, i.e. be relative to the first posting of the range.
+    Returns (blocks per term, block ids, postings per block, max tf, min doc length).
+    """
+    n_postings = len(doc_ids)
+    posting_terms = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    posting_blocks = np.asarray(doc_ids, dtype = np.int64) // BLOCK_SIZE
+    changes = (np.diff(posting_terms) != 0) | (np.diff(posting_blocks) != 0)
+    starts = np.concatenate([[0], np.flatnonzero(changes) + 1]) if n_postings else np.zeros(0, dtype = np.int64)
+    block_counts = np.diff(np.searchsorted(starts, indptr))
+    if not n_postings:
+        empty = np.zeros(0, dtype = np.int64)
+        return block_counts, empty, empty, empty, empty
+    return (
+        block_counts,
+        posting_blocks[starts],
+        np.diff(np.append(starts, n_postings)),
+        np.maximum.reduceat(tfs, starts),
+        np.minimum.reduceat(doc_lens[doc_ids], starts),
+    )
+
+
+def encode_postings(indptr:np.ndarray, doc_ids:np.ndarray, tfs:np.ndarray, doc_lens:np.ndarray):
+    """Compressed postings of a range of terms, the layout of `InvertedIndex`.
+
+    indptr must start at 0. tfs and doc_lens are stored with their own dtypes.
+    Returns (arrays, blocks per term, block id bytes per term).
+    """
+    blocks_per_term, block_ids, block_sizes, max_tf, min_len = block_metadata(indptr, doc_ids, tfs, doc_lens)
+    # block ids are stored as gaps from the previous block of the same term
+    previous = np.zeros_like(block_ids)
+    previous[1:] = block_ids[:-1]
+    previous[(np.cumsum(blocks_per_term) - blocks_per_term)[blocks_per_term > 0]] = 0
+    block_gaps, gap_bytes = encode_varints(block_ids - previous)
+    block_terms = np.repeat(np.arange(len(blocks_per_term)), blocks_per_term)
+    arrays = {
+        "doc_offsets": (np.asarray(doc_ids) % BLOCK_SIZE).astype(np.uint8),
+        "tfs": np.asarray(tfs),
+        "block_gaps": block_gaps,
+        "block_sizes": block_sizes.astype(np.uint8),
+        "block_max_tf": max_tf.astype(tfs.dtype),
+        "block_min_len": min_len.astype(doc_lens.dtype),
+    }
+    return arrays, blocks_per_term, np.bincount(block_terms, weights = gap_bytes, minlength = len(blocks_per_term)).astype(np.int64)
+
+
+class ArrayWriter:
+    """Append-only writer of a 1-d .npy file whose length is not known in advance.
+
+    Chunks are appended to a raw side file and copied behind the .npy header on `close`.
+    """
+
+    COPY_CHUNK = 2 ** 22
+
+    def __init__(self, path:Path, dtype):
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype)
+        self._raw_path = self.path.with_name(self.path.name + ".raw")
+        self._raw = open(self._raw_path, "wb")
+        self.size = 0
+
+    def append(self, values) -> None:
+        values = np.asarray(values, dtype = self.dtype)
+        values.tofile(self._raw)
+        self.size += len(values)
+
+    def close(self) -> None:
+        self._raw.close()
+        out = np.lib.format.open_memmap(self.path, mode = "w+", dtype = self.dtype, shape = (self.size,))
+        if self.size:
+            raw = np.memmap(self._raw_path, dtype = self.dtype, mode = "r")
+            for start in range(0, self.size, self.COPY_CHUNK):
+                out[start:start + self.COPY_CHUNK] = raw[start:start + self.COPY_CHUNK]
+            del raw
+        out.flush()
+        del out
+        os.remove(self._raw_path)
+
+
+class TermDictionary(Sequence):
+    """Sorted terms stored as one UTF-8 buffer with offsets; a term's id is its rank.
+
+    Lookups binary search the buffer, so a memory-mapped dictionary is
+    usable without building any per-term Python object.
+    """
+
+    def __init__(self, data:np.ndarray, offsets:np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_terms(cls, terms:List[str]) -> "TermDictionary":
+        """Build a dictionary from terms that are already sorted and unique"""
+        return cls(*encode_strings(terms))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, term_id:int) -> str:
+        return bytes(self.data[self.offsets[term_id]:self.offsets[term_id + 1]]).decode("utf-8")
+
+    def lookup(self, terms:List[str]) -> np.ndarray:
+        """Map terms to term ids, -1 for terms not in the dictionary"""
+        ids = np.full(len(terms), -1, dtype = np.int64)
+        for i, term in enumerate(terms):
+            pos = bisect_left(self, term)
+            if pos < len(self) and self[pos] == term:
+                ids[i] = pos
+        return ids
+
+    def save(self, folder:Path, name:str = "terms") -> None:
+        self.data.tofile(folder / f"{name}.bin")
+        np.save(folder / f"{name}_offsets.npy", self.offsets)
+
+    @classmethod
+    def load(cls, folder:Path, name:str = "terms", mmap:bool = True) -> "TermDictionary":
+        offsets = _load_array(folder / f"{name}_offsets.npy", mmap)
+        if offsets[-1] == 0:
+            # np.memmap refuses empty files
+            return cls(np.zeros(0, dtype = np.uint8), offsets)
+        if mmap:
+            data = np.memmap(folder / f"{name}.bin", dtype = np.uint8, mode = "r")
+        else:
+            data = np.fromfile(folder / f"{name}.bin", dtype = np.uint8)
+        return cls(data, offsets)
+
+
+@dataclass
+class InvertedIndex:
+    """Term-major postings of a tokenized corpus, compressed in CSR layout.
+
+    Postings are cut into blocks of doc ids sharing ``doc_id // BLOCK_SIZE``. The
+    postings of term ``t`` are ``indptr[t]:indptr[t+1]`` and its blocks
+    ``block_indptr[t]:block_indptr[t+1]``, each block holding ``block_sizes`` postings.
+    A doc id is stored as its offset in its block, ``doc_offsets``, and the ids of the
+    blocks of a term as varint encoded gaps, ``block_gaps[block_gap_indptr[t]:block_gap_indptr[t+1]]``.
+    Term frequencies and document lengths use the smallest unsigned dtype they fit.
+
+    Blocks keep the largest term frequency and the smallest document length of
+    their postings, which bound the BM25 impact of the term on any document of
+    the block whatever the idf and average document length.
+    """
+
+    vocabulary:TermDictionary
+    indptr:np.ndarray
+    doc_offsets:np.ndarray
+    tfs:np.ndarray
+    doc_lens:np.ndarray
+    block_indptr:np.ndarray
+    block_gap_indptr:np.ndarray
+    block_gaps:np.ndarray
+    block_sizes:np.ndarray
+    block_max_tf:np.ndarray
+    block_min_len:np.ndarray
+
+    ARRAYS = ("indptr", "doc_offsets", "tfs", "doc_lens", "block_indptr", "block_gap_indptr",
+              "block_gaps", "block_sizes", "block_max_tf", "block_min_len")
+
+    @classmethod
+    def from_postings(cls, vocabulary:TermDictionary, indptr:np.ndarray, doc_ids:np.ndarray,
+                      tfs:np.ndarray, doc_lens:np.ndarray) -> "InvertedIndex":
+        """Compress plain CSR postings, doc ids sorted within a term"""
+        tfs = np.asarray(tfs)
+        doc_lens = np.asarray(doc_lens)
+        tfs = tfs.astype(min_uint_dtype(int(tfs.max()) if len(tfs) else 0))
+        doc_lens = doc_lens.astype(min_uint_dtype(int(doc_lens.max()) if len(doc_lens) else 0))
+        indptr = np.asarray(indptr, dtype = np.int64)
+        arrays, blocks_per_term, gap_bytes = encode_postings(indptr - indptr[0], doc_ids, tfs, doc_lens)
+        return cls(
+            vocabulary = vocabulary,
+            indptr = indptr,
+            doc_lens = doc_lens,
+            block_indptr = _indptr(blocks_per_term),
+            block_gap_indptr = _indptr(gap_bytes),
+            **arrays,
+        )
+
+    @property
+    def n_blocks(self) -> int:
+        """Number of doc id ranges of BLOCK_SIZE spanned by the segment"""
+        return -(-self.n_docs // BLOCK_SIZE)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory taken by the postings, block metadata and vocabulary"""
+        arrays = [getattr(self, name) for name in self.ARRAYS]
+        return sum(array.nbytes for array in arrays) + self.vocabulary.data.nbytes + self.vocabulary.offsets.nbytes
+
+    @classmethod
+    def from_tokenized(cls, tokenized_documents:List[List[str]]) -> "InvertedIndex":
+        vocabulary = {}
+        term_ids, doc_lens = [], []
+        for tokens in tokenized_documents:
+            term_ids.append([vocabulary.setdefault(token, len(vocabulary)) for token in tokens])
+            doc_lens.append(len(tokens))
+
+        doc_lens = np.asarray(doc_lens, dtype = np.int64)
+        flat_terms = np.fromiter(
+            (t for ids in term_ids for t in ids), dtype = np.int64, count = int(doc_lens.sum())
+        )
+        flat_docs = np.repeat(np.arange(len(doc_lens), dtype = np.int64), doc_lens)
+
+        # term ids follow the sorted order of the terms
+        terms = sorted(vocabulary)
+        rank = np.zeros(len(terms), dtype = np.int64)
+        rank[[vocabulary[term] for term in terms]] = np.arange(len(terms))
+        flat_terms = rank[flat_terms]
+
+        # one key per (term, doc) pair; unique sorts term-major, doc-minor
+        keys, tfs = np.unique(flat_terms * len(doc_lens) + flat_docs, return_counts = True)
+        term_of_posting, docs = np.divmod(keys, max(len(doc_lens), 1))
+        indptr = _indptr(np.bincount(term_of_posting, minlength = len(terms)))
+
+        return cls.from_postings(TermDictionary.from_terms(terms), indptr, docs, tfs, doc_lens)
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_lens)
+
+    @property
+    def terms(self) -> List[str]:
+        """Terms ordered by term id"""
+        return list(self.vocabulary)
+
+    def lookup(self, terms:List[str]) -> np.ndarray:
+        """Map terms to term ids, -1 for out-of-vocabulary terms"""
+        return self.vocabulary.lookup(terms)
+
+    def doc_freq(self, term_ids:np.ndarray) -> np.ndarray:
+        """Number of documents containing each of the given terms"""
+        return self.indptr[term_ids + 1] - self.indptr[term_ids]
+
+    def _block_ids(self, term_ids:np.ndarray) -> np.ndarray:
+        """Decoded block ids of all blocks of the given terms, in order"""
+        gaps = decode_varints(self.block_gaps[concat_ranges(
+            self.block_gap_indptr[term_ids], self.block_gap_indptr[term_ids + 1])])
+        return segment_cumsum(gaps, self.block_indptr[term_ids + 1] - self.block_indptr[term_ids])
+
+    def postings(self, term_id:int):
+        """Return (doc_ids, tfs) of a single term"""
+        _, doc_ids, tfs = self.gather_postings(np.asarray([term_id]))
+        return doc_ids, tfs
+
+    def gather_postings(self, term_ids:np.ndarray):
+        """Return (owner, doc_ids, tfs) for the postings of many terms at once.
+
+        ``owner`` holds, for every posting, its position in ``term_ids``.
+        """
+        term_ids = np.asarray(term_ids, dtype = np.int64)
+        starts, ends = self.indptr[term_ids], self.indptr[term_ids + 1]
+        positions = concat_ranges(starts, ends)
+        owner = np.repeat(np.arange(len(term_ids)), ends - starts)
+        block_sizes = self.block_sizes[concat_ranges(self.block_indptr[term_ids], self.block_indptr[term_ids + 1])]
+        doc_ids = np.repeat(self._block_ids(term_ids) * BLOCK_SIZE, block_sizes) + self.doc_offsets[positions]
+        return owner, doc_ids, self.tfs[positions]
+
+    def gather_blocks(self, term_ids:np.ndarray):
+        """Return (owner, positions, block_ids, starts) for the blocks of many terms at once.
+
+        ``positions`` index the block metadata and ``starts`` are the positions of
+        the blocks' first postings.
+        """
+        term_ids = np.asarray(term_ids, dtype = np.int64)
+        lengths = self.block_indptr[term_ids + 1] - self.block_indptr[term_ids]
+        owner = np.repeat(np.arange(len(term_ids)), lengths)
+        positions = concat_ranges(self.block_indptr[term_ids], self.block_indptr[term_ids + 1])
+        block_sizes = self.block_sizes[positions]
+        starts = np.repeat(self.indptr[term_ids], lengths) + segment_cumsum(block_sizes, lengths) - block_sizes
+        return owner, positions, self._block_ids(term_ids), starts
+
+    def gather_block_postings(self, block_positions:np.ndarray, block_ids:np.ndarray, starts:np.ndarray):
+        """Return (owner, doc_ids, tfs) for the postings of the given blocks, see `gather_blocks`.
+
+        ``owner`` holds, for every posting, its position in ``block_positions``.
+        """
+        block_sizes = self.block_sizes[block_positions]
+        positions = concat_ranges(starts, starts + block_sizes)
+        owner = np.repeat(np.arange(len(block_positions)), block_sizes)
+        doc_ids = np.repeat(block_ids * BLOCK_SIZE, block_sizes) + self.doc_offsets[positions]
+        return owner, doc_ids, self.tfs[positions]
+
+    def term_frequencies(self, term_ids:np.ndarray, doc_ids:np.ndarray) -> np.ndarray:
+        """Dense (len(term_ids), len(doc_ids)) matrix of term frequencies.
+
+        Only the blocks of the given documents are decoded, found by binary search
+        among the blocks of the terms, so the cost does not grow with the postings.
+        """
+        term_ids = np.asarray(term_ids, dtype = np.int64)
+        doc_ids = np.asarray(doc_ids, dtype = np.int64)
+        tfs = np.zeros(len(term_ids) * len(doc_ids), dtype = np.int64)
+        owner, positions, block_ids, starts = self.gather_blocks(term_ids)
+        if len(block_ids) == 0 or len(doc_ids) == 0:
+            return tfs.reshape(len(term_ids), len(doc_ids))
+
+        # (term, block) keys are sorted, owners ascend and block ids ascend within a term
+        keys = owner * self.n_blocks + block_ids
+        wanted = (np.arange(len(term_ids))[:, None] * self.n_blocks + doc_ids[None, :] // BLOCK_SIZE).ravel()
+        found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        pairs = np.flatnonzero(keys[found] == wanted)
+        blocks = found[pairs]
+
+        block_sizes = self.block_sizes[positions[blocks]]
+        postings = concat_ranges(starts[blocks], starts[blocks] + block_sizes)
+        posting_pairs = np.repeat(pairs, block_sizes)
+        match = self.doc_offsets[postings] == np.tile(doc_ids, len(term_ids))[posting_pairs] % BLOCK_SIZE
+        tfs[posting_pairs[match]] = self.tfs[postings[match]]
+        return tfs.reshape(len(term_ids), len(doc_ids))
+
+    def save(self, folder:Path) -> None:
+        """Write the segment as flat arrays into folder"""
+        folder = Path(folder)
+        folder.mkdir(parents = True, exist_ok = True)
+        self.vocabulary.save(folder)
+        for name in self.ARRAYS:
+            np.save(folder / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, folder:Path, mmap:bool = True) -> "InvertedIndex":
+        """Read a segment written by `save`, memory-mapping its arrays if mmap is True"""
+        folder = Path(folder)
+        vocabulary = TermDictionary.load(folder, mmap = mmap)
+        if (folder / "doc_ids.npy").exists():
+            # uncompressed segment of format version 1, compressed in memory
+            arrays = {name: np.load(folder / f"{name}.npy") for name in ("indptr", "doc_ids", "tfs", "doc_lens")}
+            return cls.from_postings(vocabulary, **arrays)
+        return cls(vocabulary = vocabulary, **{name: _load_array(folder / f"{name}.npy", mmap) for name in cls.ARRAYS})
+
+    @classmethod
+    def merge(cls, segments:List["InvertedIndex"], keep_masks:List[np.ndarray] = None) -> "InvertedIndex":
+        """Merge segments into a single one, dropping the documents not kept.
+
+        Documents are renumbered in segment order; terms left without
+        postings are dropped from the vocabulary.
+        """
+        all_terms = sorted(set().union(*(segment.terms for segment in segments)))
+        vocabulary = {term: i for i, term in enumerate(all_terms)}
+        terms, docs, tfs, doc_lens = [], [], [], []
+        base = 0
+        for i, segment in enumerate(segments):
+            keep = np.ones(segment.n_docs, dtype = bool) if keep_masks is None else keep_masks[i]
+            new_doc_ids = np.cumsum(keep) - 1 + base
+            term_map = np.asarray([vocabulary[term] for term in segment.terms], dtype = np.int64)
+            segment_terms, segment_docs, segment_tfs = segment.gather_postings(np.arange(len(term_map)))
+            kept = keep[segment_docs]
+            terms.append(term_map[segment_terms[kept]])
+            docs.append(new_doc_ids[segment_docs[kept]])
+            tfs.append(segment_tfs[kept])
+            doc_lens.append(segment.doc_lens[keep])
+            base += int(keep.sum())
+
+        terms = np.concatenate(terms + [np.zeros(0, dtype = np.int64)])
+        # segments are in doc order, a stable sort by term keeps docs sorted within a term
+        order = np.argsort(terms, kind = "stable")
+        used, terms = np.unique(terms[order], return_inverse = True)
+        indptr = _indptr(np.bincount(terms, minlength = len(used)))
+
+        return cls.from_postings(
+            TermDictionary.from_terms([all_terms[t] for t in used]),
+            indptr,
+            np.concatenate(docs + [np.zeros(0, dtype = np.int64)])[order],
+            np.concatenate(tfs + [np.zeros(0, dtype = np.int64)])[order],
+            np.concatenate(doc_lens + [np.zeros(0, dtype = np.int64)]),
+        )
+
+    @classmethod
+    def merge_to_disk(cls, segments:List["InvertedIndex"], folder:Path, max_postings:int = 2 ** 22) -> None:
+        """Merge segments into a segment written to folder, like `save` of the `merge` result.
+
+        Postings are merged and compressed in slices of terms holding at most
+        max_postings, so memory is bounded by the merged vocabulary and
+        max_postings instead of the size of the merged index.
+        """
+        folder = Path(folder)
+        folder.mkdir(parents = True, exist_ok = True)
+
+        # k-way merge of the sorted segment dictionaries
+        term_maps = [np.zeros(len(segment.vocabulary), dtype = np.int64) for segment in segments]
+        term_offsets = ArrayWriter(folder / "terms_offsets.npy", np.int64)
+        pending_offsets, offset, n_terms, last_term = [0], 0, 0, None
+        with open(folder / "terms.bin", "wb") as terms_file:
+            streams = [zip(segment.vocabulary, itertools.repeat(s), itertools.count()) for s, segment in enumerate(segments)]
+            for term, s, i in heapq.merge(*streams):
+                if term != last_term:
+                    encoded = term.encode("utf-8")
+                    terms_file.write(encoded)
+                    offset += len(encoded)
+                    pending_offsets.append(offset)
+                    n_terms, last_term = n_terms + 1, term
+                    if len(pending_offsets) >= 2 ** 16:
+                        term_offsets.append(pending_offsets)
+                        pending_offsets = []
+                term_maps[s][i] = n_terms - 1
+        term_offsets.append(pending_offsets)
+        term_offsets.close()
+
+        doc_freqs = np.zeros(n_terms, dtype = np.int64)
+        for segment, term_map in zip(segments, term_maps):
+            doc_freqs[term_map] += np.diff(segment.indptr)
+        indptr = _indptr(doc_freqs)
+
+        doc_lens = np.concatenate([segment.doc_lens for segment in segments] + [np.zeros(0, dtype = np.int64)])
+        doc_lens = doc_lens.astype(min_uint_dtype(int(doc_lens.max()) if len(doc_lens) else 0))
+        max_tf = max([int(segment.block_max_tf.max()) for segment in segments if len(segment.block_max_tf)] + [0])
+        tf_dtype = min_uint_dtype(max_tf)
+        bases = _indptr([segment.n_docs for segment in segments])
+
+        writers = {name: ArrayWriter(folder / f"{name}.npy", np.uint8)
+                   for name in ("doc_offsets", "block_gaps", "block_sizes")}
+        writers["tfs"] = ArrayWriter(folder / "tfs.npy", tf_dtype)
+        writers["block_max_tf"] = ArrayWriter(folder / "block_max_tf.npy", tf_dtype)
+        writers["block_min_len"] = ArrayWriter(folder / "block_min_len.npy", doc_lens.dtype)
+        blocks_per_term = np.zeros(n_terms, dtype = np.int64)
+        gap_bytes = np.zeros(n_terms, dtype = np.int64)
+        for a, b in _term_slices(indptr, max_postings):
+            terms, docs, tfs = [np.zeros(0, dtype = np.int64)], [np.zeros(0, dtype = np.int64)], [np.zeros(0, dtype = tf_dtype)]
+            for segment, term_map, base in zip(segments, term_maps, bases):
+                # term maps are increasing, the segment terms of a slice are contiguous
+                local_a, local_b = np.searchsorted(term_map, [a, b])
+                owner, doc_ids, segment_tfs = segment.gather_postings(np.arange(local_a, local_b))
+                terms.append(term_map[local_a + owner])
+                docs.append(doc_ids + base)
+                tfs.append(segment_tfs)
+            # segments are in doc order, a stable sort by term keeps docs sorted within a term
+            order = np.argsort(np.concatenate(terms), kind = "stable")
+            arrays, blocks_per_term[a:b], gap_bytes[a:b] = encode_postings(
+                indptr[a:b + 1] - indptr[a], np.concatenate(docs)[order],
+                np.concatenate(tfs)[order].astype(tf_dtype), doc_lens
+            )
+            for name, values in arrays.items():
+                writers[name].append(values)
+        for writer in writers.values():
+            writer.close()
+
+        np.save(folder / "indptr.npy", indptr)
+        np.save(folder / "doc_lens.npy", doc_lens)
+        np.save(folder / "block_indptr.npy", _indptr(blocks_per_term))
+        np.save(folder / "block_gap_indptr.npy", _indptr(gap_bytes))
+
+
+def _term_slices(indptr:np.ndarray, max_postings:int):
+    """Consecutive term ranges [a, b) holding at most max_postings postings, or a single term"""
+    n_terms = len(indptr) - 1
+    a = 0
+    while a < n_terms:
+        b = int(np.searchsorted(indptr, indptr[a] + max_postings, side = "right")) - 1
+        b = min(max(b, a + 1), n_terms)
+        yield a, b
+        a = b
+
+
+class TextStore(Sequence):
+    """Strings kept in one UTF-8 buffer and decoded lazily by offset, plus an
+    in-memory tail of strings appended since.
+
+    Used for documents and ids; items are decoded back according to ``dtype``,
+    one of "str", "int" or "json".
+    """
+
+    def __init__(self, data:np.ndarray = None, starts:np.ndarray = None,
+                 ends:np.ndarray = None, tail:list = None, dtype:str = "str"):
+        self.data = np.zeros(0, dtype = np.uint8) if data is None else data
+        self.starts = np.zeros(0, dtype = np.int64) if starts is None else starts
+        self.ends = np.zeros(0, dtype = np.int64) if ends is None else ends
+        self.tail = [] if tail is None else tail
+        self.dtype = dtype
+
+    def __len__(self) -> int:
+        return len(self.starts) + len(self.tail)
+
+    def _decode(self, position:int):
+        text = bytes(self.data[self.starts[position]:self.ends[position]]).decode("utf-8")
+        if self.dtype == "int":
+            return int(text)
+        if self.dtype == "json":
+            return json.loads(text)
+        return text
+
+    def __getitem__(self, position:int):
+        if position < 0:
+            position += len(self)
+        if position < len(self.starts):
+            return self._decode(position)
+        return self.tail[position - len(self.starts)]
+
+    def extend(self, items:list) -> None:
+        self.tail.extend(items)
+
+    def take(self, positions:np.ndarray) -> "TextStore":
+        """New store holding the items at ascending positions, sharing the buffer"""
+        positions = np.asarray(positions, dtype = np.int64)
+        n_buffered = len(self.starts)
+        buffered = positions[positions < n_buffered]
+        tail = [self.tail[p - n_buffered] for p in positions[positions >= n_buffered]]
+        return TextStore(self.data, self.starts[buffered], self.ends[buffered], tail, self.dtype)
+
+    def save(self, folder:Path, name:str, dtype:str = "str") -> None:
+        """Write all items as <name>.bin with offsets in <name>_offsets.npy"""
+        encode = json.dumps if dtype == "json" else str
+        offsets = np.zeros(len(self) + 1, dtype = np.int64)
+        with open(Path(folder) / f"{name}.bin", "wb") as f:
+            for i, item in enumerate(self):
+                encoded = encode(item).encode("utf-8")
+                f.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+        np.save(Path(folder) / f"{name}_offsets.npy", offsets)
+
+    @classmethod
+    def load(cls, folder:Path, name:str, mmap:bool = True, dtype:str = "str") -> "TextStore":
+        dictionary = TermDictionary.load(Path(folder), name = name, mmap = mmap)
+        offsets = dictionary.offsets
+        return cls(dictionary.data, offsets[:-1], offsets[1:], dtype = dtype)
@@ -0,0 +1,241 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import reduce
+from pathlib import Path
+from typing import List, Tuple
+import json
+import operator
+import zlib
+import numpy as np
+from .bm25 import BM25Model, CollectionStats, Tokenizer, tokenizer_config, tokenizer_from_config
+
+class ShardWorker:
+    """Serving side of a shard: a BM25Model and the calls ShardedBM25 makes on it.
+
+    Calls not defined here go to the model.
+    """
+
+    def __init__(self, model:BM25Model):
+        self.model = model
+
+    def __getattr__(self, name:str):
+        return getattr(self.model, name)
+
+    def check_new_ids(self, ids:list) -> None:
+        """ValueError for ids given twice or already indexed, see `BM25Model.add_documents`"""
+        with self.model._lock:
+            self.model._check_new_ids(ids)
+
+    def dump(self, path:str) -> None:
+        # a shard no document was routed to is left out, and starts empty on load
+        if self.model.fitted:
+            self.model.dump(path)
+
+# the worker of a shard process
+_shard_worker = None
+
+def _init_shard(model_params:dict, path:str = None):
+    global _shard_worker
+    if path is not None and Path(path).exists():
+        _shard_worker = ShardWorker(BM25Model.load(path))
+    else:
+        _shard_worker = ShardWorker(BM25Model(**model_params))
+
+def _call_shard(method:str, args:tuple, kwargs:dict):
+    return getattr(_shard_worker, method)(*args, **kwargs)
+
+def shard_of(id_, n_shards:int) -> int:
+    """Shard of a document id, stable across processes and runs"""
+    return zlib.crc32(json.dumps(id_).encode("utf-8")) % n_shards
+
+
+class ProcessShard:
+    """A ShardWorker held by a single-worker process pool.
+
+    Worker methods are called by name and return futures; this is the whole
+    interface ShardedBM25 relies on, so a shard living on another node only
+    needs to implement `submit` and `close` over the network.
+    """
+
+    def __init__(self, model_params:dict, path:str = None):
+        self.executor = ProcessPoolExecutor(
+            max_workers = 1, initializer = _init_shard, initargs = (model_params, path))
+
+    def submit(self, method:str, *args, **kwargs) -> Future:
+        return self.executor.submit(_call_shard, method, args, kwargs)
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+
+@dataclass
+class ShardedBM25:
+    """BM25 over a corpus partitioned across shards, each a BM25Model in its own process.
+
+    Documents are routed to shards by a hash of their id. Queries fan out to all
+    shards in two rounds: the shards' collection statistics for the query terms are
+    summed up first, then every shard returns its top n scored with the global
+    statistics, so scores are the same as those of a single BM25Model over the corpus.
+
+    Use as a context manager, or call `close`, to stop the shard processes.
+    """
+
+    k1:float
+    b:float
+    n_shards:int = 4
+    tokenizer:Tokenizer = field(default_factory = Tokenizer)
+
+    def __post_init__(self):
+        self._next_id = 0
+        self.shards = [ProcessShard(self._model_params()) for _ in range(self.n_shards)]
+
+    def _model_params(self) -> dict:
+        return {"k1": self.k1, "b": self.b, "tokenizer": self.tokenizer}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+    def _broadcast(self, method:str, *args, **kwargs) -> list:
+        """Call a method on every shard in parallel, results in shard order"""
+        futures = [shard.submit(method, *args, **kwargs) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    def _route(self, ids:list) -> List[List[int]]:
+        """Positions in ids of the documents of each shard"""
+        positions = [[] for _ in self.shards]
+        for i, id_ in enumerate(ids):
+            positions[shard_of(id_, self.n_shards)].append(i)
+        return positions
+
+    def fit(self, documents:List[str], ids:list = None):
+        self._broadcast("reset")
+        self._next_id = 0
+        self.add_documents(documents, ids = ids)
+        return self
+
+    def add_documents(self, documents:List[str], ids:list = None) -> list:
+        """Index new documents on the shards their ids hash to, returns their ids.
+
+        Ids are checked on all shards before any of them indexes, so an id given
+        twice or already indexed raises ValueError without a partial insert.
+        """
+        documents = list(documents)
+        new_ids = ids is None
+        if new_ids:
+            ids = list(range(self._next_id, self._next_id + len(documents)))
+        elif len(ids) != len(documents):
+            raise ValueError("ids and documents must have the same length")
+        ids = list(ids)
+        routes = [(shard, positions) for shard, positions in zip(self.shards, self._route(ids)) if positions]
+
+        if not new_ids:
+            # an id always hashes to the same shard, which can tell whether it is taken
+            futures = [shard.submit("check_new_ids", [ids[i] for i in positions]) for shard, positions in routes]
+            for future in futures:
+                future.result()
+        futures = [
+            shard.submit("add_documents", [documents[i] for i in positions], ids = [ids[i] for i in positions])
+            for shard, positions in routes
+        ]
+        for future in futures:
+            future.result()
+        self._next_id = max([self._next_id] + [i + 1 for i in ids if isinstance(i, int)])
+        return ids
+
+    def remove_documents(self, ids:list) -> None:
+        ids = list(ids)
+        futures = [
+            shard.submit("remove_documents", [ids[i] for i in positions])
+            for shard, positions in zip(self.shards, self._route(ids)) if positions
+        ]
+        for future in futures:
+            future.result()
+
+    def compact(self) -> None:
+        self._broadcast("compact")
+
+    def collection_stats(self, terms:List[str]) -> CollectionStats:
+        """Statistics of the whole collection for the given terms"""
+        return reduce(operator.add, self._broadcast("collection_stats", terms))
+
+    @property
+    def n_docs(self) -> int:
+        return self.collection_stats([]).n_docs
+
+    def search(self, query:str, n:int = 10):
+        """Search all shards with a query string, same results as `BM25Model.search`.
+
+        Returns:
+            dict: scores, documents and ids of the top n hits by decreasing score.
+        """
+        stats = self.collection_stats(self.tokenizer.tokenize_doc(query))
+        results = self._broadcast("search", query, n = n, stats = stats)
+
+        scores = np.concatenate([result["scores"] for result in results])
+        documents = [document for result in results for document in result["documents"]]
+        ids = [id_ for result in results for id_ in result["ids"]]
+        idx = np.argsort(-scores, kind = "stable")[:n]
+        return {
+            "scores": scores[idx].tolist(),
+            "documents": [documents[i] for i in idx],
+            "ids": [ids[i] for i in idx],
+        }
+
+    def search_batch(self, queries:List[str], n:int = 10) -> Tuple[List[list], np.ndarray]:
+        """Score a batch of queries on all shards.
+
+        Returns:
+            Tuple[List[list], np.ndarray]: (ids, scores), one list of n ids and one
+                row of n scores per query, by decreasing score.
+        """
+        queries = list(queries)
+        terms = list({token: None for tokens in self.tokenizer.tokenize_batch(queries) for token in tokens})
+        stats = self.collection_stats(terms)
+
+        results = self._broadcast("search_batch", queries, n = n, stats = stats)
+        shard_scores = np.concatenate([scores for _, scores in results], axis = 1)
+        shard_ids = [[id_ for ids, _ in results for id_ in ids[q]] for q in range(len(queries))]
+
+        order = np.argsort(-shard_scores, axis = 1, kind = "stable")[:, :n]
+        scores = np.take_along_axis(shard_scores, order, axis = 1)
+        return [[shard_ids[q][i] for i in row] for q, row in enumerate(order)], scores
+
+    def dump(self, path:str = "sharded_bm25_dump") -> None:
+        """Dump every shard to its own folder under path, see `BM25Model.dump`"""
+        dump_folder = Path(path)
+        dump_folder.mkdir(parents = True, exist_ok = True)
+        futures = [shard.submit("dump", str(dump_folder / "shards" / str(i))) for i, shard in enumerate(self.shards)]
+        for future in futures:
+            future.result()
+        meta = {
+            "format": "sharded_bm25",
+            "k1": self.k1,
+            "b": self.b,
+            "n_shards": self.n_shards,
+            "tokenizer": tokenizer_config(self.tokenizer),
+            "next_id": self._next_id,
+        }
+        with open(dump_folder / "meta.json", "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path:str):
+        """Start shard processes loading a dump written by `dump`"""
+        load_path = Path(path)
+        with open(load_path / "meta.json", "r") as f:
+            meta = json.load(f)
+
+        obj = cls.__new__(cls)
+        obj.k1, obj.b, obj.n_shards = meta["k1"], meta["b"], meta["n_shards"]
+        obj.tokenizer = tokenizer_from_config(meta["tokenizer"])
+        obj._next_id = meta["next_id"]
+        obj.shards = [ProcessShard(obj._model_params(), str(load_path / "shards" / str(i)))
+                      for i in range(obj.n_shards)]
+        return obj
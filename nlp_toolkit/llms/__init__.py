@@ -1 +1,5 @@
-from .openai_func import *
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "openai_func": ["get_completion"],
+})
@@ -1 +1,5 @@
-from .ask_rag import *
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "ask_rag": ["get_or_create_index_local", "LocalDirRag", "RagChatBot"],
+})
@@ -1 +1,5 @@
-from .google_translation import GoogleTrans
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "google_translation": ["GoogleTrans"],
+})
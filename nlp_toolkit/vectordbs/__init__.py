@@ -1 +1,13 @@
-from .chroma import *
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "bulk": ["MODES", "DEFAULT_BATCH_SIZE", "accepts_arrays", "embeddings_param", "max_batch_size",
+             "column_values", "arrow_batches", "embedding_matrix", "BulkLoader"],
+    "chroma": ["insert_df_collection", "insert_df_collection_batch", "update_metafield", "mean_seed_query",
+               "concat_text_query", "delete_metadata_by_key", "QUERY_INCLUDE", "query_results", "ChromaCrud"],
+    "ingest": ["record_batches", "TIMESTAMP_COLS", "missing_as_none", "metadata_dicts", "dataframe_metadatas",
+               "record_metadatas", "IngestStats", "IngestPipeline"],
+    "ivfpq": ["N_CODES", "assign", "cluster_sums", "kmeans", "IVFPQIndex"],
+    "results": ["Document", "QueryResult", "object_array", "ResultRow", "ResultSet", "query_dict"],
+    "local": ["METRICS", "where_mask", "where_document_mask", "LocalVectorStore"],
+})
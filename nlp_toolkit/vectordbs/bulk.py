@@ -0,0 +1,211 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+import datetime
+import logging
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from ..embedders.base import BaseEmbedder
+from .ingest import MODES, IngestStats, metadata_dicts
+
+
+if TYPE_CHECKING:
+    import pyarrow
+    from chromadb import Collection
+
+# rows per collection write, below the sqlite limit of Chroma's default max batch size
+DEFAULT_BATCH_SIZE = 4096
+
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+
+
+@lru_cache(maxsize = None)
+def accepts_arrays() -> bool:
+    """Whether the installed chromadb takes numpy embeddings as they are, otherwise they are passed as lists"""
+    try:
+        import chromadb
+    except ImportError:
+        return False
+    version = tuple(int(part) for part in chromadb.__version__.split(".")[:2] if part.isdigit())
+    return version >= (0, 6)
+
+
+def embeddings_param(embeddings):
+    """Embeddings as passed to Chroma: the array itself when it takes arrays, a list converted at the last moment otherwise"""
+    if embeddings is None or isinstance(embeddings, list):
+        return embeddings
+    embeddings = np.asarray(embeddings, dtype = np.float32)
+    return embeddings if accepts_arrays() else embeddings.tolist()
+
+
+def max_batch_size(collection:"Collection") -> int:
+    """Largest batch the collection's client accepts in one write, None when it does not say"""
+    client = getattr(collection, "_client", None)
+    size = getattr(client, "get_max_batch_size", None) or getattr(client, "max_batch_size", None)
+    try:
+        size = size() if callable(size) else size
+    except Exception:
+        return None
+    return size if isinstance(size, int) and size > 0 else None
+
+
+def column_values(column) -> list:
+    """Python values of an Arrow column, through NumPy, much faster than to_pylist, where nulls stay None"""
+    import pyarrow as pa
+    if column.null_count and not (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+        # numeric nulls would become NaN
+        return column.to_pylist()
+    return column.to_numpy(zero_copy_only = False).tolist()
+
+
+def arrow_batches(source, batch_size:int = DEFAULT_BATCH_SIZE, columns:list = None) -> Iterator["pyarrow.RecordBatch"]:
+    """Stream Arrow record batches of at most batch_size rows.
+
+    Args:
+        source: a Parquet file, read by row groups, an Arrow IPC file (.arrow, .feather,
+            .ipc), memory-mapped, a Table, a DataFrame, a RecordBatchReader or an
+            iterable of RecordBatches.
+        batch_size (int, optional): rows per batch. Defaults to DEFAULT_BATCH_SIZE.
+        columns (list, optional): columns read, all if None. Defaults to None.
+    """
+    import pyarrow as pa
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        if path.suffix not in ARROW_SUFFIXES:
+            import pyarrow.parquet as pq
+            yield from pq.ParquetFile(path).iter_batches(batch_size = batch_size, columns = columns)
+            return
+        reader = pa.ipc.open_file(pa.memory_map(str(path), "r"))
+        source = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    elif isinstance(source, pd.DataFrame):
+        source = pa.Table.from_pandas(source, preserve_index = False)
+    if isinstance(source, pa.Table):
+        source = source.to_batches()
+    elif isinstance(source, pa.RecordBatch):
+        source = [source]
+    for batch in source:
+        if columns is not None:
+            batch = batch.select(columns)
+        # slices are views of the same buffers
+        for start in range(0, batch.num_rows, batch_size):
+            yield batch.slice(start, batch_size)
+
+
+def embedding_matrix(column) -> np.ndarray:
+    """(n, dim) float32 array of a list or fixed size list column, a view of its buffer when already float32"""
+    import pyarrow as pa
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if column.null_count:
+        raise ValueError(f"Embedding column has {column.null_count} missing embeddings")
+    if pa.types.is_fixed_size_list(column.type):
+        dim = column.type.list_size
+    elif pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+        lengths = np.diff(column.offsets.to_numpy())
+        if len(lengths) and (lengths != lengths[0]).any():
+            raise ValueError("Embeddings of different lengths in one column")
+        dim = int(lengths[0]) if len(lengths) else 0
+    else:
+        raise TypeError(f"Expected a list column of embeddings, got {column.type}")
+    values = column.flatten().to_numpy(zero_copy_only = False)
+    return values.astype(np.float32, copy = False).reshape(len(column), dim)
+
+
+@dataclass
+class BulkLoader:
+    """Write Parquet or Arrow data into a Chroma collection by streaming record batches.
+
+    Embeddings are read from a list column straight into a float32 matrix, a view
+    of the Arrow buffer when stored as float32, and only converted when handed to
+    Chroma; metadata dicts are built from whole columns. Rows are written
+    batch_size at a time, at most the client's max batch size. With mode "upsert",
+    rows are written with `Collection.upsert`, so re-running a load after an
+    interruption, or on data already loaded, leaves one row per id.
+
+    Args:
+        collection (Collection): the Chroma collection.
+        doc_col (str, optional): column of the document text, none if None. Defaults to "text".
+        id_col (str, optional): column of the ids, random ids if None (add mode only). Defaults to None.
+        embedding_col (str, optional): list column of the embeddings. Defaults to "embedding".
+        meta_cols (list, optional): metadata columns, all others if None. Defaults to None.
+        embedder (BaseEmbedder, optional): embeds documents when there is no embedding column,
+            otherwise the collection's embedding function does. Defaults to None.
+        batch_size (int, optional): rows per write. Defaults to DEFAULT_BATCH_SIZE.
+        mode (str, optional): add or upsert. Defaults to "add".
+        timestamps (bool, optional): add create_time and update_time metadata. Defaults to True.
+    """
+
+    collection:"Collection"
+    doc_col:str = "text"
+    id_col:str = None
+    embedding_col:str = "embedding"
+    meta_cols:list = None
+    embedder:BaseEmbedder = None
+    batch_size:int = DEFAULT_BATCH_SIZE
+    mode:str = "add"
+    timestamps:bool = True
+
+    def __post_init__(self):
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown mode {self.mode!r}, expected one of {MODES}")
+        if self.mode == "upsert" and self.id_col is None:
+            raise ValueError("upsert needs id_col, random ids are never the same twice")
+        limit = max_batch_size(self.collection)
+        if limit is not None and self.batch_size > limit:
+            self.batch_size = limit
+
+    def _params(self, batch:"pyarrow.RecordBatch", now:str) -> dict:
+        import pyarrow as pa
+        names = batch.schema.names
+        if self.id_col is None:
+            ids = [str(uuid.uuid4()) for _ in range(batch.num_rows)]
+        else:
+            ids = column_values(batch.column(self.id_col).cast(pa.string()))
+        documents = None if self.doc_col is None else column_values(batch.column(self.doc_col))
+        if self.embedding_col in names:
+            embeddings = embedding_matrix(batch.column(self.embedding_col))
+        elif self.embedder is not None:
+            embeddings = self.embedder(documents)
+        else:
+            embeddings = None
+
+        meta_cols = self.meta_cols
+        if meta_cols is None:
+            meta_cols = [col for col in names if col not in (self.id_col, self.doc_col, self.embedding_col)]
+        columns = {}
+        for col in meta_cols:
+            column = batch.column(col)
+            if pa.types.is_temporal(column.type):
+                column = column.cast(pa.string())
+            columns[col] = column_values(column)
+        extra = {"create_time": now, "update_time": now} if self.timestamps else None
+
+        params = dict(ids = ids, documents = documents, embeddings = embeddings_param(embeddings),
+                      metadatas = metadata_dicts(columns, batch.num_rows, extra))
+        return {k: v for k, v in params.items() if v is not None}
+
+    def load(self, source, columns:list = None) -> IngestStats:
+        """Write every row of source, see `arrow_batches` for the sources read.
+
+        embed_seconds of the returned stats counts preparing the batches, including any embedding.
+        """
+        write = self.collection.upsert if self.mode == "upsert" else self.collection.add
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        stats = IngestStats()
+        start = time.perf_counter()
+        for batch in arrow_batches(source, batch_size = self.batch_size, columns = columns):
+            prepare_start = time.perf_counter()
+            params = self._params(batch, now)
+            stats.embed_seconds += time.perf_counter() - prepare_start
+            write_start = time.perf_counter()
+            write(**params)
+            stats.insert_seconds += time.perf_counter() - write_start
+            stats.batches += 1
+            stats.records += batch.num_rows
+            stats.elapsed = time.perf_counter() - start
+            logging.info(f"Wrote batch {stats.batches}, {stats.records} records, {stats.records_per_second:.1f} records/s")
+        stats.elapsed = time.perf_counter() - start
+        return stats
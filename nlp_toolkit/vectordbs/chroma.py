@@ -2,7 +2,6 @@ import random
 from dataclasses import dataclass
 from typing import List
 from typing import Tuple
-from typing import Dict
 from typing import TYPE_CHECKING
 import pandas as pd
 import datetime
@@ -10,6 +9,11 @@ import uuid
 import numpy as np
 import sqlite3
 from pathlib import Path
+from ..cache import ResultCache
+from ..embedders.base import BaseEmbedder
+from .bulk import BulkLoader, embeddings_param
+from .ingest import IngestPipeline, IngestStats, dataframe_metadatas
+from .results import Document, QueryResult, ResultSet
 
 
 if TYPE_CHECKING:
@@ -22,24 +26,18 @@ def insert_df_collection(collection,
                          id_col:str, 
                          meta_cols:list = None) -> None:
     
-    df['create_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    df['update_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     ids = df[id_col].astype(str).tolist()
 
-    if isinstance(embeddings, np.ndarray):
-        embeddings = embeddings.tolist()
-
     documents = df[doc_col].tolist()
     
-    if meta_cols is None:
-        meta_cols = [col for col in df.columns if col not in [id_col, doc_col]]
-    
-    metadatas = df[meta_cols].to_dict(orient = 'records')
+    # built from columns, the caller's DataFrame is left as it is
+    metadatas = dataframe_metadatas(df, meta_cols, [id_col, doc_col], now)
     
     params = dict(
         documents = documents,
-        embeddings = embeddings,
+        embeddings = embeddings_param(embeddings),
         metadatas = metadatas,
         ids = ids
     )
@@ -128,33 +126,34 @@ def delete_metadata_by_key(key_name:str, storage_path:str):
         cursor.execute(f"delete from embedding_metadata where key ='{key_name}';")
         conn.commit()
 
-@dataclass
-class Document:
-    """A document with an ID, embedding, metadata, and document text."""
-    
-    id: str
-    embedding: List[float] = None
-    metadata: Dict[str, str] = None
-    document: str = None
-    
-@dataclass
-class QueryResult(Document):
-    """
-    Represents the result of a query.
+QUERY_INCLUDE = ["metadatas", "documents", "distances"]
+
+
+def query_results(rst:dict) -> List[List[QueryResult]]:
+    """QueryResults of every query of a `Collection.query` result, fields not included being None"""
+    return [result_set.to_documents(QueryResult) for result_set in ResultSet.from_query(rst)]
 
-    Attributes:
-        distance (float): The distance of the query result.
-    """
-    distance: float = None
 
 @dataclass
 class ChromaCrud:
     
     collection:"Collection"
     storage_path:str = None
+    cache:ResultCache = None
+    embedder:BaseEmbedder = None
     
     def __post_init__(self):
         self._ids = None
+        
+    @property
+    def cache_namespace(self) -> str:
+        return f"chroma:{self.collection.name}"
+        
+    def _invalidate_cache(self) -> None:
+        """Forget cached ids and query results, call after every change of the collection"""
+        self._ids = None
+        if self.cache is not None:
+            self.cache.invalidate(self.cache_namespace)
 
     @property
     def ids(self) -> list:
@@ -220,37 +219,111 @@ class ChromaCrud:
     
     def query(self, query_text:str, n_results:int = 10 , where:dict = None) -> dict:
         """Query database with a query text string"""
-        rst = self.collection.query(
-            query_texts = [query_text], 
-            n_results = n_results, 
-            include = ["metadatas", "documents", "distances","embeddings"], where = where)
-        
-        query_docs = []
-        for index, id_ in enumerate(rst['ids'][0]):
-            embedding = rst['embeddings'][0][index] if rst['embeddings'] is not None else None
-            metadata = rst['metadatas'][0][index] if rst['metadatas'] is not None else None
-            document = rst['documents'][0][index] if rst['documents'] is not None else None
-            result_doc = QueryResult(id=id_, embedding=embedding, metadata=metadata, 
-                                    document=document, distance=rst['distances'][0][index])
-            query_docs.append(result_doc)
-            
-        return query_docs
+        if self.cache is not None:
+            return self.cache.get_or_compute(
+                self.cache_namespace, ["query", query_text, n_results, where], 
+                lambda: self._query(query_text, n_results = n_results, where = where))
+        return self._query(query_text, n_results = n_results, where = where)
+    
+    def _query(self, query_text:str, n_results:int = 10 , where:dict = None) -> List[QueryResult]:
+        return self._query_result_sets([query_text], n_results = n_results, where = where,
+                                       include = ["metadatas", "documents", "distances", "embeddings"])[0].to_documents(QueryResult)
+
+    def query_batch(self,
+                    query_texts:List[str] = None,
+                    n_results:int = 10,
+                    where:dict = None,
+                    query_embeddings = None,
+                    include:list = None,
+                    chunk_size:int = None) -> List[List[QueryResult]]:
+        """Query database with many texts, or their embeddings, see `query_result_sets`"""
+        return [result_set.to_documents(QueryResult) for result_set in self.query_result_sets(
+            query_texts, n_results = n_results, where = where, query_embeddings = query_embeddings,
+            include = include, chunk_size = chunk_size)]
+
+    def query_result_sets(self,
+                          query_texts:List[str] = None,
+                          n_results:int = 10,
+                          where:dict = None,
+                          query_embeddings = None,
+                          include:list = None,
+                          chunk_size:int = None) -> List[ResultSet]:
+        """Query database with many texts, or their embeddings, in one `collection.query` call.
+
+        Args:
+            query_texts (List[str], optional): query texts, embedded in one call by embedder if set,
+                otherwise by the collection's embedding function. Defaults to None.
+            n_results (int, optional): results per query. Defaults to 10.
+            where (dict, optional): metadata filter. Defaults to None.
+            query_embeddings (optional): precomputed query embeddings, instead of query_texts. Defaults to None.
+            include (list, optional): fields to fetch, embeddings are only fetched when asked
+                for. Defaults to ["metadatas", "documents", "distances"].
+            chunk_size (int, optional): queries per `collection.query` call, all if None. Defaults to None.
+
+        Returns:
+            List[ResultSet]: the results of every query, in order.
+        """
+        if (query_texts is None) == (query_embeddings is None):
+            raise ValueError("Provide either query_texts or query_embeddings")
+        if include is None:
+            include = QUERY_INCLUDE
+        if self.cache is None or query_texts is None:
+            return self._query_result_sets(query_texts, n_results, where, query_embeddings, include, chunk_size)
+
+        # cached per text, so queries already answered are not sent again
+        keys = [["query_result_sets", text, n_results, where, sorted(include)] for text in query_texts]
+        # versioned before querying, so results of a collection changed meanwhile are never served
+        keys = [self.cache.versioned_key(self.cache_namespace, key) for key in keys]
+        results = [self.cache.get_versioned(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = self._query_result_sets([query_texts[i] for i in missing], n_results, where,
+                                               include = include, chunk_size = chunk_size)
+            for i, result in zip(missing, computed):
+                self.cache.put_versioned(keys[i], result)
+                results[i] = result
+        return results
+
+    def _query_result_sets(self,
+                           query_texts:List[str] = None,
+                           n_results:int = 10,
+                           where:dict = None,
+                           query_embeddings = None,
+                           include:list = None,
+                           chunk_size:int = None) -> List[ResultSet]:
+        if query_embeddings is None and self.embedder is not None:
+            query_embeddings = self.embedder(query_texts)
+        if query_embeddings is not None:
+            name, queries = "query_embeddings", np.asarray(query_embeddings, dtype = np.float32).tolist()
+        else:
+            name, queries = "query_texts", list(query_texts)
+        chunk_size = chunk_size or max(len(queries), 1)
+
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            rst = self.collection.query(**{name: queries[start:start + chunk_size]},
+                                        n_results = n_results, where = where, include = include)
+            results.extend(ResultSet.from_query(rst))
+        return results
 
-    
     def recommend(self, n_results:int = 10, where:dict = None, where_query:dict = None) -> Tuple[Document, List[QueryResult]]:
         """Randomly select a document and query the database for n_results similar documents"""
         doc = self.random_doc(where = where)
-        query_results = self.query(doc.document, n_results = n_results, where = where_query)
-        return doc, query_results
+        return doc, self.recommend_by_doc(doc, n_results = n_results, where_query = where_query)
     
-    def recommend_by_doc(self, doc:Document, n_results:int = 10, where_query:dict = None) -> Tuple[Document, List[QueryResult]]:
-        query_results = self.query(doc.document, n_results = n_results, where = where_query)
-        return query_results
+    def recommend_by_doc(self, doc:Document, n_results:int = 10, where_query:dict = None) -> List[QueryResult]:
+        """Documents similar to doc, by its embedding when it has one"""
+        if doc.embedding is not None:
+            return self.query_batch(query_embeddings = [doc.embedding], n_results = n_results, where = where_query)[0]
+        return self.query_batch([doc.document], n_results = n_results, where = where_query)[0]
     
     def recommend_by_text(self, text:str, n_results:int = 10, where_query:dict = None) -> Tuple[Document, List[QueryResult]]:
         doc = Document(id = "", document = text)
-        query_results = self.query(doc.document, n_results = n_results, where = where_query)
-        return doc, query_results
+        return doc, self.query_batch([text], n_results = n_results, where = where_query)[0]
+
+    def recommend_by_texts(self, texts:List[str], n_results:int = 10, where_query:dict = None) -> List[List[QueryResult]]:
+        """recommend_by_text for many texts, queried together"""
+        return self.query_batch(texts, n_results = n_results, where = where_query)
     
     def insert_dataframe(self, 
                          df:pd.DataFrame, 
@@ -265,34 +338,24 @@ class ChromaCrud:
         else:
             ids = df[id_col].astype(str).tolist()
         
-        # create time and updatetime columns
-        df['create_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        df['update_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        if embeddings is not None and isinstance(embeddings, np.ndarray):
-            embeddings = embeddings.tolist()
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
         documents = df[doc_col].tolist()
-    
-        if meta_cols is None:
-            meta_cols = [col for col in df.columns 
-                            if col not in [id_col, doc_col]]  
 
-        metadatas = df[meta_cols].to_dict(orient = 'records')
+        # create time and updatetime metadata, without adding columns to the caller's DataFrame
+        metadatas = dataframe_metadatas(df, meta_cols, [id_col, doc_col], now)
 
         params = dict(
             documents = documents,
-            embeddings = embeddings,
+            embeddings = embeddings_param(embeddings),
             metadatas = metadatas,
             ids = ids
         )
-        
-        
 
         params = {k:v for k,v in params.items() if v is not None}
         
-        print(params)
         self.collection.add(**params)
+        self._invalidate_cache()
         print("Successful added to collection")
         
         
@@ -322,6 +385,41 @@ class ChromaCrud:
                 embeddings = batch_embedding)
         
         print("Successful added all data to collection")
+
+    def bulk_load(self,
+                  source,
+                  id_col:str = None,
+                  doc_col:str = "text",
+                  embedding_col:str = "embedding",
+                  meta_cols:list = None,
+                  embedder:BaseEmbedder = None,
+                  batch_size:int = None,
+                  mode:str = "add",
+                  columns:list = None) -> IngestStats:
+        """Stream a Parquet or Arrow file, Table or record batches into the collection, see `BulkLoader`"""
+        loader = BulkLoader(self.collection, doc_col = doc_col, id_col = id_col, embedding_col = embedding_col,
+                            meta_cols = meta_cols, embedder = embedder or self.embedder, mode = mode,
+                            **({} if batch_size is None else {"batch_size": batch_size}))
+        try:
+            return loader.load(source, columns = columns)
+        finally:
+            self._invalidate_cache()
+
+    def ingest(self,
+               records,
+               embedder:BaseEmbedder,
+               id_col:str = None,
+               doc_col:str = "text",
+               meta_cols:list = None,
+               batch_size:int = 256,
+               checkpoint_path:str = None) -> IngestStats:
+        """Embed and add a DataFrame or an iterable of dicts, see `IngestPipeline`"""
+        pipeline = IngestPipeline(self.collection, embedder, doc_col = doc_col, id_col = id_col, meta_cols = meta_cols,
+                                  batch_size = batch_size, checkpoint_path = checkpoint_path)
+        try:
+            return pipeline.run(records)
+        finally:
+            self._invalidate_cache()
     
     def update_metafield(self, ids = None, **kwargs) -> None:
         """The only thing you can update is the metafield."""
@@ -337,12 +435,14 @@ class ChromaCrud:
             ids = ids,
             metadatas = [kwargs] * len(ids)
         )
+        self._invalidate_cache()
         print("Update metdata successfully.")    
         
     def delete_by_key(self, key_name):
         if self.storage_path is None:
             raise ValueError("Provide storage_path to delete metadata by key")
         delete_metadata_by_key(key_name, self.storage_path)
+        self._invalidate_cache()
         
         
     def get_documents(self, 
@@ -351,8 +451,18 @@ class ChromaCrud:
                   limit = None, 
                   offset = None, 
                   where_document = None, 
-                  include = None):
-    
+                  include = None) -> List[Document]:
+        return self.get_result_set(ids = ids, where = where, limit = limit, offset = offset,
+                                   where_document = where_document, include = include).to_documents()
+
+    def get_result_set(self,
+                       ids:list = None,
+                       where = None,
+                       limit = None,
+                       offset = None,
+                       where_document = None,
+                       include = None) -> ResultSet:
+        """Documents like `get_documents`, as one columnar ResultSet"""
         if include is None:
             include = ['metadatas','documents','embeddings']
 
@@ -364,19 +474,7 @@ class ChromaCrud:
             where_document = where_document, 
             include = include
         )
-        
-        rst = {k:v for k,v in rst.items() if v is not None}
-
-        docs = []
-        for i in range(len(rst['ids'])):
-            id = rst['ids'][i]
-            metadata = rst['metadatas'][i] if "metadatas" in rst else None
-            document = rst['documents'][i] if "documents" in rst else None
-            embedding = rst['embeddings'][i] if "embeddings" in rst else None
-            doc = Document(id = id, metadata = metadata, document = document, embedding = embedding)
-            docs.append(doc)
-            
-        return docs
+        return ResultSet.from_get(rst)
     
     
     def mean_seed_query(self, ids, n_results:int = 10):
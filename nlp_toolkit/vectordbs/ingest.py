@@ -0,0 +1,243 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Union
+import datetime
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from ..embedders.base import BaseEmbedder
+
+
+if TYPE_CHECKING:
+    from chromadb import Collection
+
+MODES = ("add", "upsert")
+
+
+def record_batches(records:Union[pd.DataFrame, Iterable[dict]], batch_size:int,
+                   skip_batches:int = 0) -> Iterator[List[dict]]:
+    """Lists of at most batch_size records, from a DataFrame or an iterable of dicts, after the first skip_batches.
+
+    Skipped rows of a DataFrame are never read; skipped dicts of an iterable are
+    consumed without building batches, but whatever produces them still runs.
+    """
+    if isinstance(records, pd.DataFrame):
+        for start in range(skip_batches * batch_size, len(records), batch_size):
+            yield records.iloc[start:start + batch_size].to_dict(orient = 'records')
+        return
+    records = iter(records)
+    if skip_batches:
+        next(itertools.islice(records, skip_batches * batch_size, skip_batches * batch_size), None)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+TIMESTAMP_COLS = ("create_time", "update_time")
+
+
+def missing_as_none(column:list) -> list:
+    """Values of a column with the missing ones, NaN and NaT included, as None"""
+    series = pd.Series(column, dtype = object)
+    missing = series.isna().to_numpy()
+    return series.where(~missing, None).tolist() if missing.any() else column
+
+
+def metadata_dicts(columns:dict, n_rows:int, extra:dict = None) -> List[dict]:
+    """One metadata dict per row from lists of values by key, without the None, NaN or NaT values Chroma rejects"""
+    keys = list(columns) + list(extra or {})
+    if not keys:
+        return None
+    columns = {key: missing_as_none(column) for key, column in columns.items()}
+    values = list(columns.values()) + [itertools.repeat(value, n_rows) for value in (extra or {}).values()]
+    if any(value is None for column in columns.values() for value in column):
+        return [{key: value for key, value in zip(keys, row) if value is not None} for row in zip(*values)]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+def dataframe_metadatas(df:pd.DataFrame, meta_cols:list, exclude:list, now:str) -> List[dict]:
+    """Metadata dicts of the rows of df, see `metadata_dicts`.
+
+    create_time and update_time are now, in all rows when meta_cols is None and
+    then all columns but exclude are used, otherwise only if meta_cols lists them.
+    """
+    timestamps = {col: now for col in TIMESTAMP_COLS if meta_cols is None or col in meta_cols}
+    if meta_cols is None:
+        meta_cols = [col for col in df.columns if col not in exclude]
+    return metadata_dicts({col: df[col].tolist() for col in meta_cols if col not in timestamps}, len(df), timestamps)
+
+
+def record_metadatas(records:List[dict], meta_cols:list, exclude:list, now:str) -> List[dict]:
+    """Metadata dicts of records, as `dataframe_metadatas`; meta_cols None uses the keys of any record but exclude"""
+    timestamps = {col: now for col in TIMESTAMP_COLS if meta_cols is None or col in meta_cols}
+    if meta_cols is None:
+        meta_cols = [col for col in dict.fromkeys(key for record in records for key in record) if col not in exclude]
+    return metadata_dicts({col: [record.get(col) for record in records] for col in meta_cols if col not in timestamps},
+                          len(records), timestamps)
+
+
+@dataclass
+class IngestStats:
+    """Progress of an ingestion, batches and records counting those committed by earlier runs"""
+
+    batches:int = 0
+    records:int = 0
+    resumed_batches:int = 0
+    resumed_records:int = 0
+    embed_seconds:float = 0.0
+    insert_seconds:float = 0.0
+    elapsed:float = 0.0
+
+    @property
+    def new_records(self) -> int:
+        return self.records - self.resumed_records
+
+    @property
+    def records_per_second(self) -> float:
+        """Records embedded and added by this run per second"""
+        return self.new_records / max(self.elapsed, 1e-9)
+
+
+@dataclass
+class IngestPipeline:
+    """Embed records and add them to a Chroma collection, embedding the next batch while the last one is added.
+
+    A background thread embeds batches into a queue of at most queue_size batches,
+    from which the calling thread adds them to the collection. With a checkpoint
+    file, the number of committed batches is saved after every add, and a later
+    run on the same records skips them, so an interrupted ingest resumes where it stopped.
+    A checkpoint needs id_col, and records are then written with `Collection.upsert`
+    by default: a batch written just before a crash is not committed yet, and is
+    written again under the same ids on resume.
+
+    Args:
+        collection (Collection): the Chroma collection.
+        embedder (BaseEmbedder): embeds the documents of a batch.
+        doc_col (str, optional): field of the document text. Defaults to "text".
+        id_col (str, optional): field of the ids, random ids if None (no checkpoint only). Defaults to None.
+        meta_cols (list, optional): metadata fields, all others if None. Defaults to None.
+        batch_size (int, optional): records per batch. Defaults to 256.
+        queue_size (int, optional): embedded batches waiting to be added. Defaults to 4.
+        checkpoint_path (str, optional): JSON file of the committed batches. Defaults to None.
+        mode (str, optional): add or upsert, upsert with a checkpoint and add otherwise if None. Defaults to None.
+    """
+
+    collection:"Collection"
+    embedder:BaseEmbedder
+    doc_col:str = "text"
+    id_col:str = None
+    meta_cols:list = None
+    batch_size:int = 256
+    queue_size:int = 4
+    checkpoint_path:str = None
+    mode:str = None
+
+    def __post_init__(self):
+        if self.mode is None:
+            self.mode = "add" if self.checkpoint_path is None else "upsert"
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown mode {self.mode!r}, expected one of {MODES}")
+        if self.checkpoint_path is not None and self.id_col is None:
+            raise ValueError("checkpoint_path needs id_col, random ids would duplicate a batch written again on resume")
+
+    def load_checkpoint(self) -> dict:
+        if self.checkpoint_path is None or not Path(self.checkpoint_path).exists():
+            return {"batches": 0, "records": 0, "batch_size": self.batch_size}
+        with open(self.checkpoint_path, "r") as f:
+            checkpoint = json.load(f)
+        if checkpoint["batch_size"] != self.batch_size:
+            raise ValueError(f"Checkpoint {self.checkpoint_path} was written with batch_size {checkpoint['batch_size']}, "
+                             f"resume with the same batch_size")
+        return checkpoint
+
+    def save_checkpoint(self, stats:IngestStats) -> None:
+        if self.checkpoint_path is None:
+            return
+        path = Path(self.checkpoint_path)
+        path.parent.mkdir(parents = True, exist_ok = True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"batches": stats.batches, "records": stats.records, "batch_size": self.batch_size}, f)
+        os.replace(tmp_path, path)
+
+    def _prepare(self, batch:List[dict]) -> dict:
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self.id_col is None:
+            ids = [str(uuid.uuid4()) for _ in batch]
+        else:
+            ids = [str(record[self.id_col]) for record in batch]
+        metadatas = record_metadatas(batch, self.meta_cols, [self.id_col, self.doc_col], now)
+        documents = [record[self.doc_col] for record in batch]
+        return {"ids": ids, "documents": documents, "metadatas": metadatas}
+
+    def _embed_batches(self, batches:Iterator[List[dict]], out:queue.Queue, stop:threading.Event,
+                       stats:IngestStats) -> None:
+        """Producer: put (params, None) per batch, then (None, None), or (None, error) on failure"""
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout = 0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for batch in batches:
+                params = self._prepare(batch)
+                start = time.perf_counter()
+                embeddings = self.embedder(params["documents"])
+                stats.embed_seconds += time.perf_counter() - start
+                params["embeddings"] = embeddings if isinstance(embeddings, list) else np.asarray(embeddings).tolist()
+                if not put((params, None)):
+                    return
+            put((None, None))
+        except BaseException as e:
+            put((None, e))
+
+    def run(self, records:Union[pd.DataFrame, Iterable[dict]]) -> IngestStats:
+        """Ingest records, skipping the batches committed by earlier runs with the same checkpoint"""
+        checkpoint = self.load_checkpoint()
+        stats = IngestStats(batches = checkpoint["batches"], records = checkpoint["records"],
+                            resumed_batches = checkpoint["batches"], resumed_records = checkpoint["records"])
+        batches = record_batches(records, self.batch_size, skip_batches = stats.resumed_batches)
+        if stats.resumed_batches:
+            logging.info(f"Resuming after {stats.resumed_batches} committed batches, {stats.records} records")
+
+        write = self.collection.upsert if self.mode == "upsert" else self.collection.add
+        embedded, stop = queue.Queue(maxsize = self.queue_size), threading.Event()
+        producer = threading.Thread(target = self._embed_batches, args = (batches, embedded, stop, stats), daemon = True)
+        start = time.perf_counter()
+        producer.start()
+        try:
+            while True:
+                params, error = embedded.get()
+                if error is not None:
+                    raise error
+                if params is None:
+                    break
+                insert_start = time.perf_counter()
+                write(**params)
+                stats.insert_seconds += time.perf_counter() - insert_start
+                stats.batches += 1
+                stats.records += len(params["ids"])
+                stats.elapsed = time.perf_counter() - start
+                self.save_checkpoint(stats)
+                logging.info(f"Added batch {stats.batches}, {stats.records} records, "
+                             f"{stats.records_per_second:.1f} records/s")
+        finally:
+            stop.set()
+            producer.join()
+        stats.elapsed = time.perf_counter() - start
+        logging.info(f"Added {stats.new_records} records in {stats.elapsed:.1f}s, {stats.records_per_second:.1f} records/s "
+                     f"(embedding {stats.embed_seconds:.1f}s, adding {stats.insert_seconds:.1f}s)")
+        return stats
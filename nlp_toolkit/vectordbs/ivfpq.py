@@ -0,0 +1,274 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Tuple
+import json
+import numpy as np
+from ..keywords.index import concat_ranges, min_uint_dtype
+
+# codes are uint8, so every sub-quantizer has 256 centroids
+N_CODES = 256
+
+
+def assign(x:np.ndarray, centroids:np.ndarray, block_size:int = 65536) -> np.ndarray:
+    """Index of the nearest centroid of every row of x by L2 distance, by blocks of rows"""
+    centroid_norms = np.sum(centroids ** 2, axis = 1)
+    labels = np.empty(len(x), dtype = np.int64)
+    for start in range(0, len(x), block_size):
+        block = np.asarray(x[start:start + block_size], dtype = np.float32)
+        labels[start:start + len(block)] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis = 1)
+    return labels
+
+
+def cluster_sums(x:np.ndarray, labels:np.ndarray, k:int, max_cells:int = 2 ** 22) -> np.ndarray:
+    """(k, dim) sums of the rows of x by label, one bincount over (label, dimension) keys per block of rows"""
+    dim = x.shape[1]
+    sums = np.zeros(k * dim)
+    block_size = max(1, max_cells // max(dim, 1))
+    for start in range(0, len(x), block_size):
+        keys = labels[start:start + block_size, None] * dim + np.arange(dim)
+        sums += np.bincount(keys.ravel(), weights = x[start:start + block_size].ravel(), minlength = k * dim)
+    return sums.reshape(k, dim)
+
+
+def kmeans(x:np.ndarray, k:int, n_iter:int = 20, seed:int = 0) -> np.ndarray:
+    """Lloyd's k-means from k random rows of x, empty clusters re-seeded with random rows"""
+    x = np.asarray(x, dtype = np.float32)
+    if len(x) < k:
+        raise ValueError(f"k-means with {k} centroids needs at least {k} samples, got {len(x)}")
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace = False)].copy()
+    for _ in range(n_iter):
+        labels = assign(x, centroids)
+        counts = np.bincount(labels, minlength = k)
+        sums = cluster_sums(x, labels, k)
+        empty = counts == 0
+        centroids[~empty] = (sums[~empty] / counts[~empty, None]).astype(np.float32)
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace = False)]
+    return centroids
+
+
+@dataclass
+class IVFPQIndex:
+    """Approximate nearest neighbour index: inverted file over k-means lists, product-quantized residuals.
+
+    Every vector is assigned to its nearest of n_lists coarse centroids, and the
+    residual to that centroid is split into m sub-vectors, each encoded as the uint8
+    id of its nearest of 256 sub-centroids: m bytes per vector. A query scans the
+    nprobe lists nearest to it, scoring codes with per-query lookup tables
+    (asymmetric distance), and optionally re-ranks a shortlist with the exact
+    vectors. Rows are the positions of the vectors, e.g. in a LocalVectorStore.
+
+    Args:
+        n_lists (int, optional): coarse centroids. Defaults to 1024.
+        m (int, optional): sub-quantizers, must divide the dimension. Defaults to 16.
+        metric (str, optional): cosine, ip or l2, distances as in LocalVectorStore. Defaults to "cosine".
+        sample_size (int, optional): vectors k-means is trained on. Defaults to 100_000.
+        n_iter (int, optional): k-means iterations. Defaults to 20.
+        seed (int, optional): seed of the training sample and k-means. Defaults to 0.
+    """
+
+    n_lists:int = 1024
+    m:int = 16
+    metric:str = "cosine"
+    sample_size:int = 100_000
+    n_iter:int = 20
+    seed:int = 0
+
+    ARRAYS = ("centroids", "codebooks", "list_indptr", "codes", "rows", "sq_norms")
+
+    def __post_init__(self):
+        self.centroids = None
+        self.codebooks = None
+        self.list_indptr = np.zeros(self.n_lists + 1, dtype = np.int64)
+        self.codes = np.zeros((0, self.m), dtype = np.uint8)
+        self.rows = np.zeros(0, dtype = np.uint32)
+        # with l2, the squared norm of every encoded vector
+        self.sq_norms = np.zeros(0, dtype = np.float32)
+
+    @property
+    def n_rows(self) -> int:
+        """Vectors in the index"""
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def _prepare(self, x:np.ndarray) -> np.ndarray:
+        x = np.atleast_2d(np.asarray(x, dtype = np.float32))
+        if self.metric == "cosine":
+            x = x / np.maximum(np.linalg.norm(x, axis = 1, keepdims = True), 1e-12)
+        return x
+
+    def _split(self, x:np.ndarray) -> np.ndarray:
+        """(m, n, dim / m) sub-vectors of the rows of x"""
+        return x.reshape(len(x), self.m, -1).transpose(1, 0, 2)
+
+    def train(self, x:np.ndarray):
+        """Fit the coarse centroids and the sub-quantizers on a sample of x"""
+        if x.shape[1] % self.m:
+            raise ValueError(f"Dimension {x.shape[1]} is not divisible by m = {self.m}")
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(len(x), min(self.sample_size, len(x)), replace = False))
+        sample = self._prepare(x[sample])
+        self.centroids = kmeans(sample, self.n_lists, n_iter = self.n_iter, seed = self.seed)
+        residuals = self._split(sample - self.centroids[assign(sample, self.centroids)])
+        self.codebooks = np.stack([kmeans(sub, N_CODES, n_iter = self.n_iter, seed = self.seed + 1 + i)
+                                   for i, sub in enumerate(residuals)])
+        return self
+
+    def encode(self, x:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(list, codes) of every vector"""
+        x = self._prepare(x)
+        lists = assign(x, self.centroids)
+        residuals = self._split(x - self.centroids[lists])
+        codes = np.stack([assign(sub, codebook) for sub, codebook in zip(residuals, self.codebooks)], axis = 1)
+        return lists, codes.astype(np.uint8)
+
+    def add(self, x:np.ndarray, rows:np.ndarray = None, block_size:int = 65536) -> None:
+        """Encode vectors into their lists, rows defaulting to the next positions"""
+        if rows is None:
+            rows = np.arange(self.n_rows, self.n_rows + len(x))
+        lists, codes, sq_norms = [], [], []
+        for start in range(0, len(x), block_size):
+            block_lists, block_codes = self.encode(x[start:start + block_size])
+            lists.append(block_lists)
+            codes.append(block_codes)
+            if self.metric == "l2":
+                reconstructed = self.centroids[block_lists] + self._decode(block_codes)
+                sq_norms.append(np.sum(reconstructed ** 2, axis = 1))
+        old_lists = np.repeat(np.arange(self.n_lists), np.diff(self.list_indptr))
+        lists = np.concatenate([old_lists] + lists)
+        order = np.argsort(lists, kind = "stable")
+        self.codes = np.concatenate([self.codes] + codes)[order]
+        if self.metric == "l2":
+            self.sq_norms = np.concatenate([self.sq_norms] + sq_norms)[order].astype(np.float32)
+        all_rows = np.concatenate([self.rows, np.asarray(rows)])
+        self.rows = all_rows[order].astype(min_uint_dtype(int(all_rows.max(initial = 0))))
+        self.list_indptr = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength = self.n_lists))]).astype(np.int64)
+
+    def search(self, queries:np.ndarray, k:int = 10, nprobe:int = 16, rerank:int = 0,
+               vectors:np.ndarray = None, allowed:np.ndarray = None, 
+               max_candidates:int = 2 ** 16) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate top k rows of every query.
+
+        Queries are searched by blocks: the lookup tables of a block are one einsum
+        and the codes of all its probed lists are gathered at once. Blocks are cut
+        so that their queries times the most candidates of one of them stay under
+        max_candidates, a query with more is searched alone.
+
+        Args:
+            nprobe (int, optional): lists scanned per query. Defaults to 16.
+            rerank (int, optional): with vectors, re-score this many best candidates exactly. Defaults to 0.
+            vectors (np.ndarray, optional): the indexed vectors by row, e.g. a memory map. Defaults to None.
+            allowed (np.ndarray, optional): boolean mask of the rows that may be returned. Defaults to None.
+            max_candidates (int, optional): bound on the candidates scored at once, see above; small
+                blocks keep their lookup tables in cache. Defaults to 2 ** 16.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (rows, distances) by increasing distance, padded
+                with row -1 and distance inf when fewer rows are found.
+        """
+        queries = self._prepare(queries)
+        nprobe = min(nprobe, self.n_lists)
+        centroid_products = queries @ self.centroids.T
+        if self.metric == "l2":
+            coarse = np.sum(self.centroids ** 2, axis = 1) - 2 * centroid_products
+        else:
+            coarse = -centroid_products
+        probes = np.argpartition(coarse, nprobe - 1, axis = 1)[:, :nprobe]
+        n_keep = max(k, rerank if vectors is not None else 0)
+
+        out_rows = np.full((len(queries), k), -1, dtype = np.int64)
+        out_distances = np.full((len(queries), k), np.inf, dtype = np.float32)
+        n_candidates = np.maximum((self.list_indptr[probes + 1] - self.list_indptr[probes]).sum(axis = 1), 1)
+        start = 0
+        while start < len(queries):
+            # queries times the most candidates so far, growing with the end of the block
+            block_candidates = np.maximum.accumulate(n_candidates[start:start + max_candidates])
+            sizes = np.arange(1, len(block_candidates) + 1) * block_candidates
+            end = start + max(1, int(np.searchsorted(sizes, max_candidates, side = "right")))
+            rows, distances = self._search_block(queries[start:end], centroid_products[start:end], probes[start:end],
+                                                 n_keep, vectors if rerank else None, allowed)
+            order = np.argsort(distances, axis = 1, kind = "stable")[:, :k]
+            out_rows[start:end, :order.shape[1]] = np.take_along_axis(rows, order, axis = 1)
+            out_distances[start:end, :order.shape[1]] = np.take_along_axis(distances, order, axis = 1)
+            start = end
+        return out_rows, out_distances
+
+    def _search_block(self, queries:np.ndarray, centroid_products:np.ndarray, probes:np.ndarray, n_keep:int,
+                      vectors:np.ndarray, allowed:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, distances) of the n_keep best candidates of every query, unordered, exact with vectors"""
+        n_queries, nprobe = probes.shape
+        # inner products of every query sub-vector with every sub-centroid, (n queries, m, 256)
+        tables = np.einsum("qmd,mkd->qmk", queries.reshape(n_queries, self.m, -1), self.codebooks, optimize = True)
+        starts, ends = self.list_indptr[probes].ravel(), self.list_indptr[probes + 1].ravel()
+        positions = concat_ranges(starts, ends)
+        probe_of = np.repeat(np.arange(n_queries * nprobe), ends - starts)
+        if allowed is not None:
+            keep = allowed[self.rows[positions]]
+            positions, probe_of = positions[keep], probe_of[keep]
+        query_of = probe_of // nprobe
+        codes = self.codes[positions]
+
+        # <q, c + r> = <q, c> + the table entries of r's codes, read from the flat tables
+        products = np.take_along_axis(centroid_products, probes, axis = 1).ravel()[probe_of]
+        table_starts = query_of * (self.m * N_CODES)
+        tables = tables.ravel()
+        for j in range(self.m):
+            products += np.take(tables, table_starts + j * N_CODES + codes[:, j])
+        if self.metric == "l2":
+            # |q - (c + r)|^2 = |q|^2 - 2 <q, c + r> + |c + r|^2
+            distances = np.sum(queries ** 2, axis = 1)[query_of] - 2 * products + self.sq_norms[positions]
+        else:
+            distances = 1 - products
+
+        # candidates of a query are contiguous, padded to the longest with row -1 and distance inf
+        counts = np.bincount(query_of, minlength = n_queries)
+        width = max(int(counts.max()), 1)
+        cells = np.arange(len(query_of)) + (np.arange(n_queries) * width - (np.cumsum(counts) - counts))[query_of]
+        rows = np.full((n_queries, width), -1, dtype = np.int64)
+        block_distances = np.full((n_queries, width), np.inf, dtype = np.float32)
+        rows.ravel()[cells] = self.rows[positions]
+        block_distances.ravel()[cells] = distances
+        if n_keep < width:
+            top = np.argpartition(block_distances, n_keep - 1, axis = 1)[:, :n_keep]
+            rows, block_distances = np.take_along_axis(rows, top, axis = 1), np.take_along_axis(block_distances, top, axis = 1)
+
+        if vectors is not None:
+            found = rows >= 0
+            block_distances[found] = self._exact_distances(queries[np.nonzero(found)[0]], vectors, rows[found])
+        return rows, block_distances
+
+    def _decode(self, codes:np.ndarray) -> np.ndarray:
+        """Residuals encoded by codes"""
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis = 1)
+
+    def _exact_distances(self, queries:np.ndarray, vectors:np.ndarray, rows:np.ndarray) -> np.ndarray:
+        """Exact distance of every row's vector to the query on the same line of queries"""
+        order = np.argsort(rows)
+        exact = np.empty(len(rows), dtype = np.float32)
+        candidates = self._prepare(np.asarray(vectors[rows[order]], dtype = np.float32))
+        if self.metric == "l2":
+            exact[order] = np.sum((candidates - queries[order]) ** 2, axis = 1)
+        else:
+            exact[order] = 1 - np.einsum("ij,ij->i", candidates, queries[order])
+        return exact
+
+    def save(self, path:str) -> None:
+        folder = Path(path)
+        folder.mkdir(parents = True, exist_ok = True)
+        for name in self.ARRAYS:
+            np.save(folder / f"{name}.npy", getattr(self, name))
+        with open(folder / "meta.json", "w") as f:
+            json.dump({"n_lists": self.n_lists, "m": self.m, "metric": self.metric, "sample_size": self.sample_size,
+                       "n_iter": self.n_iter, "seed": self.seed}, f)
+
+    @classmethod
+    def load(cls, path:str, mmap:bool = True):
+        folder = Path(path)
+        with open(folder / "meta.json", "r") as f:
+            obj = cls(**json.load(f))
+        for name in cls.ARRAYS:
+            setattr(obj, name, np.load(folder / f"{name}.npy", mmap_mode = "r" if mmap else None))
+        return obj
@@ -0,0 +1,541 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Tuple
+import datetime
+import json
+import logging
+import operator
+import os
+import random
+import uuid
+import numpy as np
+import pandas as pd
+from ..cache import ResultCache
+from ..embedders.base import BaseEmbedder
+from .chroma import QUERY_INCLUDE
+from .ingest import IngestPipeline, IngestStats, dataframe_metadatas
+from .ivfpq import IVFPQIndex
+from .results import Document, QueryResult, ResultSet, query_dict
+
+METRICS = ("cosine", "ip", "l2")
+
+_COMPARISONS = {
+    "$eq": operator.eq, "$ne": operator.ne,
+    "$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le,
+    "$in": lambda value, values: value in values, "$nin": lambda value, values: value not in values,
+}
+
+
+def where_mask(columns:dict, n_rows:int, where:dict = None) -> np.ndarray:
+    """Rows whose metadata matches a Chroma where filter, e.g. {"$and": [{"a": 1}, {"b": {"$gt": 2}}]}"""
+    mask = np.ones(n_rows, dtype = bool)
+    for key, condition in (where or {}).items():
+        if key in ("$and", "$or"):
+            masks = [where_mask(columns, n_rows, clause) for clause in condition]
+            mask &= np.logical_and.reduce(masks) if key == "$and" else np.logical_or.reduce(masks)
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        column = columns.get(key, [None] * n_rows)
+        for op, operand in condition.items():
+            compare = _COMPARISONS[op]
+            # rows without the key only match $ne and $nin, like in Chroma
+            missing = op in ("$ne", "$nin")
+            mask &= np.fromiter((missing if value is None else compare(value, operand) for value in column),
+                                dtype = bool, count = n_rows)
+    return mask
+
+
+def where_document_mask(documents:list, where_document:dict = None) -> np.ndarray:
+    """Rows whose document matches a Chroma where_document filter, $contains and $not_contains"""
+    mask = np.ones(len(documents), dtype = bool)
+    for key, condition in (where_document or {}).items():
+        if key in ("$and", "$or"):
+            masks = [where_document_mask(documents, clause) for clause in condition]
+            mask &= np.logical_and.reduce(masks) if key == "$and" else np.logical_or.reduce(masks)
+        elif key == "$contains":
+            mask &= np.fromiter((condition in document for document in documents), dtype = bool, count = len(documents))
+        elif key == "$not_contains":
+            mask &= np.fromiter((condition not in document for document in documents), dtype = bool, count = len(documents))
+        else:
+            raise ValueError(f"Unsupported where_document operator {key}")
+    return mask
+
+
+def _top_k(scores:np.ndarray, rows:np.ndarray, k:int) -> Tuple[np.ndarray, np.ndarray]:
+    """The k largest scores of every row of scores, and the matching rows, unordered"""
+    if scores.shape[1] <= k:
+        return scores, rows
+    top = np.argpartition(-scores, k - 1, axis = 1)[:, :k]
+    return np.take_along_axis(scores, top, axis = 1), np.take_along_axis(rows, top, axis = 1)
+
+
+@dataclass
+class LocalVectorStore:
+    """Exact nearest neighbour search over a memory-mapped embedding matrix, with the API of ChromaCrud.
+
+    Embeddings are rows of embeddings.f32 (or .f16) under path, ids, documents and
+    metadata columns are kept in memory and persisted as an append-only log,
+    records.jsonl, replayed on load; a log line is written after its embeddings,
+    so an interrupted write leaves the store as it was before it.
+
+    Queries are scored by blocks of block_size rows with one matrix multiply for all
+    queries of a batch, keeping the top k of each with argpartition. Distances
+    are 1 - cosine similarity, 1 - inner product, or squared L2 as in Chroma.
+
+    For large stores, `build_index` trains an IVFPQIndex saved under path/ivfpq,
+    which `search` then uses, scanning nprobe lists and re-ranking the best rerank
+    candidates with the stored embeddings; rows added after the index was built or
+    last updated with `update_index` are scanned exactly.
+
+    Args:
+        path (str): folder of the store.
+        embedder (BaseEmbedder): embeds documents inserted without embeddings, and query texts.
+        dtype (str, optional): float32 or float16 storage of the embeddings. Defaults to "float32".
+        metric (str, optional): cosine, ip or l2. Defaults to "cosine".
+        block_size (int, optional): rows scored at a time. Defaults to 65536.
+        cache (ResultCache, optional): cache of query results. Defaults to None.
+        nprobe (int, optional): index lists scanned per query. Defaults to 16.
+        rerank (int, optional): index candidates re-scored exactly, 0 for none. Defaults to 100.
+    """
+
+    path:str
+    embedder:BaseEmbedder = None
+    dtype:str = "float32"
+    metric:str = "cosine"
+    block_size:int = 65536
+    cache:ResultCache = None
+    nprobe:int = 16
+    rerank:int = 100
+
+    def __post_init__(self):
+        if self.dtype not in ("float32", "float16"):
+            raise ValueError(f"Unknown dtype {self.dtype!r}, expected 'float32' or 'float16'")
+        if self.metric not in METRICS:
+            raise ValueError(f"Unknown metric {self.metric!r}, expected one of {METRICS}")
+        self.path = Path(self.path)
+        self.path.mkdir(parents = True, exist_ok = True)
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            self.dtype, self.metric, self.dim = meta["dtype"], meta["metric"], meta["dim"]
+        else:
+            self.dim = None
+        self._ids, self._documents, self._columns, self._row_of = [], [], {}, {}
+        self._embeddings = None
+        self._norms = np.zeros(0, dtype = np.float32)
+        self._replay()
+        self.index = IVFPQIndex.load(self.index_path, mmap = False) if (self.index_path / "meta.json").exists() else None
+
+    @property
+    def embeddings_path(self) -> Path:
+        return self.path / ("embeddings.f16" if self.dtype == "float16" else "embeddings.f32")
+
+    @property
+    def index_path(self) -> Path:
+        return self.path / "ivfpq"
+
+    @property
+    def cache_namespace(self) -> str:
+        return f"local:{self.path.resolve()}"
+
+    def _invalidate_cache(self) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(self.cache_namespace)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def ids(self) -> list:
+        """Get ids of all documents in the store"""
+        return self._ids
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Memory map of the embeddings of all documents"""
+        if self.dim is None:
+            return np.zeros((0, 0), dtype = self.dtype)
+        return self._matrix(len(self))[:len(self)]
+
+    def _matrix(self, n_rows:int) -> np.memmap:
+        """Memory map of the embedding file holding at least n_rows rows, grown by doubling"""
+        if self._embeddings is not None and len(self._embeddings) >= n_rows:
+            return self._embeddings
+        itemsize = np.dtype(self.dtype).itemsize
+        file = self.embeddings_path
+        capacity = file.stat().st_size // (itemsize * self.dim) if file.exists() else 0
+        if capacity < n_rows:
+            capacity = max(n_rows, 2 * capacity, 1024)
+            with open(file, "ab") as f:
+                f.truncate(capacity * self.dim * itemsize)
+            self._embeddings = None
+        if self._embeddings is None or len(self._embeddings) < capacity:
+            self._embeddings = np.memmap(file, dtype = self.dtype, mode = "r+", shape = (capacity, self.dim))
+        return self._embeddings
+
+    def _replay(self) -> None:
+        """Rebuild ids, documents and metadata from the log"""
+        log_path = self.path / "records.jsonl"
+        if not log_path.exists():
+            return
+        with open(log_path, "rb") as f:
+            lines = f.readlines()
+        for i, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if i < len(lines) - 1:
+                    raise
+                # the last write was interrupted: drop it, its rows are overwritten by the next add
+                logging.warning(f"Dropping the incomplete last record of {log_path}")
+                with open(log_path, "r+b") as f:
+                    f.truncate(sum(len(line) for line in lines[:-1]))
+                break
+            self._apply(record)
+        self._norms = self._row_norms(0, len(self))
+
+    def _row_norms(self, start:int, stop:int) -> np.ndarray:
+        """L2 norms of the stored embeddings of rows start to stop"""
+        norms = [np.linalg.norm(np.asarray(self.embeddings[i:min(i + self.block_size, stop)], dtype = np.float32), axis = 1)
+                 for i in range(start, stop, self.block_size)]
+        return np.concatenate(norms) if norms else np.zeros(0, dtype = np.float32)
+
+    def _log(self, record:dict) -> None:
+        with open(self.path / "records.jsonl", "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(record)
+
+    def _apply(self, record:dict) -> None:
+        n_rows = len(self)
+        if record["op"] == "add":
+            ids = record["ids"]
+            self._row_of.update(zip(ids, range(n_rows, n_rows + len(ids))))
+            self._ids.extend(ids)
+            self._documents.extend(record["documents"])
+            for key in set(key for metadata in record["metadatas"] for key in metadata) - set(self._columns):
+                self._columns[key] = [None] * n_rows
+            for key, column in self._columns.items():
+                column.extend(metadata.get(key) for metadata in record["metadatas"])
+        elif record["op"] == "update":
+            rows = [self._row_of[id_] for id_ in record["ids"]]
+            for key, value in record["metadata"].items():
+                column = self._columns.setdefault(key, [None] * n_rows)
+                for row in rows:
+                    column[row] = value
+        elif record["op"] == "delete_key":
+            self._columns.pop(record["key"], None)
+
+    def _embed(self, texts:List[str]) -> np.ndarray:
+        if self.embedder is None:
+            raise ValueError("An embedder is required to embed texts, pass embedder to LocalVectorStore or give embeddings")
+        return self.embedder(texts)
+
+    def add(self, ids:List[str], embeddings = None, metadatas:List[dict] = None, documents:List[str] = None) -> None:
+        """Add documents like `Collection.add`, skipping ids already in the store"""
+        ids = [str(id_) for id_ in ids]
+        if documents is None:
+            documents = [None] * len(ids)
+        if metadatas is None:
+            metadatas = [{}] * len(ids)
+        if embeddings is None:
+            embeddings = self._embed(documents)
+        embeddings = np.asarray(embeddings, dtype = np.float32)
+
+        seen = set(self._row_of)
+        keep = [i for i, id_ in enumerate(ids) if not (id_ in seen or seen.add(id_))]
+        if len(keep) < len(ids):
+            logging.warning(f"Skipping {len(ids) - len(keep)} ids already in the store")
+        if not keep:
+            return
+        embeddings = embeddings[keep]
+
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with open(self.path / "meta.json", "w") as f:
+                json.dump({"dtype": self.dtype, "metric": self.metric, "dim": self.dim}, f)
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match the store's {self.dim}")
+
+        n_rows = len(self)
+        matrix = self._matrix(n_rows + len(keep))
+        matrix[n_rows:n_rows + len(keep)] = embeddings
+        matrix.flush()
+        self._log({"op": "add", "ids": [ids[i] for i in keep], "documents": [documents[i] for i in keep],
+                   "metadatas": [metadatas[i] for i in keep]})
+        self._norms = np.concatenate([self._norms, self._row_norms(n_rows, len(self))])
+        self._invalidate_cache()
+
+    def insert_dataframe(self,
+                         df:pd.DataFrame,
+                         id_col:str = None,
+                         doc_col:str = "text",
+                         meta_cols:list = None,
+                         embeddings:List[List[float]] = None) -> None:
+        if id_col is None:
+            ids = [str(uuid.uuid4()) for _ in range(len(df))]
+        else:
+            ids = df[id_col].astype(str).tolist()
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        documents = df[doc_col].tolist()
+        metadatas = dataframe_metadatas(df, meta_cols, [id_col, doc_col], now)
+        self.add(ids = ids, embeddings = embeddings, metadatas = metadatas, documents = documents)
+
+    def insert_dataframe_batch(self,
+                               df:pd.DataFrame,
+                               id_col:str = None,
+                               doc_col:str = "text",
+                               meta_cols:list = None,
+                               embeddings:List[List[float]] = None,
+                               batch_size:int = 256) -> None:
+        for start in range(0, len(df), batch_size):
+            self.insert_dataframe(
+                df = df.iloc[start:start + batch_size],
+                id_col = id_col,
+                doc_col = doc_col,
+                meta_cols = meta_cols,
+                embeddings = None if embeddings is None else embeddings[start:start + batch_size])
+
+    def ingest(self,
+               records,
+               embedder:BaseEmbedder = None,
+               id_col:str = None,
+               doc_col:str = "text",
+               meta_cols:list = None,
+               batch_size:int = 256,
+               checkpoint_path:str = None) -> IngestStats:
+        """Embed and add a DataFrame or an iterable of dicts, see `IngestPipeline`"""
+        # add skips the ids already stored, so a batch written again on resume is not duplicated
+        pipeline = IngestPipeline(self, embedder or self.embedder, doc_col = doc_col, id_col = id_col,
+                                  meta_cols = meta_cols, batch_size = batch_size, checkpoint_path = checkpoint_path,
+                                  mode = "add")
+        return pipeline.run(records)
+
+    def update_metafield(self, ids = None, **kwargs) -> None:
+        """The only thing you can update is the metafield."""
+        if ids is None:
+            ids = self.ids
+        kwargs.update(update_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        missing = [id_ for id_ in ids if id_ not in self._row_of]
+        if missing:
+            raise KeyError(f"{len(missing)} ids not in the store, e.g. {missing[0]!r}")
+        self._log({"op": "update", "ids": list(ids), "metadata": kwargs})
+        self._invalidate_cache()
+
+    def delete_by_key(self, key_name:str) -> None:
+        """Remove a metadata field from all documents"""
+        self._log({"op": "delete_key", "key": key_name})
+        self._invalidate_cache()
+
+    def _result_set(self, rows:np.ndarray, include:list, distances:np.ndarray = None) -> ResultSet:
+        """ResultSet of rows, with one fancy index of the embeddings and metadata as columns"""
+        rows = np.asarray(rows, dtype = np.int64)
+        return ResultSet(
+            ids = [self._ids[row] for row in rows],
+            embeddings = np.asarray(self.embeddings[rows], dtype = np.float32) if "embeddings" in include else None,
+            documents = [self._documents[row] for row in rows] if "documents" in include else None,
+            distances = distances,
+            columns = {key: [column[row] for row in rows] for key, column in self._columns.items()}
+            if "metadatas" in include else None)
+
+    def _rows(self, where:dict = None, where_document:dict = None) -> np.ndarray:
+        mask = where_mask(self._columns, len(self), where)
+        if where_document:
+            mask &= where_document_mask(self._documents, where_document)
+        return np.flatnonzero(mask)
+
+    def get_documents(self,
+                      ids:list = None,
+                      where = None,
+                      limit = None,
+                      offset = None,
+                      where_document = None,
+                      include = None) -> List[Document]:
+        return self.get_result_set(ids = ids, where = where, limit = limit, offset = offset,
+                                   where_document = where_document, include = include).to_documents()
+
+    def get_result_set(self,
+                       ids:list = None,
+                       where = None,
+                       limit = None,
+                       offset = None,
+                       where_document = None,
+                       include = None) -> ResultSet:
+        """Documents like `get_documents`, as one columnar ResultSet"""
+        if include is None:
+            include = ['metadatas', 'documents', 'embeddings']
+        rows = self._rows(where, where_document)
+        if ids is not None:
+            wanted = [self._row_of[str(id_)] for id_ in ids if str(id_) in self._row_of]
+            rows = np.asarray(wanted, dtype = np.int64)[np.isin(wanted, rows)]
+        rows = rows[offset or 0:]
+        if limit is not None:
+            rows = rows[:limit]
+        return self._result_set(rows, include)
+
+    def random_doc(self, where:dict = None) -> Document:
+        rows = self._rows(where)
+        return self._result_set([random.choice(rows)], ['documents', 'metadatas', 'embeddings']).to_documents()[0]
+
+    def random_docs(self, n:int = 10, where:dict = None) -> List[Document]:
+        rows = self._rows(where)
+        rows = random.sample(rows.tolist(), min(n, len(rows)))
+        return self._result_set(rows, ['documents', 'metadatas']).to_documents()
+
+    def build_index(self, n_lists:int = 1024, m:int = 16, sample_size:int = 100_000, n_iter:int = 20, seed:int = 0) -> IVFPQIndex:
+        """Train an IVFPQIndex on the stored embeddings, encode them all and save it, see `IVFPQIndex`"""
+        index = IVFPQIndex(n_lists = n_lists, m = m, metric = self.metric, sample_size = sample_size,
+                           n_iter = n_iter, seed = seed)
+        index.train(self.embeddings)
+        index.add(self.embeddings)
+        index.save(self.index_path)
+        self.index = index
+        self._invalidate_cache()
+        return index
+
+    def update_index(self) -> None:
+        """Encode the rows added since the index was built, with its trained centroids, and save it"""
+        if self.index is None or self.index.n_rows == len(self):
+            return
+        self.index.add(self.embeddings[self.index.n_rows:], rows = np.arange(self.index.n_rows, len(self)))
+        self.index.save(self.index_path)
+
+    def search(self, query_embeddings:np.ndarray, n_results:int = 10, where:dict = None,
+               exact:bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Top n rows and their distances for every query embedding, from the index if built.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (rows, distances), arrays of n_results columns
+                by increasing distance, fewer when fewer documents match where; from the
+                index, rows a query found too few neighbours for are -1.
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype = np.float32))
+        allowed = None if not where else where_mask(self._columns, len(self), where)
+        n_allowed = len(self) if allowed is None else int(allowed.sum())
+        k = min(n_results, n_allowed)
+        if k == 0:
+            return np.zeros((len(queries), 0), dtype = np.int64), np.zeros((len(queries), 0), dtype = np.float32)
+        if self.metric == "cosine":
+            queries = queries / np.maximum(np.linalg.norm(queries, axis = 1, keepdims = True), 1e-12)
+        if self.index is None or exact:
+            return self._scan(queries, k, allowed)
+
+        rows, distances = self.index.search(queries, k = k, nprobe = self.nprobe, rerank = self.rerank,
+                                            vectors = self.embeddings, allowed = allowed)
+        if self.index.n_rows < len(self):
+            tail_rows, tail_distances = self._scan(queries, k, allowed, start = self.index.n_rows)
+            rows, distances = np.concatenate([rows, tail_rows], axis = 1), np.concatenate([distances, tail_distances], axis = 1)
+            order = np.argsort(distances, axis = 1, kind = "stable")[:, :k]
+            rows, distances = np.take_along_axis(rows, order, axis = 1), np.take_along_axis(distances, order, axis = 1)
+        return rows, distances
+
+    def _scan(self, queries:np.ndarray, k:int, allowed:np.ndarray = None, start:int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top k rows from start on, one matrix multiply per block"""
+        matrix = self.embeddings
+        best_scores = np.full((len(queries), 0), -np.inf, dtype = np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype = np.int64)
+        for start in range(start, len(self), self.block_size):
+            block = np.asarray(matrix[start:start + self.block_size], dtype = np.float32)
+            # similarities, larger is closer
+            scores = queries @ block.T
+            norms = self._norms[start:start + len(block)]
+            if self.metric == "cosine":
+                scores /= np.maximum(norms, 1e-12)
+            elif self.metric == "l2":
+                scores = 2 * scores - norms ** 2
+            if allowed is not None:
+                scores[:, ~allowed[start:start + len(block)]] = -np.inf
+
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            scores, rows = _top_k(scores, rows, k)
+            best_scores, best_rows = _top_k(np.concatenate([best_scores, scores], axis = 1),
+                                            np.concatenate([best_rows, rows], axis = 1), k)
+
+        order = np.argsort(-best_scores, axis = 1, kind = "stable")
+        best_scores, best_rows = np.take_along_axis(best_scores, order, axis = 1), np.take_along_axis(best_rows, order, axis = 1)
+        # with where, fewer than k allowed rows may be left after start
+        best_rows[np.isneginf(best_scores)] = -1
+        if self.metric == "l2":
+            distances = np.sum(queries ** 2, axis = 1, keepdims = True) - best_scores
+        else:
+            distances = 1 - best_scores
+        return best_rows, distances
+
+    def query(self, query_text:str, n_results:int = 10, where:dict = None) -> List[QueryResult]:
+        """Query the store with a query text string"""
+        if self.cache is not None:
+            return self.cache.get_or_compute(
+                self.cache_namespace, ["query", query_text, n_results, where],
+                lambda: self._query(query_text, n_results = n_results, where = where))
+        return self._query(query_text, n_results = n_results, where = where)
+
+    def _query(self, query_text:str, n_results:int = 10, where:dict = None) -> List[QueryResult]:
+        return self.query_batch([query_text], n_results = n_results, where = where,
+                                include = ["metadatas", "documents", "distances", "embeddings"])[0]
+
+    def query_batch(self,
+                    query_texts:List[str] = None,
+                    n_results:int = 10,
+                    where:dict = None,
+                    query_embeddings = None,
+                    include:list = None,
+                    chunk_size:int = None) -> List[List[QueryResult]]:
+        """Query the store with many texts, or their embeddings, see `query_result_sets`"""
+        return [result_set.to_documents(QueryResult) for result_set in self.query_result_sets(
+            query_texts, n_results = n_results, where = where, query_embeddings = query_embeddings,
+            include = include, chunk_size = chunk_size)]
+
+    def query_result_sets(self,
+                          query_texts:List[str] = None,
+                          n_results:int = 10,
+                          where:dict = None,
+                          query_embeddings = None,
+                          include:list = None,
+                          chunk_size:int = None) -> List[ResultSet]:
+        """Query the store with many texts, or their embeddings, scored together chunk_size at a time"""
+        if include is None:
+            include = QUERY_INCLUDE
+        if query_embeddings is None:
+            query_embeddings = self._embed(query_texts)
+        query_embeddings = np.atleast_2d(np.asarray(query_embeddings, dtype = np.float32))
+        chunk_size = chunk_size or max(len(query_embeddings), 1)
+        results = []
+        for start in range(0, len(query_embeddings), chunk_size):
+            rows, distances = self.search(query_embeddings[start:start + chunk_size], n_results = n_results, where = where)
+            # rows the index found too few neighbours for are -1
+            results.extend([self._result_set(query_rows[query_rows >= 0], include, query_distances[query_rows >= 0])
+                            for query_rows, query_distances in zip(rows, distances)])
+        return results
+
+    def recommend(self, n_results:int = 10, where:dict = None, where_query:dict = None) -> Tuple[Document, List[QueryResult]]:
+        """Randomly select a document and query the store for n_results similar documents"""
+        doc = self.random_doc(where = where)
+        return doc, self.recommend_by_doc(doc, n_results = n_results, where_query = where_query)
+
+    def recommend_by_doc(self, doc:Document, n_results:int = 10, where_query:dict = None) -> List[QueryResult]:
+        """Documents similar to doc, by its embedding when it has one"""
+        if doc.embedding is not None:
+            return self.query_batch(query_embeddings = [doc.embedding], n_results = n_results, where = where_query)[0]
+        return self.query_batch([doc.document], n_results = n_results, where = where_query)[0]
+
+    def recommend_by_text(self, text:str, n_results:int = 10, where_query:dict = None) -> Tuple[Document, List[QueryResult]]:
+        doc = Document(id = "", document = text)
+        return doc, self.query_batch([text], n_results = n_results, where = where_query)[0]
+
+    def recommend_by_texts(self, texts:List[str], n_results:int = 10, where_query:dict = None) -> List[List[QueryResult]]:
+        """recommend_by_text for many texts, queried together"""
+        return self.query_batch(texts, n_results = n_results, where = where_query)
+
+    def mean_seed_query(self, ids, n_results:int = 10) -> dict:
+        """Query by the mean embedding of ids, a `Collection.query` result like `ChromaCrud.mean_seed_query`"""
+        rows = [self._row_of[str(id_)] for id_ in ids]
+        mean_vector = np.asarray(self.embeddings[rows], dtype = np.float32).mean(axis = 0)
+        return query_dict(self.query_result_sets(query_embeddings = [mean_vector], n_results = n_results))
+
+    def concat_text_query(self, ids, n_results:int = 10) -> dict:
+        """Query by the joined documents of ids, a `Collection.query` result like `ChromaCrud.concat_text_query`"""
+        query_text = " ".join(self._documents[self._row_of[str(id_)]] for id_ in ids)
+        return query_dict(self.query_result_sets([query_text], n_results = n_results))
@@ -0,0 +1,195 @@
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Union
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class Document:
+    """A document with an ID, embedding, metadata, and document text."""
+
+    id: str
+    embedding: List[float] = None
+    metadata: Dict[str, str] = None
+    document: str = None
+
+@dataclass
+class QueryResult(Document):
+    """
+    Represents the result of a query.
+
+    Attributes:
+        distance (float): The distance of the query result.
+    """
+    distance: float = None
+
+
+def object_array(values) -> np.ndarray:
+    """1-d object array of values, never broadcast to 2-d like np.asarray does with lists of lists"""
+    if isinstance(values, np.ndarray) and values.dtype == object and values.ndim == 1:
+        return values
+    array = np.empty(len(values), dtype = object)
+    array[:] = values
+    return array
+
+
+class ResultRow:
+    """View of one row of a ResultSet, fields read from its columns on access"""
+
+    __slots__ = ("results", "index")
+
+    def __init__(self, results:"ResultSet", index:int):
+        self.results = results
+        self.index = index
+
+    @property
+    def id(self) -> str:
+        return self.results.ids[self.index]
+
+    @property
+    def embedding(self) -> np.ndarray:
+        return None if self.results.embeddings is None else self.results.embeddings[self.index]
+
+    @property
+    def metadata(self) -> dict:
+        return self.results.metadata(self.index)
+
+    @property
+    def document(self) -> str:
+        return None if self.results.documents is None else self.results.documents[self.index]
+
+    @property
+    def distance(self) -> float:
+        return None if self.results.distances is None else float(self.results.distances[self.index])
+
+    def to_document(self) -> Document:
+        return self.results[self.index:self.index + 1].to_documents()[0]
+
+    def __repr__(self) -> str:
+        return f"ResultRow(id={self.id!r}, document={self.document!r}, distance={self.distance!r})"
+
+
+@dataclass
+class ResultSet:
+    """Columnar documents or query results: ids, documents and metadata as object arrays, embeddings as one matrix.
+
+    Slicing returns a ResultSet of views of the same arrays, an int a ResultRow
+    view, and iterating yields ResultRows, so no per-row objects are built until
+    asked for. Metadata is a column array of dicts, or a dict of column arrays
+    (one per key, None where missing); `to_frame` builds a DataFrame of it once.
+    `to_documents` adapts to the Document and QueryResult dataclasses.
+
+    Args:
+        ids (np.ndarray): ids of the rows.
+        embeddings (np.ndarray, optional): (n, dim) float32 embeddings. Defaults to None.
+        documents (np.ndarray, optional): document texts. Defaults to None.
+        distances (np.ndarray, optional): query distances. Defaults to None.
+        metadatas (np.ndarray, optional): metadata dicts. Defaults to None.
+        columns (dict, optional): metadata column arrays by key, instead of metadatas. Defaults to None.
+    """
+
+    ids:np.ndarray
+    embeddings:np.ndarray = None
+    documents:np.ndarray = None
+    distances:np.ndarray = None
+    metadatas:np.ndarray = None
+    columns:dict = None
+
+    def __post_init__(self):
+        self.ids = object_array(self.ids)
+        if self.embeddings is not None:
+            embeddings = np.asarray(self.embeddings, dtype = np.float32)
+            self.embeddings = embeddings.reshape(len(self.ids), -1) if len(self.ids) else embeddings.reshape(0, 0)
+        if self.documents is not None:
+            self.documents = object_array(self.documents)
+        if self.distances is not None:
+            self.distances = np.asarray(self.distances, dtype = np.float64)
+        if self.metadatas is not None:
+            self.metadatas = object_array(self.metadatas)
+        if self.columns is not None:
+            self.columns = {key: object_array(column) for key, column in self.columns.items()}
+        self._frame = None
+
+    @classmethod
+    def from_get(cls, rst:dict):
+        """ResultSet of a `Collection.get` result"""
+        return cls(ids = rst['ids'], embeddings = rst.get('embeddings'), documents = rst.get('documents'),
+                   metadatas = rst.get('metadatas'))
+
+    @classmethod
+    def from_query(cls, rst:dict) -> List["ResultSet"]:
+        """ResultSet of every query of a `Collection.query` result"""
+        def field(key, q):
+            return None if rst.get(key) is None else rst[key][q]
+
+        return [cls(ids = ids, embeddings = field('embeddings', q), documents = field('documents', q),
+                    distances = field('distances', q), metadatas = field('metadatas', q))
+                for q, ids in enumerate(rst['ids'])]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[ResultRow]:
+        return (ResultRow(self, i) for i in range(len(self)))
+
+    def __getitem__(self, key) -> Union[ResultRow, "ResultSet"]:
+        """A ResultRow for an int, otherwise a ResultSet of the rows, views for a slice"""
+        if isinstance(key, (int, np.integer)):
+            return ResultRow(self, range(len(self))[key])
+
+        def take(column):
+            return None if column is None else column[key]
+
+        return ResultSet(ids = self.ids[key], embeddings = take(self.embeddings), documents = take(self.documents),
+                         distances = take(self.distances), metadatas = take(self.metadatas),
+                         columns = None if self.columns is None else {k: v[key] for k, v in self.columns.items()})
+
+    def metadata(self, i:int) -> dict:
+        if self.columns is not None:
+            return {key: column[i] for key, column in self.columns.items() if column[i] is not None}
+        return None if self.metadatas is None else self.metadatas[i]
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame of ids, documents, distances and one column per metadata key, built once"""
+        if self._frame is None:
+            if self.columns is not None:
+                frame = pd.DataFrame(self.columns)
+            elif self.metadatas is not None:
+                frame = pd.DataFrame.from_records([metadata or {} for metadata in self.metadatas])
+            else:
+                frame = pd.DataFrame(index = range(len(self)))
+            fields = {"id": self.ids, "document": self.documents, "distance": self.distances}
+            for i, (name, column) in enumerate((name, column) for name, column in fields.items() if column is not None):
+                frame.insert(i, name, column)
+            self._frame = frame
+        return self._frame
+
+    def to_documents(self, cls:type = None) -> List[Document]:
+        """Dataclasses of the rows, QueryResults when there are distances unless cls is given"""
+        if cls is None:
+            cls = Document if self.distances is None else QueryResult
+        n = len(self)
+        fields = {
+            "id": self.ids.tolist(),
+            "embedding": [None] * n if self.embeddings is None else self.embeddings.tolist(),
+            "metadata": [self.metadata(i) for i in range(n)] if self.columns is not None
+            else [None] * n if self.metadatas is None else self.metadatas.tolist(),
+            "document": [None] * n if self.documents is None else self.documents.tolist(),
+        }
+        if issubclass(cls, QueryResult):
+            fields["distance"] = [None] * n if self.distances is None else self.distances.tolist()
+        names = list(fields)
+        return [cls(**dict(zip(names, values))) for values in zip(*fields.values())]
+
+
+def query_dict(result_sets:List[ResultSet]) -> dict:
+    """`Collection.query` result of one ResultSet per query, the inverse of `ResultSet.from_query`"""
+    def field(name):
+        columns = [getattr(result_set, name) for result_set in result_sets]
+        return None if all(column is None for column in columns) else [
+            None if column is None else column.tolist() for column in columns]
+
+    metadatas = None if all(rs.metadatas is None and rs.columns is None for rs in result_sets) else [
+        [rs.metadata(i) for i in range(len(rs))] for rs in result_sets]
+    return {"ids": [result_set.ids.tolist() for result_set in result_sets], "embeddings": field("embeddings"),
+            "documents": field("documents"), "metadatas": metadatas, "distances": field("distances")}
@@ -0,0 +1,124 @@
+from collections import Counter
+import time
+import numpy as np
+import pytest
+from nlp_toolkit.keywords import BM25Model, Tokenizer
+
+# the tokenizer strips digits, so words are numbered in letters
+VOCABULARY = ["word" + str(i).translate(str.maketrans("0123456789", "abcdefghij")) for i in range(300)]
+
+
+def make_texts(n:int, seed:int, min_len:int = 1, max_len:int = 30) -> list:
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, len(VOCABULARY) + 1)
+    return [" ".join(rng.choice(VOCABULARY, size = rng.integers(min_len, max_len), p = weights / weights.sum()))
+            for _ in range(n)]
+
+
+@pytest.fixture(scope = "module")
+def model():
+    documents = make_texts(2000, seed = 0)
+    model = BM25Model(k1 = 1.5, b = 0.75, tokenizer = Tokenizer(offline = True))
+    model.fit(documents)
+    model.remove_documents(list(model.ids)[::5])
+    model.add_documents(documents[:100])
+    return model
+
+
+@pytest.mark.parametrize("n", [1, 10, 50])
+def test_search_batch_matches_search(model, n):
+    # empty, out-of-vocabulary and single rare term queries match fewer than n documents
+    queries = make_texts(100, seed = 1, min_len = 0, max_len = 5) + ["", "unknown", VOCABULARY[-1]]
+    ids, scores = model.search_batch(queries, n = n)
+    assert len(ids) == len(queries) and scores.shape == (len(queries), n)
+    for q, query in enumerate(queries):
+        assert len(set(ids[q])) == n
+        positions = model._id_positions(ids[q])
+        assert not model.deleted[positions].any()
+        expected = model.search(query, n = n, exhaustive = True)
+        np.testing.assert_allclose(scores[q], expected["scores"], rtol = 1e-9)
+        exact = model._score_query(model.tokenizer.tokenize_doc(query))
+        np.testing.assert_allclose(exact[positions], scores[q], rtol = 1e-9)
+
+
+def best_time(fn, repeats:int = 3) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def test_search_batch_is_not_slower_than_a_search_loop():
+    model = BM25Model(k1 = 1.5, b = 0.75, tokenizer = Tokenizer(offline = True)).fit(
+        make_texts(20000, seed = 4, min_len = 20, max_len = 60))
+    queries = make_texts(200, seed = 5, min_len = 2, max_len = 6)
+    batch = best_time(lambda: model.search_batch(queries, n = 10))
+    loop = best_time(lambda: [model.search(query, n = 10) for query in queries])
+    # some slack for timing noise, the batch shares tokenization and term lookups and should be faster
+    assert batch <= 1.2 * loop, f"search_batch took {batch:.3f}s, a loop over search {loop:.3f}s"
+
+
+class BruteForceBM25:
+    """BM25 from Counters of the tokens of the live documents of a model"""
+
+    def __init__(self, model):
+        self.model = model
+        live = [Counter(model.tokenizer.tokenize_doc(model.documents[i])) for i in np.flatnonzero(~model.deleted)]
+        self.n_docs = len(live)
+        self.avg_doc_len = sum(sum(doc.values()) for doc in live) / len(live)
+        self.doc_freqs = Counter(term for doc in live for term in doc)
+
+    def scores(self, query:str, texts:list) -> np.ndarray:
+        k1, b = self.model.k1, self.model.b
+        scores = []
+        for tokens in self.model.tokenizer.tokenize_batch(list(texts)):
+            counts = Counter(tokens)
+            score = 0.0
+            for term in self.model.tokenizer.tokenize_doc(query):
+                df = self.doc_freqs[term]
+                idf = np.log((self.n_docs - df + 0.5) / (df + 0.5) + 1)
+                tf = counts[term]
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / self.avg_doc_len))
+            scores.append(score)
+        return np.asarray(scores)
+
+
+def test_scores_match_brute_force(model):
+    brute_force = BruteForceBM25(model)
+    live = np.flatnonzero(~model.deleted)
+    live_ids = [model.ids[i] for i in live]
+    live_texts = [model.documents[i] for i in live]
+    removed_id = model.ids[int(np.flatnonzero(model.deleted)[0])]
+    for query in make_texts(20, seed = 2, min_len = 1, max_len = 6) + [VOCABULARY[0] + " " + VOCABULARY[0]]:
+        expected = brute_force.scores(query, live_texts)
+        by_id = dict(zip(live_ids, expected))
+        for exhaustive in (True, False):
+            hits = model.search(query, n = 10, exhaustive = exhaustive)
+            np.testing.assert_allclose(hits["scores"], np.sort(expected)[::-1][:10], rtol = 1e-9, atol = 1e-12)
+            np.testing.assert_allclose([by_id[id_] for id_ in hits["ids"]], hits["scores"], rtol = 1e-9, atol = 1e-12)
+
+        scores = model.score_candidates(query, ids = live_ids[:50] + [removed_id])
+        np.testing.assert_allclose(scores[:-1], expected[:50], rtol = 1e-9, atol = 1e-12)
+        assert scores[-1] == -np.inf
+        texts = make_texts(5, seed = 3) + [query]
+        np.testing.assert_allclose(model.score_candidates(query, texts = texts),
+                                   brute_force.scores(query, texts), rtol = 1e-9, atol = 1e-12)
+        assert model.get_score(query, live_texts[0]) == pytest.approx(expected[0], rel = 1e-9, abs = 1e-12)
+
+
+def test_add_documents_rejects_taken_ids():
+    model = BM25Model(k1 = 1.5, b = 0.75, tokenizer = Tokenizer(offline = True)).fit(["worda wordb", "wordc"], ids = ["a", "b"])
+    with pytest.raises(ValueError, match = "already indexed"):
+        model.add_documents(["wordd", "worde"], ids = ["c", "a"])
+    with pytest.raises(ValueError, match = "Duplicate"):
+        model.add_documents(["wordd", "worde"], ids = ["c", "c"])
+    assert model.n_docs == 2 and len(model.ids) == 2
+
+    # a removed id can be indexed again, and removed again
+    model.remove_documents(["a"])
+    model.add_documents(["wordd"], ids = ["a"])
+    assert model.search("wordd", n = 1)["ids"] == ["a"]
+    model.remove_documents(["a"])
+    assert model.n_docs == 1 and model.search("worda wordd", n = 1)["scores"] == [0.0]
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from nlp_toolkit.vectordbs.chroma import ChromaCrud, insert_df_collection
+from nlp_toolkit.vectordbs.ingest import metadata_dicts
+
+
+class RecordingCollection:
+    name = "fake"
+
+    def __init__(self):
+        self.added = []
+
+    def add(self, **params):
+        self.added.append(params)
+
+
+def test_missing_values_are_dropped():
+    columns = {"score": [1.5, np.nan, None], "when": [pd.Timestamp("2024-01-01"), pd.NaT, pd.Timestamp("2024-01-02")],
+               "tags": [["a"], ["b"], None]}
+    assert metadata_dicts(columns, 3) == [
+        {"score": 1.5, "when": pd.Timestamp("2024-01-01"), "tags": ["a"]},
+        {"tags": ["b"]},
+        {"when": pd.Timestamp("2024-01-02")},
+    ]
+
+
+def frame() -> pd.DataFrame:
+    return pd.DataFrame({"id": [1, 2], "text": ["a", "b"], "score": [0.5, np.nan], "tag": ["x", "y"]})
+
+
+def test_insert_df_collection_timestamps_only_without_meta_cols():
+    collection = RecordingCollection()
+    insert_df_collection(collection, None, frame(), doc_col = "text", id_col = "id")
+    insert_df_collection(collection, None, frame(), doc_col = "text", id_col = "id", meta_cols = ["tag"])
+    insert_df_collection(collection, None, frame(), doc_col = "text", id_col = "id", meta_cols = ["tag", "update_time"])
+    everything, tag_only, tag_and_update = [params["metadatas"] for params in collection.added]
+
+    assert [sorted(metadata) for metadata in everything] == [
+        ["create_time", "score", "tag", "update_time"], ["create_time", "tag", "update_time"]]
+    assert tag_only == [{"tag": "x"}, {"tag": "y"}]
+    assert [sorted(metadata) for metadata in tag_and_update] == [["tag", "update_time"]] * 2
+
+
+def test_insert_dataframe_leaves_the_dataframe_and_drops_nan():
+    collection = RecordingCollection()
+    df = frame()
+    ChromaCrud(collection).insert_dataframe(df, id_col = "id", meta_cols = ["score", "tag"])
+    assert collection.added[0]["metadatas"] == [{"score": 0.5, "tag": "x"}, {"tag": "y"}]
+    assert list(df.columns) == ["id", "text", "score", "tag"]
@@ -0,0 +1,68 @@
+from nlp_toolkit.cache import ResultCache
+from nlp_toolkit.vectordbs.chroma import ChromaCrud
+
+
+def test_invalidate_during_compute_is_not_served(tmp_path):
+    for cache in (ResultCache(), ResultCache(path = str(tmp_path / "cache.sqlite3"))):
+        def compute():
+            # the data changes while the result is computed from the old data
+            cache.invalidate("ns")
+            return "stale"
+
+        assert cache.get_or_compute("ns", "q", compute) == "stale"
+        assert cache.get("ns", "q") is None
+        assert cache.get_or_compute("ns", "q", lambda: "fresh") == "fresh"
+        assert cache.get("ns", "q") == "fresh"
+
+
+class InvalidatingCollection:
+    """Collection whose query invalidates the crud's cache, like an add from another thread"""
+
+    name = "fake"
+
+    def __init__(self):
+        self.crud = None
+        self.calls = 0
+
+    def query(self, query_texts = None, n_results = 10, where = None, include = ()):
+        self.calls += 1
+        self.crud._invalidate_cache()
+        return {"ids": [[f"{text}-{self.calls}"] for text in query_texts], "distances": [[0.0] for _ in query_texts]}
+
+
+def test_query_result_sets_does_not_cache_across_invalidation():
+    collection = InvalidatingCollection()
+    crud = ChromaCrud(collection, cache = ResultCache())
+    collection.crud = crud
+    first = crud.query_batch(["a"], n_results = 1)
+    second = crud.query_batch(["a"], n_results = 1)
+    assert collection.calls == 2
+    assert first[0][0].id == "a-1" and second[0][0].id == "a-2"
+
+
+def test_bm25_models_sharing_a_cache_keep_their_results_apart(tmp_path):
+    from nlp_toolkit.keywords import BM25Model, Tokenizer
+
+    cache = ResultCache(path = str(tmp_path / "cache.sqlite3"))
+    def model(documents):
+        return BM25Model(k1 = 1.5, b = 0.75, tokenizer = Tokenizer(offline = True), cache = cache).fit(documents)
+    a, b = model(["apple pie", "pear tart"]), model(["apple juice", "plum jam"])
+    assert a.search("apple", n = 1)["documents"] == ["apple pie"]
+    assert b.search("apple", n = 1)["documents"] == ["apple juice"]
+
+    # a change of b leaves the results of a cached
+    hits = cache.stats.hits
+    b.add_documents(["apple cider"])
+    assert a.search("apple", n = 1)["documents"] == ["apple pie"]
+    assert cache.stats.hits == hits + 1
+
+    # processes loading the same dump share results, until one of them changes its corpus
+    a.dump(str(tmp_path / "a"))
+    first = BM25Model.load(str(tmp_path / "a"), cache = cache)
+    second = BM25Model.load(str(tmp_path / "a"), cache = ResultCache(path = str(tmp_path / "cache.sqlite3")))
+    assert first.cache_namespace == second.cache_namespace
+    first.search("pie", n = 1)
+    assert second.search("pie", n = 1)["documents"] == ["apple pie"] and second.cache.stats.hits == 1
+    first.add_documents(["cherry pie pie pie"])
+    assert first.search("pie", n = 1)["documents"] == ["cherry pie pie pie"]
+    assert second.search("pie", n = 1)["documents"] == ["apple pie"]
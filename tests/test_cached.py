@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from nlp_toolkit.embedders.cached import CachedEmbedder, model_id_of
+from nlp_toolkit.embedders.compact import CompactEmbedder
+from nlp_toolkit.embedders.server import EmbeddingClient
+
+
+def ones(texts):
+    return np.ones((len(texts), 4), dtype = np.float32)
+
+
+def twos(texts):
+    return np.full((len(texts), 4), 2, dtype = np.float32)
+
+
+def test_model_ids_tell_embedders_apart():
+    with pytest.raises(ValueError, match = "model_id"):
+        CachedEmbedder(ones, "unused")
+    assert model_id_of(EmbeddingClient("http://x:1")) != model_id_of(EmbeddingClient("http://y:2"))
+    assert model_id_of(CompactEmbedder(EmbeddingClient("http://x:1"), dtype = "float16")) != \
+        model_id_of(CompactEmbedder(EmbeddingClient("http://x:1"), dtype = "int8"))
+
+
+def test_shared_cache_keeps_models_apart(tmp_path):
+    first = CachedEmbedder(ones, str(tmp_path), model_id = "ones")
+    second = CachedEmbedder(twos, str(tmp_path), model_id = "twos")
+    assert (first(["a", "b"]) == 1).all()
+    assert (second(["a", "b"]) == 2).all()
+    assert (first(["a"]) == 1).all() and first.stats.hits == 1
+
+
+def test_entries_stay_under_max_entries(tmp_path):
+    cache = CachedEmbedder(ones, str(tmp_path), model_id = "ones", max_entries = 5)
+    texts = [f"text {i}" for i in range(10)]
+    assert cache(texts).shape == (10, 4)
+    assert len(cache) == 5
+    evictions = cache.stats.evictions
+    cache(["other"])
+    assert len(cache) == 5 and cache.stats.evictions == evictions + 1
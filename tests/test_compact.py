@@ -0,0 +1,31 @@
+import numpy as np
+from nlp_toolkit.embedders.compact import CompactEmbedder, QuantizedEmbeddings
+
+
+def embed(texts):
+    return np.random.default_rng(len(texts)).standard_normal((len(texts), 16)).astype(np.float32)
+
+
+def test_int8_call_returns_dequantized_float32():
+    embedder = CompactEmbedder(embed, dtype = "int8", dim = 8)
+    texts = ["a", "b", "c"]
+    embeddings = embedder(texts)
+    assert isinstance(embeddings, np.ndarray) and embeddings.dtype == np.float32 and embeddings.shape == (3, 8)
+
+    compressed = embedder.compress(embed(texts))
+    assert isinstance(compressed, QuantizedEmbeddings) and compressed.codes.dtype == np.int8
+    np.testing.assert_array_equal(embeddings, compressed.dequantize())
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis = 1), 1, atol = 0.02)
+
+
+def test_float_dtypes_are_kept():
+    for dtype in ("float32", "float16"):
+        embeddings = CompactEmbedder(embed, dtype = dtype)(["a", "b"])
+        assert isinstance(embeddings, np.ndarray) and embeddings.dtype == dtype
+
+
+def test_embed_compressed_keeps_int8():
+    embedder = CompactEmbedder(embed, dtype = "int8", dim = 8)
+    compressed = embedder.embed_compressed(["a", "b", "c"])
+    assert isinstance(compressed, QuantizedEmbeddings) and compressed.nbytes == 3 * 8 + 3 * 4
+    np.testing.assert_array_equal(np.asarray(compressed), embedder(["a", "b", "c"]))
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nlp_toolkit.embedders.huggingface import SentenceEmbedder
+
+TINY_MODEL = "hf-internal-testing/tiny-random-bert"
+TEXTS = [("a text about music " * (i % 7 + 1)).strip() for i in range(40)]
+
+
+@pytest.mark.parametrize("max_tokens", [None, 64])
+def test_workers_match_a_single_process_at_the_same_thread_count(max_tokens):
+    if torch.cuda.is_available():
+        pytest.skip("workers would embed on the gpu")
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        single = SentenceEmbedder(TINY_MODEL, batch_size = 8, max_tokens = max_tokens)
+        expected = single(TEXTS)
+        expected_sentences = single.embed_sentences(TEXTS[:3])
+    finally:
+        torch.set_num_threads(threads)
+
+    with SentenceEmbedder(TINY_MODEL, batch_size = 8, max_tokens = max_tokens, workers = 2,
+                          threads_per_worker = 1) as embedder:
+        assert np.array_equal(embedder(TEXTS), expected)
+        # the model lives in the workers, direct calls go through them too
+        assert np.array_equal(embedder.embed_sentences(TEXTS[:3]), expected_sentences)
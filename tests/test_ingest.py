@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+from nlp_toolkit.vectordbs.ingest import IngestPipeline
+
+
+class FakeCollection:
+    """Rows by id, add keeps duplicates like a collection given new random ids would"""
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, ids, documents, metadatas, embeddings):
+        self.rows.extend(zip(ids, documents, metadatas))
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        written = dict(zip(ids, zip(ids, documents, metadatas)))
+        self.rows = [written.pop(row[0], row) for row in self.rows] + list(written.values())
+
+
+def embed(documents):
+    return np.ones((len(documents), 4), dtype = np.float32)
+
+
+class Crash(Exception):
+    pass
+
+
+def test_resume_after_crash_before_checkpoint_does_not_duplicate(tmp_path):
+    records = pd.DataFrame({"id": range(10), "text": [f"doc {i}" for i in range(10)], "tag": ["a"] * 10})
+    collection = FakeCollection()
+    checkpoint_path = tmp_path / "checkpoint.json"
+    pipeline = IngestPipeline(collection, embed, id_col = "id", batch_size = 4, checkpoint_path = checkpoint_path)
+
+    save_checkpoint = pipeline.save_checkpoint
+    def crash_on_second_batch(stats):
+        if stats.batches == 2:
+            raise Crash()
+        save_checkpoint(stats)
+    pipeline.save_checkpoint = crash_on_second_batch
+    with pytest.raises(Crash):
+        pipeline.run(records)
+    # the second batch was written but not committed
+    assert len(collection.rows) == 8
+
+    stats = IngestPipeline(collection, embed, id_col = "id", batch_size = 4, checkpoint_path = checkpoint_path).run(records)
+    assert stats.resumed_batches == 1
+    assert sorted(row[0] for row in collection.rows) == sorted(str(i) for i in range(10))
+
+
+def test_checkpoint_needs_ids(tmp_path):
+    with pytest.raises(ValueError, match = "id_col"):
+        IngestPipeline(FakeCollection(), embed, checkpoint_path = tmp_path / "checkpoint.json")
+
+
+def test_missing_metadata_values_are_dropped():
+    collection = FakeCollection()
+    records = [{"text": "a", "tag": "x", "score": None}, {"text": "b", "tag": None, "score": 1}]
+    IngestPipeline(collection, embed).run(records)
+    metadatas = [row[2] for row in collection.rows]
+    assert [{key: value for key, value in metadata.items() if not key.endswith("_time")} for metadata in metadatas] == [
+        {"tag": "x"}, {"score": 1}]
+
+
+def test_timestamps_follow_meta_cols():
+    records = [{"text": "a", "tag": "x"}]
+    collection = FakeCollection()
+    IngestPipeline(collection, embed, meta_cols = ["tag"]).run(records)
+    assert collection.rows[0][2] == {"tag": "x"}
+
+    collection = FakeCollection()
+    IngestPipeline(collection, embed, meta_cols = ["tag", "update_time"]).run(records)
+    assert set(collection.rows[0][2]) == {"tag", "update_time"}
+
+
+def test_metadata_keys_of_later_records_are_kept():
+    collection = FakeCollection()
+    records = [{"text": "a", "tag": "x"}, {"text": "b", "score": 1}]
+    IngestPipeline(collection, embed).run(records)
+    metadatas = [row[2] for row in collection.rows]
+    assert [{key: value for key, value in metadata.items() if not key.endswith("_time")} for metadata in metadatas] == [
+        {"tag": "x"}, {"score": 1}]
+
+
+def test_resume_skips_committed_batches_at_the_source(tmp_path, monkeypatch):
+    records = pd.DataFrame({"id": range(10), "text": [f"doc {i}" for i in range(10)]})
+    checkpoint_path = tmp_path / "checkpoint.json"
+    checkpoint_path.write_text('{"batches": 2, "records": 8, "batch_size": 4}')
+    to_dict_rows = []
+    to_dict = pd.DataFrame.to_dict
+    def counting_to_dict(df, *args, **kwargs):
+        to_dict_rows.append(len(df))
+        return to_dict(df, *args, **kwargs)
+    monkeypatch.setattr(pd.DataFrame, "to_dict", counting_to_dict)
+
+    collection = FakeCollection()
+    stats = IngestPipeline(collection, embed, id_col = "id", batch_size = 4, checkpoint_path = checkpoint_path).run(records)
+    assert to_dict_rows == [2]
+    assert [row[0] for row in collection.rows] == ["8", "9"] and stats.records == 10
+
+    generated = []
+    def generate():
+        for i in range(10):
+            generated.append(i)
+            yield {"id": i, "text": f"doc {i}"}
+    checkpoint_path.write_text('{"batches": 2, "records": 8, "batch_size": 4}')
+    collection = FakeCollection()
+    IngestPipeline(collection, embed, id_col = "id", batch_size = 4, checkpoint_path = checkpoint_path).run(generate())
+    assert [row[0] for row in collection.rows] == ["8", "9"] and generated == list(range(10))
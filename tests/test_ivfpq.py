@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from nlp_toolkit.vectordbs.ivfpq import IVFPQIndex, cluster_sums
+
+
+def make_vectors(n:int, dim:int = 32, seed:int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # low intrinsic dimension, like embeddings
+    return (rng.standard_normal((n, 4)) @ rng.standard_normal((4, dim)) + 0.1 * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def reference_search(index:IVFPQIndex, queries:np.ndarray, k:int, nprobe:int, allowed:np.ndarray = None):
+    """One query at a time, distances to the decoded vectors of the probed lists"""
+    queries = index._prepare(queries)
+    lists = np.repeat(np.arange(index.n_lists), np.diff(index.list_indptr))
+    decoded = index.centroids[lists] + index._decode(index.codes)
+    results = []
+    for query in queries:
+        if index.metric == "l2":
+            coarse = np.sum((index.centroids - query) ** 2, axis = 1)
+        else:
+            coarse = -index.centroids @ query
+        probed = np.isin(lists, np.argsort(coarse)[:nprobe])
+        if allowed is not None:
+            probed &= allowed[index.rows]
+        candidates = np.flatnonzero(probed)
+        if index.metric == "l2":
+            distances = np.sum((decoded[candidates] - query) ** 2, axis = 1)
+        else:
+            distances = 1 - decoded[candidates] @ query
+        order = np.argsort(distances, kind = "stable")[:k]
+        results.append((index.rows[candidates[order]].astype(np.int64), distances[order]))
+    return results
+
+
+@pytest.fixture(scope = "module")
+def vectors():
+    return make_vectors(3000)
+
+
+@pytest.mark.parametrize("metric", ["cosine", "ip", "l2"])
+@pytest.mark.parametrize("max_candidates", [1, 500, 2 ** 16])
+def test_search_matches_reference(vectors, metric, max_candidates):
+    index = IVFPQIndex(n_lists = 16, m = 8, metric = metric, n_iter = 5).train(vectors)
+    index.add(vectors)
+    queries = vectors[:40] + 0.01
+    allowed = np.random.default_rng(1).random(len(vectors)) < 0.02
+    for kwargs, k in [({}, 10), ({"allowed": allowed}, 20)]:
+        rows, distances = index.search(queries, k = k, nprobe = 3, max_candidates = max_candidates, **kwargs)
+        for q, (expected_rows, expected_distances) in enumerate(reference_search(index, queries, k, 3, **kwargs)):
+            found = len(expected_rows)
+            np.testing.assert_allclose(distances[q, :found], expected_distances, rtol = 1e-4, atol = 1e-4)
+            assert (rows[q, found:] == -1).all() and np.isinf(distances[q, found:]).all()
+            # rows may only differ between tied distances
+            assert set(rows[q, :found]) == set(expected_rows) or np.allclose(
+                np.sort(distances[q, :found]), np.sort(expected_distances), rtol = 1e-5)
+
+
+def test_rerank_returns_exact_distances(vectors):
+    index = IVFPQIndex(n_lists = 16, m = 8, metric = "l2", n_iter = 5).train(vectors)
+    index.add(vectors)
+    queries = vectors[:20]
+    rows, distances = index.search(queries, k = 5, nprobe = 16, rerank = 50, vectors = vectors, max_candidates = 1000)
+    exact = np.sum((vectors[rows] - queries[:, None, :]) ** 2, axis = 2)
+    np.testing.assert_allclose(distances, exact, rtol = 1e-4, atol = 1e-4)
+    assert (rows[:, 0] == np.arange(len(queries))).all()
+
+
+def test_cluster_sums():
+    x = make_vectors(1000, dim = 12)
+    labels = np.random.default_rng(0).integers(0, 7, len(x))
+    expected = np.stack([x[labels == label].sum(axis = 0) for label in range(7)])
+    np.testing.assert_allclose(cluster_sums(x, labels, 7, max_cells = 100), expected, rtol = 1e-5, atol = 1e-4)
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+HEAVY_MODULES = ["torch", "transformers", "pandas", "chromadb"]
+
+# records import attempts too, so the test means something where these are not installed
+SCRIPT = f"""
+import sys
+
+HEAVY_MODULES = {HEAVY_MODULES!r}
+attempted = []
+
+class RecordHeavyImports:
+    def find_spec(self, name, path = None, target = None):
+        if name in HEAVY_MODULES:
+            attempted.append(name)
+        return None
+
+sys.meta_path.insert(0, RecordHeavyImports())
+
+import nlp_toolkit
+nlp_toolkit.keywords.BM25Model
+
+loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+assert not loaded and not attempted, f"loaded {{loaded}}, attempted {{attempted}}"
+"""
+
+
+def test_bm25_import_does_not_load_heavy_dependencies():
+    root = Path(__file__).resolve().parents[1]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(root), os.environ.get("PYTHONPATH", "")])}
+    result = subprocess.run([sys.executable, "-c", SCRIPT], cwd = root, env = env, capture_output = True, text = True)
+    assert result.returncode == 0, result.stderr
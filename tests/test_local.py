@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from nlp_toolkit.vectordbs.local import LocalVectorStore
+from nlp_toolkit.vectordbs.results import ResultSet
+
+
+def embed(texts):
+    # a fixed pseudo-random vector per text
+    return np.stack([np.random.default_rng(sum(map(ord, text))).standard_normal(8) for text in texts]).astype(np.float32)
+
+
+def make_store(path, embedder = embed) -> LocalVectorStore:
+    store = LocalVectorStore(str(path), embedder = embedder)
+    texts = [f"document {chr(97 + i)}" for i in range(20)]
+    store.add(ids = [str(i) for i in range(20)], embeddings = embed(texts), documents = texts,
+              metadatas = [{"i": i} if i % 2 else {} for i in range(20)])
+    return store
+
+
+@pytest.mark.parametrize("method", ["mean_seed_query", "concat_text_query"])
+def test_seed_queries_return_collection_query_results(tmp_path, method):
+    store = make_store(tmp_path)
+    result = getattr(store, method)(["1", "2"], n_results = 5)
+    assert set(result) == {"ids", "embeddings", "documents", "metadatas", "distances"}
+    assert result["embeddings"] is None
+    for key in ("ids", "documents", "metadatas", "distances"):
+        assert isinstance(result[key], list) and len(result[key]) == 1 and len(result[key][0]) == 5
+    assert all(isinstance(metadata, dict) for metadata in result["metadatas"][0])
+    assert result["distances"][0] == sorted(result["distances"][0])
+
+    [result_set] = ResultSet.from_query(result)
+    assert result_set.ids.tolist() == result["ids"][0]
+
+
+def test_text_queries_need_an_embedder(tmp_path):
+    store = make_store(tmp_path, embedder = None)
+    with pytest.raises(ValueError, match = "embedder is required"):
+        store.query_batch(["document a"])
+    with pytest.raises(ValueError, match = "embedder is required"):
+        store.concat_text_query(["1"])
+    # embeddings need no embedder
+    assert len(store.mean_seed_query(["1"], n_results = 3)["ids"][0]) == 3
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from nlp_toolkit.embedders.huggingface import SentenceEmbedder
+
+TINY_MODEL = "hf-internal-testing/tiny-random-bert"
+TEXTS = ["a short text", "a somewhat longer text about music and how songs are composed",
+         "another one", "the last text of the batch, padded the least"]
+
+
+def test_onnx_embeddings_agree_with_torch():
+    torch_embedder = SentenceEmbedder(TINY_MODEL, backend = "torch")
+    torch_embedder.device = "cpu"
+    torch_embedder.model.to("cpu")
+    reference = torch_embedder(TEXTS)
+    embeddings = SentenceEmbedder(TINY_MODEL, backend = "onnx")(TEXTS)
+    assert embeddings.shape == reference.shape
+    # embeddings are L2 normalized
+    assert np.sum(embeddings * reference, axis = 1).min() > 0.99
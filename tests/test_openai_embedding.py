@@ -0,0 +1,94 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import json
+import threading
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("tenacity")
+
+from tenacity import wait_none
+from nlp_toolkit.embedders.openai_embedding import OpenAIEmbedding, RateLimiter, estimate_tokens
+
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    """/v1/embeddings of an OpenAI-compatible server: 429 on the first attempt of every
+    batch, then embeddings [i, len(text)] of texts "text i", listed in reverse order.
+    Earlier batches answer later, so threads finish out of order."""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"]
+        with self.server.lock:
+            self.server.attempts.append(texts)
+            first_attempt = self.server.attempts.count(texts) == 1
+        if first_attempt:
+            return self.reply(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit"}})
+        time.sleep(max(0, 60 - int(texts[0].split()[1])) / 600)
+        data = []
+        for index, text in reversed(list(enumerate(texts))):
+            embedding = np.asarray([int(text.split()[1]), len(text)], dtype = np.float32)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(embedding.tobytes()).decode("ascii")
+            else:
+                embedding = embedding.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        self.reply(200, {"object": "list", "data": data, "model": body["model"],
+                         "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    def reply(self, status:int, payload:dict):
+        content = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAI)
+    server.lock, server.attempts = threading.Lock(), []
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_batches_retries_and_order(server):
+    embedder = OpenAIEmbedding(model = "fake-embedding", api_key = "key",
+                               base_url = f"http://127.0.0.1:{server.server_address[1]}/v1",
+                               max_batch_size = 7, max_batch_tokens = 40, max_workers = 4,
+                               requests_per_minute = 6000)
+    embedder._create = embedder._create.retry_with(wait = wait_none())
+    acquired, acquire = [], embedder.rate_limiter.acquire
+    embedder.rate_limiter.acquire = lambda tokens: acquired.append(tokens) or acquire(tokens)
+    texts = [f"text {i} " + "word " * (i % 5) for i in range(60)]
+
+    embeddings = np.asarray(embedder(texts))
+    np.testing.assert_array_equal(embeddings, [[i, len(text)] for i, text in enumerate(texts)])
+
+    # one rate limited and one successful attempt per batch
+    batches = [batch for i, batch in enumerate(server.attempts) if batch not in server.attempts[:i]]
+    assert all(server.attempts.count(batch) == 2 for batch in batches) and len(batches) > 1
+    assert sorted(text for batch in batches for text in batch) == sorted(texts)
+    n_tokens = dict(zip(texts, estimate_tokens(texts, embedder.model)))
+    for batch in batches:
+        assert len(batch) <= 7
+        assert len(batch) == 1 or sum(n_tokens[text] for text in batch) <= 40
+    # every attempt, retries included, took a request from the limiter
+    assert len(acquired) == len(server.attempts)
+
+
+def test_rate_limiter_waits_for_the_token_budget():
+    limiter = RateLimiter(tokens_per_minute = 600)
+    limiter.acquire(600)
+    start = time.monotonic()
+    limiter.acquire(5)
+    assert time.monotonic() - start >= 0.4
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from nlp_toolkit.keywords import BM25Model, ShardedBM25, Tokenizer
+
+# the tokenizer strips digits, so words are numbered in letters
+VOCABULARY = ["word" + str(i).translate(str.maketrans("0123456789", "abcdefghij")) for i in range(150)]
+QUERIES = ["wordb wordc", "wordd", "wordba wordbb wordbc wordbd", "wordbej worda worda", "wordhh nothing"]
+
+
+def make_documents(n:int, seed:int) -> list:
+    rng = np.random.default_rng(seed)
+    # a skewed word distribution, so terms have very different document frequencies
+    weights = 1 / np.arange(1, len(VOCABULARY) + 1)
+    return [" ".join(rng.choice(VOCABULARY, size = rng.integers(3, 40), p = weights / weights.sum()))
+            for _ in range(n)]
+
+
+def assert_same_hits(ids, scores, expected_ids, expected_scores):
+    """Same scores, and the same ids except for the order of tied scores"""
+    np.testing.assert_allclose(scores, expected_scores, rtol = 1e-9)
+    expected = dict(zip(expected_ids, expected_scores))
+    boundary = expected_scores[-1]
+    assert {id_ for id_, score in expected.items() if score > boundary} <= set(ids)
+    for id_, score in zip(ids, scores):
+        if score > boundary:
+            assert expected[id_] == pytest.approx(score, rel = 1e-9)
+
+
+def assert_parity(sharded:ShardedBM25, model:BM25Model, n:int = 10):
+    assert sharded.n_docs == model.n_docs
+    for query in QUERIES:
+        result, expected = sharded.search(query, n = n), model.search(query, n = n)
+        assert_same_hits(result["ids"], result["scores"], expected["ids"], expected["scores"])
+
+    ids, scores = sharded.search_batch(QUERIES, n = n)
+    expected_ids, expected_scores = model.search_batch(QUERIES, n = n)
+    for q in range(len(QUERIES)):
+        assert_same_hits(ids[q], scores[q], expected_ids[q], expected_scores[q])
+
+
+def test_sharded_matches_single_model(tmp_path):
+    tokenizer = Tokenizer(offline = True)
+    documents = make_documents(300, seed = 0)
+    ids = [f"doc-{i}" for i in range(len(documents))]
+    model = BM25Model(k1 = 1.5, b = 0.75, tokenizer = tokenizer).fit(documents, ids = ids)
+
+    with ShardedBM25(k1 = 1.5, b = 0.75, n_shards = 3, tokenizer = tokenizer) as sharded:
+        sharded.fit(documents, ids = ids)
+        assert_parity(sharded, model)
+
+        removed = ids[::7]
+        sharded.remove_documents(removed)
+        model.remove_documents(removed)
+        assert_parity(sharded, model)
+
+        added = make_documents(50, seed = 1)
+        added_ids = [f"new-{i}" for i in range(len(added))]
+        sharded.add_documents(added, ids = added_ids)
+        model.add_documents(added, ids = added_ids)
+        assert_parity(sharded, model)
+
+        sharded.compact()
+        model.compact()
+        assert_parity(sharded, model)
+        sharded.dump(str(tmp_path / "sharded"))
+
+    with ShardedBM25.load(str(tmp_path / "sharded")) as loaded:
+        assert_parity(loaded, model)
+
+
+def test_sharded_rejects_taken_ids_on_every_shard():
+    with ShardedBM25(k1 = 1.5, b = 0.75, n_shards = 3, tokenizer = Tokenizer(offline = True)) as sharded:
+        ids = [f"doc-{i}" for i in range(20)]
+        sharded.fit(make_documents(20, seed = 0), ids = ids)
+        with pytest.raises(ValueError, match = "already indexed"):
+            sharded.add_documents(make_documents(10, seed = 1), ids = [f"new-{i}" for i in range(9)] + ids[:1])
+        assert sharded.n_docs == 20